@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+"""
+plex-log-saver and plex-reporter in one: tails the plex log, saves it to our
+logs and prints done and live events as JSON lines as they happen. Events are
+also kept in logs/events.db. Needs python 3.
+
+Events are streamed locally too, see plex/stream.py. Set "event_api_port" to
+0 in logs/config.cfg to turn off the HTTP server, and "event_api_socket" to
+a path for a unix socket.
+
+Touch a file named __shutdown__ (or send SIGINT/SIGTERM) to stop it.
+"""
+
+import os
+## Uncomment the next line if you plan on using this script in the windows
+## task scheduler
+#os.chdir(os.path.dirname(os.path.abspath(__file__)))
+import sys
+import json
+import asyncio
+import logging
+
+from plex.lockfile import LockFile
+from plex.daemon import EventDaemon
+from plex.stream import EventStreamServer
+from plex.prefetch import MetadataPrefetcher
+from plex.aiomedia import AsyncPlexServerConnection
+from plex.store import EventStore
+from plex.util import config_load
+
+
+def print_event(kind, event):
+    print(json.dumps(
+        {'type': kind, 'event': event.to_dict()}, sort_keys=True))
+    sys.stdout.flush()
+
+
+def main():
+    logging.info('{0:#^40}'.format('[ Plex Event Daemon ]'))
+
+    if not os.path.isdir('logs'):
+        os.mkdir('logs')
+    config_file = os.path.join('logs', 'config.cfg')
+    config = config_load(config_file)
+
+    if config['plex_log_dir'] == '':
+        logging.info('Config missing "plex_log_dir", Exiting!')
+        print('Config missing "plex_log_dir", Exiting!')
+        return
+
+    daemon = EventDaemon(config_file, config)
+    store = EventStore(os.path.join('logs', 'events.db'))
+
+    daemon.events.subscribe(print_event)
+    daemon.events.subscribe(
+        lambda kind, event: store.upsert_events([event]))
+
+    if config['event_api_port'] or config['event_api_socket']:
+        daemon.services.append(EventStreamServer(
+            daemon.events,
+            host=config['event_api_host'],
+            port=config['event_api_port'] or None,
+            socket_path=config['event_api_socket'] or None))
+
+    if config['media_prefetch']:
+        daemon.services.append(MetadataPrefetcher(
+            daemon.events,
+            AsyncPlexServerConnection(
+                config['plex_server_host'], config['plex_server_port'],
+                batch_delay=config['media_prefetch_window'])))
+
+    try:
+        asyncio.run(daemon.run())
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        filename='plex-event-daemon.log',
+        level=logging.DEBUG)
+
+    try:
+        with LockFile():
+            main()
+    except Exception as err:
+        logging.exception(err)
+        raise
@@ -38,26 +38,11 @@ import logging
 from glob import glob as file_glob
 
 # Only import what is needed, don't need or want requests.
-from plex.util import BasketOfHandles, config_load, config_save, datetime_diff
+from plex.util import (
+    BasketOfHandles, ReorderBuffer, config_load, config_save, datetime_diff)
 from plex.lockfile import LockFile
-from plex.parser import PlexLogParser
-
-
-class PlexSuperLogParser(PlexLogParser):
-    def __init__(self, last_datetime, *args, **kwargs):
-        super(PlexSuperLogParser, self).__init__(**kwargs)
-        self.last_datetime = last_datetime
-
-    def line_body_filter(self, line_body):
-        # We don't want old records
-        if line_body['datetime'] <= self.last_datetime:
-            return False
-
-        # We don't want the useless lines following request lines.
-        if 'content' in line_body and line_body['content'].startswith(' *'):
-            return False
-
-        return super(PlexSuperLogParser, self).line_body_filter(line_body)
+from plex.dedup import LineIndex
+from plex.parser import PlexSuperLogParser, IngestFilter
 
 
 def main():
@@ -83,56 +68,110 @@ def main():
         log_open = open
 
     last_datetime = tuple(map(int, config['plex_last_datetime'].split('-')))
+    previous_datetime = last_datetime
+
+    # Lines already saved are looked up in the line index, the parser only
+    # has to drop what's older than the index goes back. Without an index
+    # anything up to the last saved line is taken as saved.
+    index_file = os.path.join('logs', 'lines.index')
+    line_index = LineIndex(config['log_dedup_window'])
+    if line_index.load(index_file) and line_index.floor() is not None:
+        cutoff = line_index.floor()
+    else:
+        cutoff = last_datetime
 
-    log_parser = PlexSuperLogParser(last_datetime)
+    ingest_filter = IngestFilter(config['ingest_filter'])
+    log_parser = PlexSuperLogParser(cutoff, ingest_filter=ingest_filter)
 
-    all_lines = []
+    # Lines are written as they come out of the reorder buffer, in order
+    # as long as they're no more than log_reorder_lateness seconds late.
+    # Compacted polls come out up to compact_idle late, so never less.
+    reorder = ReorderBuffer(
+        ingest_filter.reorder_lateness(config['log_reorder_lateness']))
 
     # We're only interested in 'Plex Media Server.log' log files
     # I've been able to so far get all of the info i need from those logs
     log_file_glob = os.path.join(
         config['plex_log_dir'], 'Plex Media Server.log*')
 
-    for log_file in file_glob(log_file_glob):
-        all_lines.extend(log_parser.parse_file(log_file))
+    # Oldest first, so the lines come mostly in order
+    log_files = sorted(file_glob(log_file_glob), key=os.path.getmtime)
+
+    def reorder_lines(lines):
+        for line_body in lines:
+            released = reorder.push(line_body, line_body['datetime'])
+            if released is not None:
+                for line in released:
+                    yield line
+
+    def ordered_lines():
+        for log_file in log_files:
+            for line_body in log_parser.iter_file(log_file):
+                # Dedup before sampling and compacting, so lines read again
+                # are dropped even if they were compacted away last time,
+                # and don't count towards the sampling.
+                if not line_index.add(line_body):
+                    continue
+                if not ingest_filter.sample(line_body):
+                    continue
+                for line in reorder_lines(ingest_filter.compact(line_body)):
+                    yield line
+
+        for line in reorder_lines(ingest_filter.flush()):
+            yield line
+        for line in reorder.flush():
+            yield line
+
+    counter = 0
+    first_datetime = None
+
+    ## TODO: replace this! No longer needed...
+    # BasketOfHandles handles our open files for us,
+    # keeping only 5 open at a time.
+    with BasketOfHandles(log_open, 5) as basket:
+        for line_body in ordered_lines():
+            if first_datetime is None:
+                first_datetime = line_body['datetime']
+            if line_body['datetime'] > last_datetime:
+                last_datetime = line_body['datetime']
+            counter += 1
+
+            log_file_name = log_file_template.format(**line_body)
+
+            file_handle = basket.open(log_file_name, 'at')
 
-    if len(all_lines) == 0:
+            json.dump(line_body, file_handle, sort_keys=True)
+            file_handle.write('\n')
+
+    if counter == 0:
         logging.info('No new lines, finishing.')
         return
 
-    # Sort the logs based on datetime
-    all_lines.sort(key=lambda line_body: line_body['datetime'])
-
-    time_diff = datetime_diff(all_lines[0]['datetime'], last_datetime)
+    time_diff = datetime_diff(first_datetime, previous_datetime)
 
     logging.info((
         '    Last entry last run:'
         ' {0:04d}-{1:02d}-{2:02d} {3:02d}:{4:02d}:{5:02d}').format(
-            *last_datetime))
+            *previous_datetime))
     logging.info((
         'Earliest entry this run:'
         ' {0:04d}-{1:02d}-{2:02d} {3:02d}:{4:02d}:{5:02d}').format(
-            *all_lines[0]['datetime']))
+            *first_datetime))
 
     if time_diff > 60:
         logging.warn((
             'Possibly missing {0} seconds of log files').format(time_diff))
 
-    logging.info('{0} new log lines added'.format(len(all_lines)))
-
-    ## TODO: replace this! No longer needed...
-    # BasketOfHandles handles our open files for us,
-    # keeping only 5 open at a time.
-    with BasketOfHandles(log_open, 5) as basket:
-        for line_body in all_lines:
-            log_file_name = log_file_template.format(**line_body)
+    if reorder.late > 0:
+        logging.warn((
+            'Dropped {0} lines more than {1} seconds out of order').format(
+                reorder.late, reorder.lateness / 1000.0))
 
-            file_handle = basket.open(log_file_name, 'at')
+    logging.info('{0} new log lines added'.format(counter))
 
-            json.dump(line_body, file_handle, sort_keys=True)
-            file_handle.write('\n')
-            if line_body['datetime'] > last_datetime:
-                last_datetime = line_body['datetime']
+    # The index first, if saving the config fails the lines are still
+    # known to be saved.
+    line_index.save(index_file)
 
     config['plex_last_datetime'] = '-'.join(map(str, last_datetime))
 
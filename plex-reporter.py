@@ -36,8 +36,12 @@ import itertools
 from glob import glob as file_glob
 
 from plex.lockfile import LockFile
-from plex.media import PlexServerConnection, plex_media_object_batch
+from plex.librarydb import media_connection
 from plex.event import EventParserController, LogLoader
+from plex.checkpoint import EventCheckpoint, DayCheckpoints
+from plex.store import EventStore
+from plex.cache import MetadataCache
+from plex.library import LibraryIndex
 from plex.util import config_load
 
 
@@ -49,16 +53,6 @@ except ImportError:
     import pickle
 
 
-def do_pickle(pickle_file, objs):
-    temp_file = pickle_file + '.tmp'
-    with open(temp_file, 'wb') as file_handle:
-        pickle.dump(objs, file_handle, 2)
-
-    if os.path.isfile(pickle_file):
-        os.remove(pickle_file)
-    os.rename(temp_file, pickle_file)
-
-
 def do_unpickle(pickle_file):
     if os.path.isfile(pickle_file):
         with open(pickle_file, 'rb') as file_handle:
@@ -84,52 +78,90 @@ def main():
 
     config_file = os.path.join('logs', 'config.cfg')
     pickle_file = os.path.join('logs', 'events.pickle')
+    journal_file = os.path.join('logs', 'events.journal')
+    checkpoint_dir = os.path.join('logs', 'checkpoints')
+    store_file = os.path.join('logs', 'events.db')
+    cache_file = os.path.join('logs', 'metadata.db')
+    library_file = os.path.join('logs', 'library.index')
 
     config = config_load(config_file)
 
     log_file_match = os.path.join('logs', config['log_file_match'])
 
-    conn = PlexServerConnection(
-        config['plex_server_host'], config['plex_server_port'])
+    metadata_cache = MetadataCache(cache_file)
+    conn = media_connection(config, cache=metadata_cache)
 
     ## Setup controller to keep 10 lines
-    debug_handle = open('debug.txt', 'wt')
+    checkpoint = EventCheckpoint(journal_file)
+    last_datetime, controller = checkpoint.load()
 
-    if os.path.isfile(pickle_file):
+    if controller is None and os.path.isfile(pickle_file):
+        ## Controllers used to be pickled, the next save moves it over.
         last_datetime, controller = do_unpickle(pickle_file)
-    else:
+
+    if controller is None:
         controller = EventParserController(10)
-        last_datetime = None
 
-    controller.debug_stream = debug_handle
-    controller.debug_keys = ['c1e289c8a2ad7c411c75333970a0ea83e0dda017']
+    controller.trace_unknown = True
+    controller.trace('c1e289c8a2ad7c411c75333970a0ea83e0dda017')
 
-    loader = LogLoader(controller, last_datetime=last_datetime, want_all=False)
+    ## Checkpoint each day, so tool-reprocess-events.py can start from there
+    day_checkpoints = DayCheckpoints(checkpoint_dir)
 
-    ## TODO: skip files based on last_datetime...
-    for log_file in file_glob(log_file_match):
+    def day_callback(last_datetime, next_datetime):
+        day_checkpoints.save(next_datetime, last_datetime, controller)
+
+    loader = LogLoader(controller, last_datetime=last_datetime, want_all=False,
+        day_callback=day_callback, lateness=config['log_reorder_lateness'])
+
+    ## Saved logs are named by date, so sorting keeps them in order
+    for log_file in sorted(file_glob(log_file_match)):
         loader.load_file(log_file)
+    loader.flush()
+
+    if loader.late > 0:
+        logging.warning('Dropped {0} lines that were out of order'.format(
+            loader.late))
 
     ## Dump state...
     done_events = controller.parse_dump(loader.last_datetime)
+    logging.info('Controller stats: {0}'.format(json.dumps(
+        controller.get_stats(), sort_keys=True)))
 
-    controller.debug_stream = None
-    controller.debug_keys = []
-    debug_handle.close()
+    controller.trace_unknown = False
+    controller.trace_keys.clear()
+    traces = controller.pop_traces()
 
-    do_pickle(pickle_file, (loader.last_datetime, controller))
+    checkpoint.save(loader.last_datetime, controller)
 
     live_events = controller.parse_flush()
-
-    ## Load event information...
-    if False:
-        media_keys = list(set([
-            event.media_key for event in (
-                itertools.chain(done_events, live_events))]))
-        media_keys.sort(key=lambda key: int(key))
-        media_objects = plex_media_object_batch(conn, media_keys)
-    else:
-        media_objects = {}
+    traces.extend(controller.pop_traces())
+
+    with open('debug.txt', 'wt') as debug_handle:
+        for trace in traces:
+            print(json.dumps(trace, sort_keys=True), file=debug_handle)
+
+    ## Load event information, from the local library snapshot, only what
+    ##   changed since the last sync is asked from the server, and only if
+    ##   that was a while ago. Now and then it's rebuilt to drop deletions.
+    library = LibraryIndex(source=conn)
+    library.load(library_file)
+    if conn.enabled and library.refresh(
+            conn, config['library_sync_minutes'] * 60,
+            config['library_full_sync_days'] * 86400) is not None:
+        library.save(library_file)
+
+    missing = 0
+    for event in itertools.chain(done_events, live_events):
+        event.media_object = library.get(event.media_key)
+        if event.media_object is None:
+            missing += 1
+    if missing > 0:
+        logging.warning('No library item for {0} events'.format(missing))
+
+    ## Live events are stored too, and get updated when they finish
+    with EventStore(store_file) as store:
+        store.upsert_events(done_events + live_events)
 
     done_events.sort(key=lambda event: event.start)
 
@@ -143,6 +175,9 @@ def main():
         for event in live_events:
             print(json.dumps(event.to_dict(), sort_keys=True))
 
+    ## The events' media objects load what they're missing through it
+    metadata_cache.close()
+
 if __name__ == '__main__':
     with LockFile() as lock_file:
         main()
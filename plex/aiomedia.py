@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+
+"""
+Media metadata lookups for asyncio code, like the event daemon, that never
+block the event loop. Python 3 only.
+
+AsyncPlexServerConnection is the counterpart of
+plex.media.PlexServerConnection's fetch() and fetch_metadata():
+
+    * At most concurrency requests are sent at once, over kept alive
+      connections.
+    * Concurrent fetches of the same path, or metadata for the same key,
+      share the one request (single flight).
+    * fetch_metadata() calls made within batch_delay seconds of each other
+      are sent as one library/metadata/k1,k2,... request of up to
+      batch_size keys.
+    * A batch is split up per key, so each key only keeps its own
+      metadata, and it's parsed the once (see fetch_metadata_document()).
+    * What's fetched is kept for the max_entries most recently used paths
+      and keys, of no more than max_bytes of xml each for the pages and the
+      metadata. It's the daemon's working set, not a copy of the library.
+
+It speaks just enough HTTP/1.1 to talk to the Plex Media Server, on top of
+asyncio streams, so it needs nothing outside the standard library.
+"""
+
+import asyncio
+import collections
+
+from plex.util import get_logger
+from plex.media import PlexServerException, MediaDocument, split_metadata
+
+
+class _HTTPConnectionPool(object):
+    """Kept alive HTTP/1.1 connections to one host, for GET requests."""
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = []
+
+    async def get(self, path):
+        """Returns (status, reason, text) for GET /path."""
+        while len(self.idle) > 0:
+            reader, writer = self.idle.pop()
+            try:
+                return await self._request(reader, writer, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed it while it was idle, try the next one.
+                writer.close()
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        return await self._request(reader, writer, path)
+
+    async def _request(self, reader, writer, path):
+        writer.write((
+            'GET /{path} HTTP/1.1\r\n'
+            'Host: {host}:{port}\r\n'
+            'Accept: */*\r\n'
+            'Connection: keep-alive\r\n'
+            '\r\n').format(
+                path=path, host=self.host, port=self.port).encode('latin-1'))
+        try:
+            await writer.drain()
+            version, status, reason, keep_alive, body = (
+                await asyncio.wait_for(
+                    self._read_response(reader), self.timeout))
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, reason, body.decode('utf-8')
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed')
+
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        version, status = parts[0], int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = (
+            version == 'HTTP/1.1' and
+            headers.get('connection', '').lower() != 'close')
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailers
+                    while (await reader.readline()) not in (
+                            b'\r\n', b'\n', b''):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return version, status, reason, keep_alive, bytes(body)
+
+    def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class _LRUCache(object):
+    """The max_entries most recently used values, max_bytes between them by
+    size(value), though the newest is always kept."""
+    def __init__(self, max_entries, max_bytes, size=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        old_value = self.entries.pop(key, None)
+        if old_value is not None:
+            self.bytes -= self.size(old_value)
+        self.entries[key] = value
+        self.bytes += self.size(value)
+
+        while len(self.entries) > 1 and (
+                len(self.entries) > self.max_entries or
+                self.bytes > self.max_bytes):
+            key, value = self.entries.popitem(last=False)
+            self.bytes -= self.size(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+class AsyncPlexServerConnection(object):
+    """AsyncPlexServerConnection(host='localhost', port=32400, concurrency=4,
+        batch_size=20, batch_delay=0.005, timeout=30.0, max_entries=1000,
+        max_bytes=16777216)
+
+    See the module docstring. fetch_metadata() returns the key's own XML,
+    as the server would answer library/metadata/{key}, whatever batch it
+    was fetched in.
+    """
+    def __init__(self, host='localhost', port=32400, concurrency=4,
+            batch_size=20, batch_delay=0.005, timeout=30.0, max_entries=1000,
+            max_bytes=16777216):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+
+        self.pool = _HTTPConnectionPool(host, port, timeout)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        # key -> (xml, [MediaElement, ...]), from split_metadata()
+        self.metadata_cache = _LRUCache(
+            max_entries, max_bytes, lambda entry: len(entry[0]))
+        self.page_cache = _LRUCache(max_entries, max_bytes)
+
+        # path -> future of a request being sent
+        self.page_futures = {}
+        # key -> future of a key batched, or being fetched
+        self.key_futures = {}
+        self.batch_keys = []
+        self.batch_timer = None
+        self.batch_tasks = set()
+
+        self.requests = 0
+        self.coalesced = 0
+
+    async def close(self):
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        self._send_batches()
+        pending = list(self.batch_tasks) + list(self.page_futures.values())
+        if len(pending) > 0:
+            await asyncio.wait(pending)
+        self.pool.close()
+
+    async def fetch(self, path):
+        text = self.page_cache.get(path)
+        if text is not None:
+            return text
+
+        future = self.page_futures.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_page(path))
+            self.page_futures[path] = future
+            future.add_done_callback(
+                lambda future: self.page_futures.pop(path, None))
+        else:
+            self.coalesced += 1
+
+        # One caller being cancelled mustn't cancel it for the others.
+        return await asyncio.shield(future)
+
+    async def _fetch_page(self, path, cached=True):
+        logger = get_logger(self, '_fetch_page')
+
+        async with self.semaphore:
+            self.requests += 1
+            status, reason, text = await self.pool.get(path)
+
+        if status != 200:
+            raise PlexServerException((
+                'Unable to query path {path}:'
+                ' [{status_code}] - {reason}').format(
+                    path=path, status_code=status, reason=reason))
+
+        logger.debug('Fetched {0!r}, {1} bytes'.format(path, len(text)))
+        if cached:
+            self.page_cache.put(path, text)
+        return text
+
+    async def fetch_metadata(self, key):
+        xml, elements = await self._fetch_metadata(key)
+        return xml
+
+    async def fetch_metadata_document(self, key):
+        """fetch_metadata(), and a MediaDocument of it, made from the
+        elements parsed when its batch was split up."""
+        xml, elements = await self._fetch_metadata(key)
+        document = MediaDocument()
+        for element in elements:
+            document.append(element)
+        return xml, document
+
+    async def _fetch_metadata(self, key):
+        assert isinstance(key, int)
+
+        entry = self.metadata_cache.get(key)
+        if entry is not None:
+            return entry
+
+        future = self.key_futures.get(key)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self.key_futures[key] = future
+            self.batch_keys.append(key)
+
+            if len(self.batch_keys) >= self.batch_size:
+                self._send_batches()
+            elif self.batch_timer is None:
+                self.batch_timer = asyncio.get_event_loop().call_later(
+                    self.batch_delay, self._send_batches)
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _send_batches(self):
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+
+        keys = self.batch_keys
+        self.batch_keys = []
+        for offset in range(0, len(keys), self.batch_size):
+            task = asyncio.ensure_future(
+                self._fetch_batch(keys[offset:offset + self.batch_size]))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def _fetch_batch(self, keys):
+        # Not in the page cache, only each key's part of it is kept
+        try:
+            entries = split_metadata(await self._fetch_page(
+                'library/metadata/' + ','.join(map(str, keys)), False))
+        except Exception as err:
+            for key in keys:
+                future = self.key_futures.pop(key)
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        for key in keys:
+            future = self.key_futures.pop(key)
+            if future.done():
+                continue
+            if key not in entries:
+                future.set_exception(PlexServerException(
+                    'No metadata for {0}'.format(key)))
+                continue
+            xml, updated_at, elements = entries[key]
+            self.metadata_cache.put(key, (xml, elements))
+            future.set_result((xml, elements))
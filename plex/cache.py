@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+
+"""
+A persistent cache of the XML fetched from the Plex Media Server, kept in
+SQLite so it lasts between plex-reporter runs.
+
+Entries are keyed by ratingKey (metadata) or path (any other page), and
+expire after ttl seconds. If the caller knows the item's updatedAt (from a
+library listing for example), that decides instead, an entry is good for
+as long as its updatedAt matches no matter how old it is. Once there are
+more than max_entries, the least recently used are evicted.
+"""
+
+import re
+import time
+import sqlite3
+
+from plex.util import get_logger
+
+
+_schema = (
+    '''CREATE TABLE IF NOT EXISTS cache (
+        key        TEXT PRIMARY KEY,
+        xml        TEXT NOT NULL,
+        updated_at INTEGER,
+        fetched    REAL NOT NULL,
+        accessed   REAL NOT NULL
+        )''',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    )
+
+_updated_at_re = re.compile(r'\bupdatedAt="(\d+)"')
+
+
+def metadata_key(key):
+    return 'metadata:{0}'.format(key)
+
+
+def page_key(path):
+    return 'page:{0}'.format(path)
+
+
+def xml_updated_at(xml, key):
+    """The updatedAt of the element with ratingKey key, None if missing."""
+    tag_re = re.compile(
+        r'<\w+\s[^>]*\bratingKey="{0}"[^>]*>'.format(re.escape(str(key))))
+    tag = tag_re.search(xml)
+    if tag is None:
+        return None
+    match = _updated_at_re.search(tag.group(0))
+    return None if match is None else int(match.group(1))
+
+
+class MetadataCache(object):
+    """MetadataCache(file_name, ttl=604800, max_entries=20000,
+        clock=time.time)
+
+    See the module docstring. Reads only touch the database for rows that
+    aren't in memory yet. When entries were last used is written back, and
+    the cache trimmed to max_entries, in one go by flush() (called by
+    close()).
+    """
+    def __init__(self, file_name, ttl=604800, max_entries=20000,
+            clock=time.time):
+        self.file_name = file_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in _schema:
+                self.connection.execute(statement)
+
+        # key -> (xml, updated_at, fetched)
+        self.rows = {}
+        self.accessed = {}
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def get(self, key, updated_at=None):
+        """The cached xml for key, None if it's missing or stale."""
+        now = self.clock()
+
+        row = self.rows.get(key)
+        if row is None:
+            row = self.connection.execute(
+                'SELECT xml, updated_at, fetched FROM cache WHERE key = ?',
+                (key,)).fetchone()
+            if row is not None:
+                self.rows[key] = row
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        xml, row_updated_at, fetched = row
+        if updated_at is not None:
+            fresh = row_updated_at == updated_at
+        else:
+            fresh = now - fetched < self.ttl
+
+        if not fresh:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.accessed[key] = now
+        return xml
+
+    def put(self, key, xml, updated_at=None):
+        self.put_many([(key, xml, updated_at)])
+
+    def put_many(self, entries):
+        """put() for each (key, xml, updated_at) in entries, written in one
+        transaction."""
+        now = self.clock()
+        values = []
+        for key, xml, updated_at in entries:
+            row = (xml, updated_at, now)
+            self.rows[key] = row
+            self.accessed.pop(key, None)
+            values.append((key,) + row + (now,))
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO cache'
+                ' (key, xml, updated_at, fetched, accessed)'
+                ' VALUES (?, ?, ?, ?, ?)', values)
+
+    def flush(self):
+        """Writes back when entries were used, and evicts the least recently
+        used entries past max_entries."""
+        logger = get_logger(self, 'flush')
+
+        with self.connection:
+            if len(self.accessed) > 0:
+                self.connection.executemany(
+                    'UPDATE cache SET accessed = ? WHERE key = ?',
+                    [(accessed, key)
+                        for key, accessed in self.accessed.items()])
+                self.accessed.clear()
+
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                evicted = [row[0] for row in self.connection.execute(
+                    'SELECT key FROM cache ORDER BY accessed LIMIT ?',
+                    (excess,))]
+                self.connection.executemany(
+                    'DELETE FROM cache WHERE key = ?',
+                    [(key,) for key in evicted])
+                for key in evicted:
+                    self.rows.pop(key, None)
+                logger.debug('Evicted {0} entries'.format(len(evicted)))
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+"""
+Checkpointing of the EventParserController between plex-reporter runs.
+
+The checkpoint is a journal file, a base snapshot of every entity from
+EventParserController.dump_state() followed by the entities that changed on
+each later save. The journal is compacted back into a single snapshot once
+the appended changes outgrow the snapshot.
+
+File format, all integers big endian:
+
+    header:  b'PLEXJRNL' version:uint16
+    record:  length:uint32 crc32:uint32 payload:bytes[length]
+
+The payload is zlib compressed JSON, one of:
+
+    {"op": "set", "key": key, "value": value}
+    {"op": "del", "key": key}
+    {"op": "commit", "seq": seq}
+
+Records only take effect once their commit record has been read, a torn
+write at the end of the journal is ignored and overwritten on the next save.
+
+DayCheckpoints keeps one snapshot journal per day, of the controller as it
+was at the first line of that day, so events can be rebuilt from any day
+without replaying every log before it. See tool-reprocess-events.py.
+"""
+
+import os
+import re
+import json
+import zlib
+import struct
+
+from plex.util import PlexException, get_logger
+from plex.event import EventParserController
+
+
+JOURNAL_MAGIC   = b'PLEXJRNL'
+JOURNAL_VERSION = 1
+
+_header = struct.Struct('>8sH')
+_record = struct.Struct('>II')
+
+
+class CheckpointException(PlexException):
+    pass
+
+
+def _encode_record(record_text):
+    payload = zlib.compress(record_text.encode('utf-8'))
+    return _record.pack(
+        len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def _set_record(key, encoded_value):
+    # encoded_value is already JSON, no need to decode and encode it again.
+    return _encode_record('{{"key": {0}, "op": "set", "value": {1}}}'.format(
+        json.dumps(key), encoded_value))
+
+
+def _del_record(key):
+    return _encode_record(json.dumps({'key': key, 'op': 'del'}))
+
+
+def _commit_record(seq):
+    return _encode_record(json.dumps({'op': 'commit', 'seq': seq}))
+
+
+def _read_records(file_handle):
+    """Yields (record, end_offset) until the end, or a damaged record."""
+    while True:
+        head = file_handle.read(_record.size)
+        if len(head) < _record.size:
+            return
+
+        length, crc = _record.unpack(head)
+        payload = file_handle.read(length)
+        if (len(payload) < length or
+                zlib.crc32(payload) & 0xffffffff != crc):
+            return
+
+        yield (
+            json.loads(zlib.decompress(payload).decode('utf-8')),
+            file_handle.tell())
+
+
+class EventCheckpoint(object):
+    """EventCheckpoint(file_name, compact_ratio=2.0)
+
+    Saves and loads (last_datetime, EventParserController) to a journal.
+    Saves only write the entities that changed since the last load/save, so
+    they cost O(changes) on disk. Once the journal has grown past
+    compact_ratio times the size of its base snapshot it is rewritten as a
+    fresh snapshot.
+    """
+    def __init__(self, file_name, compact_ratio=2.0):
+        self.file_name = file_name
+        self.compact_ratio = compact_ratio
+
+        # key -> encoded value, as of the last commit
+        self.encoded = None
+        self.seq = 0
+        self.base_size = 0
+        self.journal_size = 0
+        self.good_offset = 0
+
+    def load(self):
+        """Returns (last_datetime, controller), (None, None) if missing."""
+        logger = get_logger(self, 'load')
+
+        self.encoded = None
+        if not os.path.isfile(self.file_name):
+            return None, None
+
+        entities = {}
+        pending = []
+        committed = False
+
+        with open(self.file_name, 'rb') as file_handle:
+            magic, version = _header.unpack(file_handle.read(_header.size))
+            if magic != JOURNAL_MAGIC:
+                raise CheckpointException(
+                    '{0!r} is not an event journal'.format(self.file_name))
+            if version != JOURNAL_VERSION:
+                raise CheckpointException((
+                    'Unsupported event journal version {0}'
+                    ' in {1!r}').format(version, self.file_name))
+
+            self.good_offset = file_handle.tell()
+            for record, offset in _read_records(file_handle):
+                if record['op'] != 'commit':
+                    pending.append(record)
+                    continue
+
+                for pending_record in pending:
+                    if pending_record['op'] == 'set':
+                        entities[pending_record['key']] = (
+                            pending_record['value'])
+                    else:
+                        entities.pop(pending_record['key'], None)
+                pending = []
+
+                if not committed:
+                    self.base_size = offset
+                committed = True
+                self.seq = record['seq']
+                self.good_offset = offset
+
+        if not committed:
+            logger.warning(
+                'No committed checkpoint in {0!r}'.format(self.file_name))
+            return None, None
+
+        if len(pending) > 0:
+            logger.warning('Ignoring {0} uncommitted records'.format(
+                len(pending)))
+
+        self.journal_size = self.good_offset - self.base_size
+        self.encoded = dict(
+            (key, json.dumps(value, sort_keys=True))
+            for key, value in entities.items())
+
+        last_datetime = entities.pop('last_datetime')
+        return last_datetime, EventParserController.load_state(entities)
+
+    def save(self, last_datetime, controller):
+        """Appends what changed since the last load/save to the journal."""
+        self.save_state(last_datetime, controller.dump_state())
+
+    def save_state(self, last_datetime, entities):
+        """Like save, with entities from EventParserController.dump_state."""
+        logger = get_logger(self, 'save_state')
+
+        entities = dict(entities)
+        entities['last_datetime'] = last_datetime
+        encoded = dict(
+            (key, json.dumps(value, sort_keys=True))
+            for key, value in entities.items())
+
+        if (self.encoded is None or
+                self.journal_size > self.base_size * self.compact_ratio):
+            self._write_snapshot(encoded)
+            logger.debug('Wrote snapshot of {0} entities, {1} bytes'.format(
+                len(encoded), self.base_size))
+        else:
+            written = self._write_changes(encoded)
+            logger.debug('Appended {0} changes, journal {1} bytes'.format(
+                written, self.journal_size))
+
+        self.encoded = encoded
+
+    def _write_snapshot(self, encoded):
+        self.seq += 1
+        temp_file = self.file_name + '.tmp'
+        with open(temp_file, 'wb') as file_handle:
+            file_handle.write(_header.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+            for key in sorted(encoded):
+                file_handle.write(_set_record(key, encoded[key]))
+            file_handle.write(_commit_record(self.seq))
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+            self.base_size = self.good_offset = file_handle.tell()
+            self.journal_size = 0
+
+        if os.path.isfile(self.file_name):
+            os.remove(self.file_name)
+        os.rename(temp_file, self.file_name)
+
+    def _write_changes(self, encoded):
+        records = []
+        for key in sorted(encoded):
+            if self.encoded.get(key) != encoded[key]:
+                records.append(_set_record(key, encoded[key]))
+        for key in sorted(self.encoded):
+            if key not in encoded:
+                records.append(_del_record(key))
+
+        self.seq += 1
+        records.append(_commit_record(self.seq))
+
+        with open(self.file_name, 'r+b') as file_handle:
+            # Drop anything left over from a torn save
+            file_handle.seek(self.good_offset)
+            file_handle.truncate()
+            for record in records:
+                file_handle.write(record)
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+            self.good_offset = file_handle.tell()
+
+        self.journal_size = self.good_offset - self.base_size
+        return len(records) - 1
+
+
+class DayCheckpoints(object):
+    """DayCheckpoints(directory)
+
+    A directory of controller checkpoints, one per day, keyed by the
+    watermark (last_datetime) they were saved at. Each one is a standalone
+    snapshot journal named day-YYYY-MM-DD.journal, for the controller state
+    just before the first line of that day.
+
+    Finished events and traces are left out, they were already handed out
+    by the run that saved the checkpoint, so a checkpoint only holds the
+    events in progress and stays small.
+    """
+    _file_re = re.compile(r'^day-(\d{4})-(\d{2})-(\d{2})\.journal$')
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def file_name(self, day):
+        return os.path.join(
+            self.directory,
+            'day-{0:04d}-{1:02d}-{2:02d}.journal'.format(*day[:3]))
+
+    def days(self):
+        """Sorted list of (year, month, day) with a checkpoint."""
+        if not os.path.isdir(self.directory):
+            return []
+
+        days = []
+        for file_name in os.listdir(self.directory):
+            match = self._file_re.match(file_name)
+            if match is not None:
+                days.append(tuple(int(part) for part in match.groups()))
+        days.sort()
+        return days
+
+    def nearest(self, day):
+        """The latest checkpoint day on or before day, None if there's none."""
+        day = tuple(day[:3])
+        nearest = None
+        for checkpoint_day in self.days():
+            if checkpoint_day > day:
+                break
+            nearest = checkpoint_day
+        return nearest
+
+    def save(self, day, last_datetime, controller):
+        logger = get_logger(self, 'save')
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        entities = controller.dump_state()
+        entities['controller'] = dict(
+            entities['controller'], done_events=[], traces=[])
+
+        EventCheckpoint(self.file_name(day)).save_state(
+            last_datetime, entities)
+        logger.debug('Saved checkpoint for {0}, at {1}'.format(
+            tuple(day[:3]), last_datetime))
+
+    def load(self, day):
+        """Returns (last_datetime, controller), (None, None) if missing."""
+        return EventCheckpoint(self.file_name(day)).load()
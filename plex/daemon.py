@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+"""
+The event daemon, plex-log-saver and plex-reporter in one long running
+process. Python 3 only, it's built on asyncio.
+
+The plex log is tailed once, each line is parsed once and then fanned out to
+the LogSaverSink, which appends it to our own logs like plex-log-saver does,
+and to the EventSink, which feeds it to an EventParserController and emits
+done and live events to its subscribers as they happen. The stages are
+joined by bounded queues, so a slow sink holds back the tailer rather than
+buffering the log in memory.
+
+Events still trail the log by the controller's buffer_size lines, as
+EventParsers get to look at the lines following theirs.
+"""
+
+import os
+import json
+import signal
+import asyncio
+import logging
+
+from glob import glob as file_glob
+
+from plex.util import BasketOfHandles, config_save, get_logger
+from plex.parser import PlexSuperLogParser, IngestFilter
+from plex.event import EventParserController, LogLoader
+from plex.checkpoint import EventCheckpoint
+from plex.dedup import LineIndex
+
+
+PLEX_LOG_NAME = 'Plex Media Server.log'
+
+
+class LogTailer(object):
+    """LogTailer(file_name)
+
+    Follows a log file, like tail -F. Picks up where it was when the file is
+    rotated (renamed and recreated) or truncated. read_lines() returns the
+    complete lines written since the last call, as (line_no, line_text).
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file_handle = None
+        self.file_id = None
+        self.line_no = 0
+        self.partial = ''
+
+    def _open(self):
+        try:
+            self.file_handle = open(
+                self.file_name, 'rt', encoding='utf-8', errors='replace')
+        except (IOError, OSError):
+            self.file_handle = None
+            return False
+
+        stat = os.fstat(self.file_handle.fileno())
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.line_no = 0
+        self.partial = ''
+        return True
+
+    def close(self):
+        if self.file_handle is not None:
+            self.file_handle.close()
+            self.file_handle = None
+
+    def _rotated(self):
+        try:
+            stat = os.stat(self.file_name)
+        except OSError:
+            return False
+        if (stat.st_dev, stat.st_ino) != self.file_id:
+            return True
+        # Truncated in place
+        return stat.st_size < self.file_handle.tell()
+
+    def read_lines(self, max_lines=1000):
+        logger = get_logger(self, 'read_lines')
+
+        if self.file_handle is None and not self._open():
+            return []
+
+        lines = self._read(max_lines)
+        if len(lines) == 0 and self._rotated():
+            logger.info('{0!r} rotated, reopening'.format(self.file_name))
+            self.close()
+            if self._open():
+                lines = self._read(max_lines)
+        return lines
+
+    def _read(self, max_lines):
+        lines = []
+        while len(lines) < max_lines:
+            line_text = self.file_handle.readline()
+            if line_text == '':
+                break
+            if not line_text.endswith('\n'):
+                # Plex is still writing this one
+                self.partial += line_text
+                break
+            self.line_no += 1
+            lines.append((self.line_no, self.partial + line_text))
+            self.partial = ''
+        return lines
+
+
+class LogSaverSink(object):
+    """Appends parsed lines to our own logs, see plex-log-saver.py."""
+    def __init__(self, config_file, config):
+        self.config_file = config_file
+        self.config = config
+        self.log_file_template = os.path.join('logs', config['log_file_name'])
+
+        if config['log_save_mode'] == 'gzip':
+            import gzip
+            log_open = gzip.open
+        else:
+            log_open = open
+
+        self.last_datetime = tuple(
+            map(int, config['plex_last_datetime'].split('-')))
+
+        self.index_file = os.path.join('logs', 'lines.index')
+        self.line_index = LineIndex(config['log_dedup_window'])
+        self.line_index.load(self.index_file)
+
+        self.basket = BasketOfHandles(log_open, 5)
+        self.basket.__enter__()
+        self.counter = 0
+
+    def cutoff(self):
+        """Lines up to this datetime are already saved, anything newer has
+        to be checked with is_new()."""
+        return self.line_index.floor() or self.last_datetime
+
+    def is_new(self, line_body):
+        """True if line_body hasn't been saved yet, and remembers it."""
+        return self.line_index.add(line_body)
+
+    def write(self, line_body):
+        file_handle = self.basket.open(
+            self.log_file_template.format(**line_body), 'at')
+        json.dump(line_body, file_handle, sort_keys=True)
+        file_handle.write('\n')
+        if line_body['datetime'] > self.last_datetime:
+            self.last_datetime = line_body['datetime']
+        self.counter += 1
+
+    def checkpoint(self):
+        self.basket.flush()
+        self.line_index.save(self.index_file)
+        self.config['plex_last_datetime'] = '-'.join(
+            map(str, self.last_datetime))
+        config_save(self.config_file, self.config)
+
+    def close(self):
+        self.checkpoint()
+        self.basket.__exit__(None, None, None)
+
+
+class EventSink(object):
+    """Feeds parsed lines to an EventParserController, checkpointed to
+    journal_file, and emits events to subscribers as they happen.
+
+    Subscribers are called as subscriber(kind, event), kind being 'done' or
+    'live'. Live events are only emitted again once they've changed, and the
+    same event_id is emitted as 'done' once it finishes.
+    """
+    def __init__(self, journal_file, buffer_size=10):
+        self.checkpoint_file = EventCheckpoint(journal_file)
+        last_datetime, controller = self.checkpoint_file.load()
+        if controller is None:
+            controller = EventParserController(buffer_size)
+
+        self.controller = controller
+        self.loader = LogLoader(controller, last_datetime=last_datetime)
+        self.subscribers = []
+        self.live = {}
+        # media_key -> media object or None, see plex.prefetch
+        self.media_lookup = None
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    def emit(self, kind, event):
+        logger = get_logger(self, 'emit')
+        if event.media_object is None and self.media_lookup is not None:
+            event.media_object = self.media_lookup(event.media_key)
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(kind, event)
+            except Exception:
+                logger.exception('Subscriber {0!r} failed'.format(subscriber))
+
+    def catch_up(self, log_file_match):
+        """Load the saved logs the controller hasn't seen yet."""
+        for log_file in sorted(file_glob(log_file_match)):
+            self.loader.load_file(log_file)
+        self._emit_done()
+
+    def feed(self, line_body):
+        # A copy, the loader changes it and the datetime has to be a list
+        # just like in the saved logs.
+        event_line = dict(line_body)
+        event_line['datetime'] = list(line_body['datetime'])
+        if self.loader.load_line(event_line):
+            self._emit_done()
+
+    def _emit_done(self):
+        if len(self.controller.done_events) == 0:
+            return
+        done_events = self.controller.done_events
+        self.controller.done_events = []
+        for event in done_events:
+            self.live.pop(event.event_id, None)
+            self.emit('done', event)
+
+    def idle_flush(self):
+        """Parses the lines the controller is holding back to look ahead
+        from, for when the log has gone quiet. Returns how many there were.
+        """
+        pending = len(self.controller.next_lines)
+        if pending > 0:
+            self.controller.parse_finish()
+            self._emit_done()
+        return pending
+
+    def emit_live(self):
+        live = {}
+        for event in self.controller.live_events():
+            live[event.event_id] = event.end
+            if self.live.get(event.event_id) != event.end:
+                self.emit('live', event)
+        self.live = live
+
+    def checkpoint(self):
+        self.checkpoint_file.save(self.loader.last_datetime, self.controller)
+
+
+class EventDaemon(object):
+    """EventDaemon(config_file, config, queue_size=1000, live_interval=1.0,
+        checkpoint_interval=60.0, poll_interval=0.25, idle_flush=5.0)
+
+    Runs the tail -> parse -> (save, events) pipeline until stop() is called
+    or a __shutdown__ file shows up. Subscribe to events through
+    daemon.events.subscribe() before calling run().
+
+    Once no line has come in for idle_flush seconds, the lines the
+    controller holds back to look ahead from are parsed, so a quiet server
+    doesn't hold on to its last events until more lines show up.
+
+    Anything in services (like a plex.stream.EventStreamServer) has its
+    start() coroutine awaited once caught up, and close() when stopping.
+    """
+    def __init__(self, config_file, config, queue_size=1000,
+            live_interval=1.0, checkpoint_interval=60.0, poll_interval=0.25,
+            idle_flush=5.0):
+        self.config = config
+        self.queue_size = queue_size
+        self.live_interval = live_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.poll_interval = poll_interval
+        self.idle_flush = idle_flush
+        # Event loop time the last line was fed to the EventSink
+        self.last_fed = None
+
+        self.saver = LogSaverSink(config_file, config)
+        ## Only the deny and sample rules, compacted polls would come out
+        ## too late for the EventSink. Sampling is after the dedup, see
+        ## _accept().
+        self.ingest_filter = IngestFilter(config['ingest_filter'])
+        self.parser = PlexSuperLogParser(
+            self.saver.cutoff(), ingest_filter=self.ingest_filter)
+        self.events = EventSink(os.path.join('logs', 'events.journal'))
+        self.services = []
+
+        self.stopping = None
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    def _log_files(self):
+        """Rotated plex logs oldest first, then the live one."""
+        plex_log_dir = self.config['plex_log_dir']
+        live_log = os.path.join(plex_log_dir, PLEX_LOG_NAME)
+        rotated = [
+            log_file for log_file in file_glob(
+                os.path.join(plex_log_dir, 'Plex Media Server*.log*'))
+            if log_file != live_log]
+        rotated.sort(key=os.path.getmtime)
+        return rotated, live_log
+
+    async def _tail(self, raw_queue):
+        rotated, live_log = self._log_files()
+
+        ## Whatever was rotated since the last run, the parser drops anything
+        ## older than what has already been saved.
+        for log_file in rotated:
+            tailer = LogTailer(log_file)
+            file_name = os.path.basename(log_file)
+            while True:
+                lines = tailer.read_lines()
+                if len(lines) == 0:
+                    break
+                for line_no, line_text in lines:
+                    await raw_queue.put((file_name, line_no, line_text))
+            tailer.close()
+
+        tailer = LogTailer(live_log)
+        file_name = os.path.basename(live_log)
+        try:
+            while True:
+                lines = tailer.read_lines()
+                if len(lines) == 0:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                for line_no, line_text in lines:
+                    await raw_queue.put((file_name, line_no, line_text))
+        finally:
+            tailer.close()
+
+    def _accept(self, file_name, line_no, line_text):
+        """The parsed line if it's to be saved and parsed, None if not."""
+        line_body = self.parser.parse_line(file_name, line_no, line_text)
+        if line_body is None or not self.parser.line_body_filter(line_body):
+            return None
+        if not self.saver.is_new(line_body):
+            return None
+        if not self.ingest_filter.sample(line_body):
+            return None
+        return line_body
+
+    async def _parse(self, raw_queue, saver_queue, event_queue):
+        while True:
+            line_body = self._accept(*(await raw_queue.get()))
+            if line_body is None:
+                continue
+            await saver_queue.put(line_body)
+            await event_queue.put(line_body)
+
+    async def _save(self, saver_queue):
+        while True:
+            self.saver.write(await saver_queue.get())
+
+    async def _feed_events(self, event_queue):
+        loop = asyncio.get_event_loop()
+        while True:
+            self.events.feed(await event_queue.get())
+            self.last_fed = loop.time()
+
+    async def _periodic(self):
+        loop = asyncio.get_event_loop()
+        next_checkpoint = loop.time() + self.checkpoint_interval
+        while True:
+            await asyncio.sleep(self.live_interval)
+
+            if (self.last_fed is not None and
+                    loop.time() - self.last_fed >= self.idle_flush):
+                self.last_fed = None
+                self.events.idle_flush()
+            self.events.emit_live()
+
+            if os.path.isfile('__shutdown__'):
+                os.remove('__shutdown__')
+                self.stop()
+
+            if loop.time() >= next_checkpoint:
+                next_checkpoint = loop.time() + self.checkpoint_interval
+                self.checkpoint()
+
+    def checkpoint(self):
+        logger = get_logger(self, 'checkpoint')
+        self.saver.checkpoint()
+        self.events.checkpoint()
+        logger.debug('Checkpoint, {0} lines saved, {1}'.format(
+            self.saver.counter, json.dumps(
+                self.events.controller.get_stats(), sort_keys=True)))
+
+    def _drain(self, raw_queue, saver_queue, event_queue):
+        """Finish off whatever is still queued once the tasks are stopped."""
+        while not saver_queue.empty():
+            self.saver.write(saver_queue.get_nowait())
+        while not event_queue.empty():
+            self.events.feed(event_queue.get_nowait())
+
+        while not raw_queue.empty():
+            line_body = self._accept(*raw_queue.get_nowait())
+            if line_body is None:
+                continue
+            self.saver.write(line_body)
+            self.events.feed(line_body)
+
+    async def run(self):
+        logger = get_logger(self, 'run')
+        loop = asyncio.get_event_loop()
+        self.stopping = asyncio.Event()
+
+        for signal_no in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_no, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        self.events.catch_up(
+            os.path.join('logs', self.config['log_file_match']))
+        logger.info('Caught up on saved logs')
+        # The end of the saved logs is held back like any other
+        self.last_fed = loop.time()
+
+        for service in self.services:
+            await service.start()
+
+        raw_queue = asyncio.Queue(self.queue_size)
+        saver_queue = asyncio.Queue(self.queue_size)
+        event_queue = asyncio.Queue(self.queue_size)
+
+        tasks = [
+            loop.create_task(self._tail(raw_queue)),
+            loop.create_task(self._parse(raw_queue, saver_queue, event_queue)),
+            loop.create_task(self._save(saver_queue)),
+            loop.create_task(self._feed_events(event_queue)),
+            loop.create_task(self._periodic()),
+            ]
+
+        stopping = loop.create_task(self.stopping.wait())
+        done, pending = await asyncio.wait(
+            tasks + [stopping], return_when=asyncio.FIRST_COMPLETED)
+
+        for task in tasks + [stopping]:
+            task.cancel()
+        await asyncio.gather(*(tasks + [stopping]), return_exceptions=True)
+
+        try:
+            ## A task dying is a bug, don't hide it
+            for task in done:
+                if task is not stopping and task.exception() is not None:
+                    raise task.exception()
+
+            self._drain(raw_queue, saver_queue, event_queue)
+        finally:
+            for service in self.services:
+                await service.close()
+            self.saver.close()
+            self.events.checkpoint()
+            logger.info('Stopped')
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+
+"""
+A rolling index of the lines plex-log-saver has already saved, so rotated
+logs that get read again, or a run whose config save failed, don't save
+the same lines twice.
+
+Lines are keyed by their datetime and a hash of their contents. The file
+name and line number are left out on purpose, plex renames its logs as it
+rotates them, so the same line turns up under another name on the next
+read. Identical lines in the same millisecond are told apart by counting
+them, the n-th copy of a line read in a run is only new if fewer than n
+copies were saved before.
+
+Only the last window hours (before the newest line) are kept, anything
+older than that is taken as already saved.
+
+File format, all integers big endian, zlib compressed after the header:
+
+    header:  b'PLEXLIDX' version:uint16
+    record:  millis:int64 digest:bytes[8] count:uint16
+"""
+
+import os
+import json
+import zlib
+import struct
+import hashlib
+
+from plex.util import (
+    PlexException, datetime_to_millis, millis_to_datetime, get_logger)
+
+
+INDEX_MAGIC   = b'PLEXLIDX'
+INDEX_VERSION = 1
+
+_header = struct.Struct('>8sH')
+_record = struct.Struct('>q8sH')
+
+# Where the line came from, not what it says.
+_source_fields = ('file_name', 'file_line_no')
+
+
+class LineIndexException(PlexException):
+    pass
+
+
+def line_digest(line_body):
+    content = dict(
+        (key, value) for key, value in line_body.items()
+        if key not in _source_fields)
+    return hashlib.md5(
+        json.dumps(content, sort_keys=True).encode('utf-8')).digest()[:8]
+
+
+class LineIndex(object):
+    """LineIndex(window=6)
+
+    The saved lines of the last window hours, see add().
+    """
+    def __init__(self, window=6):
+        self.window = int(window * 3600 * 1000)
+        # (millis, digest) -> copies saved
+        self.counts = {}
+        # (millis, digest) -> copies read this run
+        self.seen = {}
+        self.newest = None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def floor(self):
+        """The datetime lines must be newer than to be looked at, None if
+        the index is empty."""
+        if self.newest is None:
+            return None
+        return millis_to_datetime(self.newest - self.window)
+
+    def add(self, line_body):
+        """Returns True if line_body is new, and remembers it."""
+        millis = datetime_to_millis(line_body['datetime'])
+        if self.newest is not None and millis <= self.newest - self.window:
+            return False
+
+        key = (millis, line_digest(line_body))
+        seen = self.seen.get(key, 0) + 1
+        self.seen[key] = seen
+        if seen <= self.counts.get(key, 0):
+            return False
+
+        self.counts[key] = seen
+        if self.newest is None or millis > self.newest:
+            self.newest = millis
+        return True
+
+    def expire(self):
+        """Forgets the lines that fell out of the window."""
+        if self.newest is None:
+            return
+        limit = self.newest - self.window
+        for table in (self.counts, self.seen):
+            for key in [key for key in table if key[0] <= limit]:
+                del table[key]
+
+    def load(self, file_name):
+        """Loads a saved index, returns False if there isn't one."""
+        if not os.path.isfile(file_name):
+            return False
+
+        with open(file_name, 'rb') as file_handle:
+            magic, version = _header.unpack(file_handle.read(_header.size))
+            if magic != INDEX_MAGIC:
+                raise LineIndexException(
+                    '{0!r} is not a line index'.format(file_name))
+            if version != INDEX_VERSION:
+                raise LineIndexException((
+                    'Unsupported line index version {0}'
+                    ' in {1!r}').format(version, file_name))
+            data = zlib.decompress(file_handle.read())
+
+        self.counts = {}
+        self.seen = {}
+        self.newest = None
+        for offset in range(0, len(data), _record.size):
+            millis, digest, count = _record.unpack_from(data, offset)
+            self.counts[(millis, digest)] = count
+            if self.newest is None or millis > self.newest:
+                self.newest = millis
+
+        self.expire()
+        return True
+
+    def save(self, file_name):
+        logger = get_logger(self, 'save')
+
+        self.expire()
+        data = b''.join(
+            _record.pack(millis, digest, min(count, 0xffff))
+            for (millis, digest), count in sorted(self.counts.items()))
+
+        temp_file = file_name + '.tmp'
+        with open(temp_file, 'wb') as file_handle:
+            file_handle.write(_header.pack(INDEX_MAGIC, INDEX_VERSION))
+            file_handle.write(zlib.compress(data))
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+        os.rename(temp_file, file_name)
+
+        logger.debug('Saved {0} lines to {1!r}'.format(
+            len(self.counts), file_name))
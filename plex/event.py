@@ -30,9 +30,12 @@ THE SOFTWARE.
 import re
 import json
 import gzip
+import array
 import itertools
 
-from plex.util import datetime_diff
+from plex.util import (
+    datetime_diff, datetime_seconds, datetime_to_millis, millis_to_datetime,
+    TimeWheel, ReorderBuffer)
 
 EVENT_MORE      = 0
 EVENT_DONE      = 1
@@ -46,96 +49,149 @@ def startswith_list(text, items):
     return None
 
 
+# url_path prefixes that collate a whole transcode session into one category,
+# with the url_path.split('/') index of the session segment (if any).
+_url_collators = (
+    ('/video/:/transcode/segmented', None),
+    ('/video/:/transcode/universal', None),
+    ('/video/:/transcode/session', 5),
+    )
+
+_url_sessions = (
+    ('/video/:/transcode/segmented/session', 6),
+    ('/video/:/transcode/universal/session', 6),
+    )
+
+# Every prefix above fits within this many characters, so the url_path
+# truncated to it is all that's needed to memoize the lookup.
+_url_prefix_size = max(
+    len(prefix) for prefix, index in _url_collators + _url_sessions)
+
+_url_path_cache = {}
+_url_path_cache_size = 4096
+
+
+def _categorize_url_path(url_path):
+    """Returns (collated prefix or None, session segment index or None)."""
+    url_prefix = url_path[:_url_prefix_size]
+    try:
+        return _url_path_cache[url_prefix]
+    except KeyError:
+        pass
+
+    collator = None
+    session_index = None
+    for prefix, index in _url_collators:
+        if url_prefix.startswith(prefix):
+            collator = prefix
+            session_index = index
+            break
+
+    for prefix, index in _url_sessions:
+        if url_prefix.startswith(prefix):
+            session_index = index
+            break
+
+    if len(_url_path_cache) >= _url_path_cache_size:
+        _url_path_cache.clear()
+    _url_path_cache[url_prefix] = (collator, session_index)
+
+    return collator, session_index
+
+
 def event_categorize(event_line):
     """Categorizes an event_line suitable for the EventParserController."""
     result = []
     # Doesn't work if event_line starts over new day
     # result.append("{0:04}-{1:02}-{2:02}".format(*event_line['datetime']))
-    seen = []
-
-    url_collators = (
-        '/video/:/transcode/segmented',
-        '/video/:/transcode/universal',
-        '/video/:/transcode/session',
-        )
+    seen_ip = False
+    seen_session = False
 
     # Session info is only useful if we have a ratingKey or key
-    if 'session_info' in event_line and (
-            'ratingKey' in event_line['session_info'] or
-            'key' in event_line['session_info']):
+    session_info = event_line.get('session_info')
+    if session_info is not None and (
+            'ratingKey' in session_info or 'key' in session_info):
 
-        seen.append('url')
         result.append('/:/session_info')
-        session_info = event_line['session_info']
-        seen.append('session')
+        seen_session = True
         result.append(session_info['session'])
 
-    if 'url_path' in event_line:
-        seen.append('url')
-        startswith = startswith_list(event_line['url_path'], url_collators)
-        if startswith:
-            result.append(startswith)
-        else:
-            result.append(event_line['url_path'])
+    url_path = event_line.get('url_path')
+    if url_path is not None:
+        collator, session_index = _categorize_url_path(url_path)
+        result.append(collator if collator is not None else url_path)
 
         if 'request_ip' in event_line:
-            seen.append('ip')
+            seen_ip = True
             result.append(event_line['request_ip'])
 
-        if (event_line['url_path'].startswith(
-                '/video/:/transcode/segmented/session') or
-            event_line['url_path'].startswith(
-                '/video/:/transcode/universal/session')):
-            seen.append('session')
-            result.append(event_line['url_path'].split('/')[6])
-        elif (event_line['url_path'].startswith('/video/:/transcode/session')):
-            seen.append('session')
-            result.append(event_line['url_path'].split('/')[5])
-
-    if 'ip' not in seen and 'request_ip' in event_line:
-        seen.append('ip')
+        if session_index is not None:
+            seen_session = True
+            result.append(url_path.split('/')[session_index])
+
+    if not seen_ip and 'request_ip' in event_line:
         result.append(event_line['request_ip'])
 
-    if 'session' not in seen and 'url_query' in event_line:
+    if not seen_session and 'url_query' in event_line:
         url_query = event_line['url_query']
         if 'session' in url_query:
-            seen.append('session')
             result.append(url_query['session'])
         # elif 'X-Plex-Client-Identifier' in url_query:
-        #     seen.append('session')
         #     result.append(url_query['X-Plex-Client-Identifier'])
         elif 'ratingKey' in url_query:
-            seen.append('key')
             result.append(url_query['ratingKey'])
         elif 'key' in url_query:
-            seen.append('key')
             result.append(url_query['key'].rsplit('/', 1)[-1])
         elif 'X-Plex-Device-Name' in url_query:
-            seen.append('name')
             result.append(url_query['X-Plex-Device-Name'])
 
     return tuple(result)
 
 
-_content_session_info_re = (
-    re.compile(r'Client \[(?P<session>[^\]]+)]'),
-    re.compile(r'progress of (?P<time>\d+)/(?P<total>\d+)ms'),
-    re.compile(r'for guid=(?P<guid>[^,]*)'),
-    re.compile(r'ratingKey=(?P<ratingKey>\d+)'),
-    re.compile(r'url=(?P<url>[^,]*),'),
-    re.compile(r'key=(?P<key>[^,]*),'),
-    re.compile(r'containerKey=(?P<containerKey>[^,]*),'),
-    re.compile(r'metadataId=(?P<metadataId>\d*)'),)
+# The usual shape of a session info line, matched in one go.
+_content_session_info_line_re = re.compile(
+    r'Client \[(?P<session>[^\]]+)][^,]*,'
+    r' progress of (?P<time>\d+)/(?P<total>\d+)ms'
+    r' for guid=(?P<guid>[^,]*),'
+    r' ratingKey=(?P<ratingKey>\d+)'
+    r' url=(?P<url>[^,]*),'
+    r' key=(?P<key>[^,]*),'
+    r' containerKey=(?P<containerKey>[^,]*),'
+    r' metadataId=(?P<metadataId>\d*)')
+
+# Anything else is scanned left to right for each field, in a single pass.
+# The progress alternative is the only one with two groups, total is its last.
+#
+# Unlike the search per field this replaced, a field is never picked out of
+# the middle of another one's value, a guid of ...?ratingKey=5 or a url of
+# ...?key=9 doesn't hide the real ratingKey= and key= that follow them.
+_content_session_info_re = re.compile(
+    r'Client \[(?P<session>[^\]]+)]'
+    r'|progress of (?P<time>\d+)/(?P<total>\d+)ms'
+    r'|for guid=(?P<guid>[^,]*)'
+    r'|ratingKey=(?P<ratingKey>\d+)'
+    r'|url=(?P<url>[^,]*),'
+    r'|containerKey=(?P<containerKey>[^,]*),'
+    r'|key=(?P<key>[^,]*),'
+    r'|metadataId=(?P<metadataId>\d*)')
 
 
 def decode_content_session_info(event_line):
-    result = {}
     content = event_line['content']
 
-    for regex in _content_session_info_re:
-        match = regex.search(content)
-        if match is not None:
-            result.update(match.groupdict())
+    match = _content_session_info_line_re.match(content)
+    if match is not None:
+        result = match.groupdict()
+    else:
+        result = {}
+        for match in _content_session_info_re.finditer(content):
+            name = match.lastgroup
+            # Like a search for each field, the first match wins.
+            if name in result:
+                continue
+            if name == 'total':
+                result['time'] = match.group('time')
+            result[name] = match.group(name)
 
     if 'session' in result:
         del event_line['content']
@@ -157,7 +213,14 @@ def format_date(datetime):
 
 
 class PlexEvent(object):
+    # Millions of these get made when reporting, keep them small.
+    __slots__ = (
+        '_session_key', '_media_key', '_start', '_event_id',
+        'device_name', 'device_ip', 'device_client', 'end', 'media_object',
+        'resumed', 'stopped', 'live')
+
     def __init__(self, **kwargs):
+        self._event_id     = None
         self.session_key   = kwargs.get('session_key', '')
         self.media_key     = kwargs.get('media_key', '0')
 
@@ -175,6 +238,41 @@ class PlexEvent(object):
         self.stopped       = kwargs.get('stopped', None)
         self.live          = kwargs.get('live', False)
 
+    def __getstate__(self):
+        state = self.to_dict()
+        state['media_object'] = self.media_object
+        return state
+
+    def __setstate__(self, state):
+        # Also takes the __dict__ of PlexEvents pickled before __slots__
+        self.__init__(**state)
+
+    ## session_key, media_key and start make up the event_id, which is cached
+    ## until one of them changes.
+    def get_session_key(self):
+        return self._session_key
+
+    def set_session_key(self, session_key):
+        self._session_key = session_key
+        self._event_id = None
+    session_key = property(get_session_key, set_session_key)
+
+    def get_media_key(self):
+        return self._media_key
+
+    def set_media_key(self, media_key):
+        self._media_key = media_key
+        self._event_id = None
+    media_key = property(get_media_key, set_media_key)
+
+    def get_start(self):
+        return self._start
+
+    def set_start(self, start):
+        self._start = start
+        self._event_id = None
+    start = property(get_start, set_start)
+
     def get_duration(self):
         if self.end is None or self.start is None:
             return None
@@ -182,11 +280,13 @@ class PlexEvent(object):
     duration = property(get_duration)
 
     def get_event_id(self):
-        timestamp = '-'.join(map(str, self.start))
-        return '@'.join([
-            str(self.session_key),
-            str(self.media_key),
-            timestamp])
+        if self._event_id is None:
+            timestamp = '-'.join(map(str, self._start))
+            self._event_id = '@'.join([
+                str(self._session_key),
+                str(self._media_key),
+                timestamp])
+        return self._event_id
     event_id = property(get_event_id)
 
     def to_dict(self):
@@ -230,6 +330,180 @@ class PlexEvent(object):
                     else None))
 
 
+class EventBatch(object):
+    """EventBatch(events=None)
+
+    Stores lots of PlexEvents as columns, rather than as objects. Strings are
+    interned into a table and stored as indexes, start and end are stored as
+    milliseconds since the epoch (-1 for None), and the flags as bytes
+    (stopped is -1 for None).
+
+    Iterating or indexing gives PlexEvents back (without their media_object),
+    reports can work on whole columns with column()/durations() instead.
+    """
+    _string_columns = (
+        'session_key', 'media_key', 'device_name', 'device_ip',
+        'device_client')
+
+    _flag_columns = ('resumed', 'stopped', 'live')
+
+    def __init__(self, events=None):
+        self.strings = []
+        self._string_index = {}
+
+        self.columns = {}
+        for name in self._string_columns:
+            self.columns[name] = array.array('i')
+        for name in ('start', 'end'):
+            self.columns[name] = array.array('q')
+        for name in self._flag_columns:
+            self.columns[name] = array.array('b')
+
+        if events is not None:
+            self.extend(events)
+
+    def _intern(self, value):
+        try:
+            return self._string_index[value]
+        except KeyError:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+            return index
+
+    def append(self, event):
+        columns = self.columns
+        for name in self._string_columns:
+            columns[name].append(self._intern(getattr(event, name)))
+
+        columns['start'].append(datetime_to_millis(event.start))
+        columns['end'].append(datetime_to_millis(event.end))
+
+        columns['resumed'].append(1 if event.resumed else 0)
+        columns['stopped'].append(
+            -1 if event.stopped is None else int(event.stopped))
+        columns['live'].append(1 if event.live else 0)
+
+    def extend(self, events):
+        for event in events:
+            self.append(event)
+
+    def __len__(self):
+        return len(self.columns['start'])
+
+    def __getitem__(self, index):
+        columns = self.columns
+        strings = self.strings
+        kwargs = {}
+        for name in self._string_columns:
+            kwargs[name] = strings[columns[name][index]]
+
+        kwargs['start'] = millis_to_datetime(columns['start'][index])
+        kwargs['end'] = millis_to_datetime(columns['end'][index])
+
+        kwargs['resumed'] = columns['resumed'][index] == 1
+        stopped = columns['stopped'][index]
+        kwargs['stopped'] = None if stopped == -1 else stopped == 1
+        kwargs['live'] = columns['live'][index] == 1
+
+        return PlexEvent(**kwargs)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def column(self, name):
+        """The values of a column, strings are looked up in the table."""
+        if name in self._string_columns:
+            strings = self.strings
+            return [strings[index] for index in self.columns[name]]
+        return self.columns[name]
+
+    def durations(self):
+        """Seconds between start and end of each event, -1 if unknown."""
+        return array.array('q', [
+            (end - start) // 1000 if start >= 0 and end >= 0 else -1
+            for start, end in zip(self.columns['start'], self.columns['end'])])
+
+    def to_dicts(self):
+        return [event.to_dict() for event in self]
+
+
+def summarize_event_line(event_category, event_line):
+    """A small dict describing an event_line, for EventTrace."""
+    summary = {
+        'category': event_category,
+        'datetime': event_line['datetime'],
+        }
+
+    if 'url_query' in event_line:
+        url_query = event_line['url_query']
+        for key in ('state', 'time', 'duration'):
+            if key in url_query:
+                summary[key] = url_query[key]
+
+    if 'session_info' in event_line:
+        summary['session_info'] = event_line['session_info']
+
+    return summary
+
+
+class EventTrace(object):
+    """EventTrace(max_lines=50)
+
+    Bounded record of the lines an EventParser has seen, used for debugging
+    events. Keeps the first line with its surrounding lines, and the last
+    max_lines summarized lines in a ring.
+    """
+    def __init__(self, max_lines=50):
+        self.max_lines = max_lines
+        self.context = None
+        self.final = None
+        self.lines = []
+        self.next_index = 0
+        self.total = 0
+
+    def set_context(self, event_line, previous_lines, next_lines):
+        self.context = {
+            'previous': [
+                summarize_event_line(*line) for line in previous_lines],
+            'line': event_line,
+            'next': [
+                summarize_event_line(*line) for line in next_lines],
+            }
+
+    def record(self, event_category, event_line):
+        summary = summarize_event_line(event_category, event_line)
+        if len(self.lines) < self.max_lines:
+            self.lines.append(summary)
+        else:
+            self.lines[self.next_index] = summary
+            self.next_index = (self.next_index + 1) % self.max_lines
+        self.total += 1
+
+    def get_lines(self):
+        """The recorded lines, oldest first."""
+        return self.lines[self.next_index:] + self.lines[:self.next_index]
+
+    def dump_state(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load_state(cls, state):
+        trace = cls()
+        trace.__dict__.update(state)
+        return trace
+
+    def to_dict(self, event):
+        return {
+            'event_id': event.event_id,
+            'event': event.to_dict(),
+            'context': self.context,
+            'lines': self.get_lines(),
+            'dropped': self.total - len(self.lines),
+            'final': self.final,
+            }
+
+
 class EventParser(object):
     # For now we only parse '/:/timeline' & '/:/progress' events
     def __init__(self, controller, event_category):
@@ -244,8 +518,37 @@ class EventParser(object):
         self.event = PlexEvent(**event_dict)
         self.first_line = True
         self.last_line = None
-        self.debug_info = []
-        self.debug_final = None
+        self.trace = None
+
+    def __setstate__(self, state):
+        # EventParsers pickled before EventTrace kept every line they saw.
+        state.pop('debug_info', None)
+        state.pop('debug_final', None)
+        state.setdefault('trace', None)
+        self.__dict__.update(state)
+
+    def dump_state(self):
+        state = {
+            'event_category': self.event_category,
+            'event': self.event.to_dict(),
+            'first_line': self.first_line,
+            }
+        if hasattr(self, 'last'):
+            state['last'] = self.last
+        if self.trace is not None:
+            state['trace'] = self.trace.dump_state()
+        return state
+
+    @classmethod
+    def load_state(cls, controller, state):
+        event_parser = cls(controller, tuple(state['event_category']))
+        event_parser.event = PlexEvent(**state['event'])
+        event_parser.first_line = state['first_line']
+        if 'last' in state:
+            event_parser.last = state['last']
+        if 'trace' in state:
+            event_parser.trace = EventTrace.load_state(state['trace'])
+        return event_parser
 
     def _parse_first_line(self, event_line, previous_lines, next_lines):
         # Skip first lines that are "state": "stopped"
@@ -344,27 +647,14 @@ class EventParser(object):
 
         ## Still no session_key, it used to be just for sessions, now we use it
         ## for a unique identifier... probably should fix this :/
-        if ((self.event.session_key == '' or
-                self.event.session_key in self.controller.debug_keys) and
-                self.controller.debug_stream is not None):
-
-            ds = self.controller.debug_stream
-            print("#" * 80, file=ds)
-
-            for previous_line in previous_lines:
-                print("<", json.dumps(previous_line, sort_keys=True), file=ds)
-
-            print("=", json.dumps(event_line, sort_keys=True), file=ds)
-            print(self.event, file=ds)
-
-            for next_line in next_lines:
-                print(">", json.dumps(next_line, sort_keys=True), file=ds)
-
-            print("#" * 80, file=ds)
+        if self.controller.is_traced(self.event.session_key):
+            self.trace = EventTrace(self.controller.trace_size)
+            self.trace.set_context(event_line, previous_lines, next_lines)
+            self.trace.record(self.event_category, event_line)
 
         self.first_line = False
         self.last = event_line
-        self.debug_info.append(event_line)
+        self.controller.event_started(self.event)
         return EVENT_MORE
 
     def parse(self, event_line, previous_lines, next_lines):
@@ -376,22 +666,23 @@ class EventParser(object):
             if (datetime_diff(
                     event_line['datetime'], self.last['datetime']) > 600):
                 # Too much of a time difference, making this a different event.
-                self.debug_final = event_line
+                if self.trace is not None:
+                    self.trace.final = summarize_event_line(
+                        self.event_category, event_line)
                 return EVENT_DONE_REDO
 
-            self.debug_info.append(event_line)
-            self.last = event_line
-            return EVENT_MORE
+            result = EVENT_MORE
 
         elif event_line["url_query"]["state"] == "paused":
-            self.last = event_line
-            self.debug_info.append(event_line)
-            return EVENT_MORE
+            result = EVENT_MORE
 
         else:
-            self.last = event_line
-            self.debug_info.append(event_line)
-            return EVENT_DONE
+            result = EVENT_DONE
+
+        self.last = event_line
+        if self.trace is not None:
+            self.trace.record(self.event_category, event_line)
+        return result
 
     def finish(self):
         if self.last["url_query"]["state"] == "stopped":
@@ -401,46 +692,258 @@ class EventParser(object):
 
         self.event.end = self.last['datetime']
 
-        if self.event.session_key in self.controller.debug_keys:
-            ds = self.controller.debug_stream
-            if ds is None:
-                return
-
-            print("#" * 80, file=ds)
-
-            print(self.event, file=ds)
-
-            for event_line in self.debug_info:
-                print("-", json.dumps(event_line, sort_keys=True), file=ds)
-
-            print("#" * 80, file=ds)
+        if self.trace is not None:
+            self.controller.add_trace(self.trace.to_dict(self.event))
+            self.trace = None
 
 
 class EventParserController(object):
-    """EventParserController(buffer_size=20)
+    """EventParserController(buffer_size=20, session_ttl=7200, parser_ttl=600)
 
     Controls the creation and destruction of EventParser objects. Suitable for
     serializing with pickle, infact its recommended.
 
     This object keep track of the previous/next 20 lines for EventParser
     objects, this allows them to check surrounding lines for data.
+
+    Events can be traced for debugging, see trace(), by session_key. Traces
+    of finished events are pulled with pop_traces(), at most max_traces are
+    kept around.
+
+    Transcode sessions that haven't been seen for session_ttl seconds, and
+    EventParsers that haven't seen a line for parser_ttl seconds (log time)
+    are expired, so the state stays bounded on long running servers. Expired
+    EventParsers that started an event are finished into done_events.
+
+    media_callback(event) is called as soon as an event has started, so its
+    media_key is known, to get its metadata on the way (see plex.prefetch).
+    It isn't kept when the controller is pickled.
     """
-    def __init__(self, buffer_size=20, debug_stream=None, debug_keys=None):
+    def __init__(self, buffer_size=20, trace_keys=None, trace_unknown=False,
+            session_ttl=7200, parser_ttl=600, media_callback=None):
         self.event_parsers = {}
         self.done_events = []
         self.sessions = {}
-        self.debug_stream = debug_stream
-        self.debug_keys = debug_keys if debug_keys is not None else []
+        self.media_callback = media_callback
+
+        self._init_trace(trace_keys, trace_unknown)
 
         # Buffer contains the last/next buffer_size lines
         self.buffer_size = buffer_size
         self.next_lines = []
         self.previous_lines = []
 
+        self._init_expiry(session_ttl, parser_ttl)
+
+    def _init_trace(self, trace_keys=None, trace_unknown=False,
+            trace_size=50, max_traces=100):
+        self.trace_keys = set(trace_keys) if trace_keys is not None else set()
+        self.trace_unknown = trace_unknown
+        self.trace_size = trace_size
+        self.max_traces = max_traces
+        self.traces = []
+
+    def _init_expiry(self, session_ttl, parser_ttl):
+        self.session_wheel = TimeWheel(session_ttl)
+        self.parser_wheel = TimeWheel(parser_ttl)
+        self.counters = {
+            'sessions_expired': 0,
+            'event_parsers_expired': 0,
+            }
+
+        # Log time of the line being parsed, in seconds.
+        self.clock = None
+        self._clock_minute = None
+        self._clock_base = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('media_callback', None)
+        return state
+
+    def __setstate__(self, state):
+        # Controllers pickled before EventTrace existed
+        state.pop('debug_stream', None)
+        state.pop('debug_keys', None)
+        self.__dict__.update(state)
+        self.media_callback = None
+        if 'traces' not in state:
+            self._init_trace()
+
+        # Controllers pickled before expiry existed
+        if 'session_wheel' not in state:
+            self._init_expiry(7200, 600)
+            # Everything live now gets a full ttl from its next touch
+            self.sessions.clear()
+
+    def dump_state(self):
+        """Returns the state as a dict of JSON-able entities.
+
+        Entities are keyed by name, 'parser:<event_id>' for each EventParser
+        and 'session:<session_id>' for each transcode session, so callers can
+        work out what changed between two dumps. See plex.checkpoint.
+        """
+        entities = {}
+        entities['controller'] = {
+            'buffer_size':   self.buffer_size,
+            'trace_keys':    sorted(self.trace_keys),
+            'trace_unknown': self.trace_unknown,
+            'trace_size':    self.trace_size,
+            'max_traces':    self.max_traces,
+            'traces':        self.traces,
+            'session_ttl':   self.session_wheel.ttl,
+            'parser_ttl':    self.parser_wheel.ttl,
+            'counters':      self.counters,
+            'clock':         self.clock,
+            'done_events':   [event.to_dict() for event in self.done_events],
+            }
+        entities['buffer'] = {
+            'previous_lines': self.previous_lines,
+            'next_lines':     self.next_lines,
+            }
+
+        for event_id, event_parser in self.event_parsers.items():
+            state = event_parser.dump_state()
+            state['touched'] = self.parser_wheel.touched.get(event_id)
+            entities['parser:' + event_id] = state
+
+        for session_id, session in self.sessions.items():
+            entities['session:' + session_id] = {
+                'session': session,
+                'touched': self.session_wheel.touched.get(session_id),
+                }
+
+        return entities
+
+    @classmethod
+    def load_state(cls, entities):
+        """Creates a controller from the entities returned by dump_state."""
+        state = entities['controller']
+        controller = cls(
+            state['buffer_size'], state['trace_keys'], state['trace_unknown'],
+            state['session_ttl'], state['parser_ttl'])
+        controller.trace_size = state['trace_size']
+        controller.max_traces = state['max_traces']
+        controller.traces = state['traces']
+        controller.counters = state['counters']
+        controller.clock = state['clock']
+        controller.done_events = [
+            PlexEvent(**event) for event in state['done_events']]
+
+        buffer_state = entities['buffer']
+        controller.previous_lines = [
+            (tuple(event_category), event_line)
+            for event_category, event_line in buffer_state['previous_lines']]
+        controller.next_lines = [
+            (tuple(event_category), event_line)
+            for event_category, event_line in buffer_state['next_lines']]
+
+        for key, state in entities.items():
+            kind, _, name = key.partition(':')
+            if kind == 'parser':
+                controller.event_parsers[name] = (
+                    EventParser.load_state(controller, state))
+                if state['touched'] is not None:
+                    controller.parser_wheel.touch(name, state['touched'])
+            elif kind == 'session':
+                controller.sessions[name] = state['session']
+                if state['touched'] is not None:
+                    controller.session_wheel.touch(name, state['touched'])
+
+        return controller
+
+    def event_started(self, event):
+        """Called by EventParsers once their event has started."""
+        if self.media_callback is not None:
+            self.media_callback(event)
+
+    def trace(self, session_key):
+        """Trace events for session_key that start from now on."""
+        self.trace_keys.add(session_key)
+
+    def untrace(self, session_key):
+        self.trace_keys.discard(session_key)
+
+    def is_traced(self, session_key):
+        if session_key == '':
+            return self.trace_unknown
+        return session_key in self.trace_keys
+
+    def add_trace(self, trace_dict):
+        self.traces.append(trace_dict)
+        if len(self.traces) > self.max_traces:
+            del self.traces[:-self.max_traces]
+
+    def pop_traces(self):
+        """Returns, and forgets, the traces of finished events."""
+        traces = self.traces
+        self.traces = []
+        return traces
+
+    def sample_traces(self):
+        """Returns traces of events that are still being parsed."""
+        return [
+            event_parser.trace.to_dict(event_parser.event)
+            for event_parser in self.event_parsers.values()
+            if event_parser.trace is not None]
+
+    def live_events(self):
+        """Snapshot of the events still being parsed, as live PlexEvents.
+
+        Unlike parse_flush the EventParsers are left alone, so this can be
+        called as often as needed.
+        """
+        live_events = []
+        for event_parser in self.event_parsers.values():
+            if event_parser.first_line:
+                continue
+            event = PlexEvent(**event_parser.event.to_dict())
+            event.end = event_parser.last['datetime']
+            event.live = True
+            live_events.append(event)
+        return live_events
+
+    def get_stats(self):
+        """Gauges and counters, handy for logging."""
+        stats = dict(self.counters)
+        stats['sessions'] = len(self.sessions)
+        stats['event_parsers'] = len(self.event_parsers)
+        stats['done_events'] = len(self.done_events)
+        stats['traces'] = len(self.traces)
+        return stats
+
+    def _advance_clock(self, line_datetime):
+        # datetime_seconds is only called once per minute of log time.
+        minute = line_datetime[:5]
+        if minute != self._clock_minute:
+            self._clock_minute = minute
+            self._clock_base = datetime_seconds(list(minute) + [0])
+            self.clock = self._clock_base + line_datetime[5]
+            self.parse_expire(self.clock)
+        else:
+            self.clock = self._clock_base + line_datetime[5]
+
+    def parse_expire(self, now):
+        """Expire sessions and EventParsers idle as of now (seconds)."""
+        for session_id in self.session_wheel.expire(now):
+            if session_id in self.sessions:
+                del self.sessions[session_id]
+                self.counters['sessions_expired'] += 1
+
+        for event_id in self.parser_wheel.expire(now):
+            if event_id not in self.event_parsers:
+                continue
+            event_parser = self.event_parsers.pop(event_id)
+            self.counters['event_parsers_expired'] += 1
+            if not event_parser.first_line:
+                event_parser.finish()
+                self.done_events.append(event_parser.event)
+
     def _parse_session_event(self, event_category, event_line):
+        session_id = '@'.join(['/video/:/transcode', event_category[1]])
+
         if event_line['url_path'].rsplit('/', 1)[-1].startswith("start."):
             ## Start transcoding session...
-            session_id = '@'.join(['/video/:/transcode', event_category[1]])
             session = {'session_key': event_category[2]}
 
             if 'X-Plex-Device-Name' in event_line['url_query']:
@@ -459,13 +962,17 @@ class EventParserController(object):
                     event_line['url_query']['path'].rsplit('/', 1)[-1])
 
             self.sessions[session_id] = session
+            self.session_wheel.touch(session_id, self.clock)
 
         elif event_line['url_path'].endswith('stop'):
             ## End transcoding sesssion...
-            session_id = (
-                event_category[0].rsplit('/', 1)[0], event_category[1])
             if session_id in self.sessions:
                 del self.sessions[session_id]
+                self.session_wheel.discard(session_id)
+
+        elif session_id in self.sessions:
+            ## Still transcoding, keep the session alive.
+            self.session_wheel.touch(session_id, self.clock)
 
         return True
 
@@ -482,6 +989,7 @@ class EventParserController(object):
 
         if parse_result == EVENT_DONE_REDO:
             del self.event_parsers[event_id]
+            self.parser_wheel.discard(event_id)
             event_parser.finish()
             self.done_events.append(event_parser.event)
             # Return false to push the event back onto the queue and it'll be
@@ -490,34 +998,34 @@ class EventParserController(object):
 
         elif parse_result == EVENT_DONE:
             del self.event_parsers[event_id]
+            self.parser_wheel.discard(event_id)
             event_parser.finish()
             self.done_events.append(event_parser.event)
             return True
 
         else:  # parse_result = EVENT_MORE
+            self.parser_wheel.touch(event_id, self.clock)
             return True
 
+    # event_category[0] -> handler method name, anything not in here is
+    # just buffered. Looked up by name, so subclasses can override them.
+    _event_handlers = {
+        '/video/:/transcode/segmented': '_parse_session_event',
+        '/video/:/transcode/universal': '_parse_session_event',
+        '/:/progress': '_parse_timeline_event',
+        '/:/timeline': '_parse_timeline_event',
+        }
+
     def parse_event(self, event_category, event_line):
         if len(event_category) == 0:
             return True
 
-        elif event_category[0] in (
-                "/video/:/transcode/segmented",
-                "/video/:/transcode/universal"):
-
-            return self._parse_session_event(event_category, event_line)
-
-        elif event_category[0] == '/:/progress':
-            return self._parse_timeline_event(event_category, event_line)
-
-        elif event_category[0] == '/:/timeline':
-            return self._parse_timeline_event(event_category, event_line)
-
-        elif event_category[0] == '/:/session_info':
+        handler = self._event_handlers.get(event_category[0])
+        if handler is None:
             return True
 
-        else:
-            return True
+        self._advance_clock(event_line['datetime'])
+        return getattr(self, handler)(event_category, event_line)
 
     def parse_reset(self):
         """Totally resets the controller and its parsers, leaves the
@@ -527,6 +1035,8 @@ class EventParserController(object):
         self.previous_lines.clear()
         self.next_lines.clear()
         self.sessions.clear()
+        self.session_wheel.clear()
+        self.parser_wheel.clear()
 
     def parse_line(self, event_line):
         """Parse an event_line."""
@@ -594,14 +1104,15 @@ class EventParserController(object):
             event_parser = self.event_parsers[event_key]
             if event_parser.first_line:
                 del self.event_parsers[event_key]
+                self.parser_wheel.discard(event_key)
 
             elif (datetime_diff(
                     last_datetime, event_parser.last['datetime']) > 600):
                 event_parser.finish()
                 done_events.append(event_parser.event)
                 del self.event_parsers[event_key]
+                self.parser_wheel.discard(event_key)
 
-        self.debug_stream = None
         return done_events
 
     def parse_flush(self):
@@ -620,6 +1131,7 @@ class EventParserController(object):
                 event_parser.event.live = True
                 done_events.append(event_parser.event)
                 del self.event_parsers[event_key]
+                self.parser_wheel.discard(event_key)
 
         return done_events
 
@@ -633,18 +1145,43 @@ class LogLoader(object):
     don't have enough information, and you are trying to find more info, pass
     this flag as true and it'll pass all log lines to the parser. This can help
     with debugging.
+
+    day_callback(last_datetime, datetime) is called when the first line of
+    a new day is loaded, before it's parsed, so the controller can be
+    checkpointed at day boundaries (see plex.checkpoint.DayCheckpoints).
+
+    Lines older than the last one loaded are dropped, and counted in late
+    unless they're from before the last_datetime it started at. With a
+    lateness (in seconds) lines are put through a ReorderBuffer first, so
+    lines up to lateness seconds out of order are still loaded, call flush()
+    once done to load what it's holding back.
     """
     def __init__(self, controller, last_datetime=None, want_all=False,
-            max_load=None):
+            max_load=None, day_callback=None, lateness=0):
 
         self.controller = controller
         self.last_datetime = last_datetime
         self.want_all = want_all
+        self.day_callback = day_callback
         self.counter = 0
+        self.start_datetime = last_datetime
+        self.late = 0
+
+        if lateness > 0:
+            self.reorder = ReorderBuffer(lateness)
+        else:
+            self.reorder = None
 
         ## For debugging... :)
         self.max_load = max_load
 
+    paths_wanted = (
+        '/:/session_info',
+        '/:/timeline',
+        '/:/progress',
+        '/video/:/transcode',
+        )
+
     def load_file(self, log_file):
 
         if log_file.endswith('.gz'):
@@ -652,55 +1189,108 @@ class LogLoader(object):
         else:
             open_cmd = open
 
-        paths_wanted = (
-            '/:/session_info',
-            '/:/timeline',
-            '/:/progress',
-            '/video/:/transcode',
-            )
+        with open_cmd(log_file, 'rt') as file_handle:
+            self.load_lines(file_handle)
 
-        parse_line = self.controller.parse_line
-        first_line = True
+    def load_lines(self, lines, first_line=True):
+        """Load an iterable of saved (json) log lines.
 
-        with open_cmd(log_file, 'rt') as file_handle:
-            for line in file_handle:
-                if self.max_load is not None and self.counter >= self.max_load:
+        With first_line, lines is treated as the start of a log file, and the
+        whole lot is skipped if the first line is older than last_datetime.
+        """
+        for line in lines:
+            if self.max_load is not None and self.counter >= self.max_load:
+                break
+
+            event_line = json.loads(line)
+            if first_line:
+                first_line = False
+                ## Skip this file if the last_datetime is already set on
+                ## the first line and last_datetime[:3] is bigger than the
+                ## first lines datetime[:3].
+                if (self.last_datetime is not None and
+                        (self.last_datetime[:3] >
+                            event_line['datetime'][:3])):
                     break
 
-                event_line = json.loads(line)
-                if first_line:
-                    first_line = False
-                    ## Skip this file if the last_datetime is already set on
-                    ## the first line and last_datetime[:3] is bigger than the
-                    ## first lines datetime[:3].
-                    if (self.last_datetime is not None and
-                            (self.last_datetime[:3] >
-                                event_line['datetime'][:3])):
-                        break
-
-                # Skip old events...
-                if (self.last_datetime is not None and
-                        self.last_datetime > event_line['datetime']):
-                    continue
+            self.load_line(event_line)
 
-                self.last_datetime = event_line['datetime']
+    def load_line(self, event_line):
+        """Load a single decoded event_line, returns True if any line was
+        parsed (with a reorder buffer it may not be this one).
 
-                if ('content' in event_line and
-                        event_line['content'].startswith('Client [')):
-                    decode_content_session_info(event_line)
+        The event_line may be changed, datetime must be a list like it is in
+        the saved logs.
+        """
+        if self.reorder is None:
+            return self._load_line(event_line)
 
-                if 'url_path' in event_line:
-                    if event_line['url_path'] == '/':
-                        continue
+        if self._skip_line(event_line):
+            return False
 
-                    if (startswith_list(event_line['url_path'], paths_wanted)
-                            is None):
-                        continue
+        released = self.reorder.push(event_line, event_line['datetime'])
+        if released is None:
+            self.late += 1
+            return False
 
-                if (not self.want_all and
-                        'url_path' not in event_line and
-                        'session_info' not in event_line):
-                    continue
+        parsed = False
+        for event_line in released:
+            if self._load_line(event_line):
+                parsed = True
+        return parsed
+
+    def flush(self):
+        """Load the lines held back by the reorder buffer."""
+        if self.reorder is None:
+            return False
 
-                self.counter += 1
-                parse_line(event_line)
+        parsed = False
+        for event_line in self.reorder.flush():
+            if self._load_line(event_line):
+                parsed = True
+        return parsed
+
+    def _skip_line(self, event_line):
+        """True if event_line is older than the last line loaded."""
+        if (self.last_datetime is None or
+                self.last_datetime <= event_line['datetime']):
+            return False
+
+        # Lines from before we started were loaded by an earlier run.
+        if (self.start_datetime is None or
+                self.start_datetime < event_line['datetime']):
+            self.late += 1
+        return True
+
+    def _load_line(self, event_line):
+        # Skip old events...
+        if self._skip_line(event_line):
+            return False
+
+        if (self.day_callback is not None and
+                self.last_datetime is not None and
+                self.last_datetime[:3] != event_line['datetime'][:3]):
+            self.day_callback(self.last_datetime, event_line['datetime'])
+
+        self.last_datetime = event_line['datetime']
+
+        if ('content' in event_line and
+                event_line['content'].startswith('Client [')):
+            decode_content_session_info(event_line)
+
+        if 'url_path' in event_line:
+            if event_line['url_path'] == '/':
+                return False
+
+            if (startswith_list(event_line['url_path'], self.paths_wanted)
+                    is None):
+                return False
+
+        if (not self.want_all and
+                'url_path' not in event_line and
+                'session_info' not in event_line):
+            return False
+
+        self.counter += 1
+        self.controller.parse_line(event_line)
+        return True
@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+
+"""
+Generated inputs, and the code the optimized paths replaced, shared by the
+tests (tests/) and tool-benchmark.py. Like plex.mockserver, nothing here is
+used by the reporter or the daemon themselves.
+"""
+
+import re
+import json
+import random
+import sqlite3
+
+from plex.event import startswith_list
+from plex.media import MediaDocument, plex_media_object
+
+
+def generate_event_lines(count=100000, clients=8, seed=1337):
+    """Generate count event_lines, as LogLoader would pass them on."""
+    rand = random.Random(seed)
+    lines = []
+    clock = [0]
+
+    def line_datetime():
+        # Milliseconds since the start, always going forwards.
+        clock[0] += rand.randint(0, 2000)
+        seconds, milliseconds = divmod(clock[0], 1000)
+        return [
+            2013, 7, 1 + (seconds // 86400) % 28,
+            (seconds // 3600) % 24, (seconds // 60) % 60, seconds % 60,
+            milliseconds]
+
+    def request_line(ip, url_path, url_query):
+        return {
+            'datetime': line_datetime(),
+            'debug_level': 'DEBUG',
+            'file_name': 'Plex Media Server.log',
+            'file_line_no': len(lines) + 1,
+            'method': 'GET',
+            'request_ip': ip,
+            'request_port': str(rand.randint(40000, 60000)),
+            'url_path': url_path,
+            'url_query': url_query,
+            }
+
+    states = []
+    for client_no in range(clients):
+        states.append({
+            'ip': '192.168.1.{0}'.format(10 + client_no),
+            'name': 'Device {0}'.format(client_no),
+            'identifier': '{0:040x}'.format(rand.getrandbits(160)),
+            'session': None,
+            })
+
+    while len(lines) < count:
+        client = rand.choice(states)
+        ip = client['ip']
+
+        if client['session'] is None:
+            client['media_key'] = str(rand.randint(1000, 9999))
+            client['session'] = '{0:032x}'.format(rand.getrandbits(128))
+            client['time'] = 0
+            client['duration'] = rand.randint(20, 120) * 60000
+            lines.append(request_line(
+                ip, '/video/:/transcode/universal/start.m3u8', {
+                    'path': (
+                        'http://127.0.0.1:32400/library/metadata/' +
+                        client['media_key']),
+                    'session': client['session'],
+                    'X-Plex-Device-Name': client['name'],
+                    'X-Plex-Product': 'Plex Web',
+                    }))
+            continue
+
+        choice = rand.random()
+        client['time'] += rand.randint(1000, 10000)
+        state = 'playing' if choice < 0.9 else 'paused'
+        if client['time'] > client['duration']:
+            state = 'stopped'
+
+        if choice < 0.35:
+            lines.append(request_line(
+                ip, '/:/timeline', {
+                    'ratingKey': client['media_key'],
+                    'key': '/library/metadata/' + client['media_key'],
+                    'state': state,
+                    'time': str(client['time']),
+                    'duration': str(client['duration']),
+                    'X-Plex-Client-Identifier': client['identifier'],
+                    'X-Plex-Device-Name': client['name'],
+                    'X-Plex-Product': 'Plex Web',
+                    }))
+        elif choice < 0.5:
+            lines.append(request_line(
+                ip, '/:/progress', {
+                    'key': client['media_key'],
+                    'identifier': 'com.plexapp.plugins.library',
+                    'state': state,
+                    'time': str(client['time']),
+                    }))
+        elif choice < 0.65:
+            lines.append({
+                'datetime': line_datetime(),
+                'debug_level': 'DEBUG',
+                'file_name': 'Plex Media Server.log',
+                'file_line_no': len(lines) + 1,
+                'content': (
+                    'Client [{session}] reporting timeline state {state},'
+                    ' progress of {time}/{duration}ms for'
+                    ' guid=com.plexapp.agents.thetvdb://1/1/1?lang=en,'
+                    ' ratingKey={key} url=, key=/library/metadata/{key},'
+                    ' containerKey=/library/metadata/{key}/children,'
+                    ' metadataId={key}').format(
+                        session=client['identifier'], state=state,
+                        time=client['time'], duration=client['duration'],
+                        key=client['media_key']),
+                })
+        elif choice < 0.9:
+            lines.append(request_line(
+                ip, (
+                    '/video/:/transcode/universal/session/{0}'
+                    '/base/{1:05d}.ts').format(
+                        client['session'], client['time'] // 10000), {}))
+        else:
+            lines.append(request_line(
+                ip, '/library/metadata/{0}/thumb/1372067395'.format(
+                    client['media_key']), {'width': '320', 'height': '180'}))
+
+        if state == 'stopped':
+            lines.append(request_line(
+                ip, '/video/:/transcode/universal/stop', {
+                    'session': client['session']}))
+            client['session'] = None
+
+    return lines
+
+
+def reference_event_categorize(event_line):
+    """event_categorize as it was, a chain of startswith tests, to check the
+    prefix table against."""
+    result = []
+    seen = []
+
+    url_collators = (
+        '/video/:/transcode/segmented',
+        '/video/:/transcode/universal',
+        '/video/:/transcode/session',
+        )
+
+    if 'session_info' in event_line and (
+            'ratingKey' in event_line['session_info'] or
+            'key' in event_line['session_info']):
+        seen.append('url')
+        result.append('/:/session_info')
+        seen.append('session')
+        result.append(event_line['session_info']['session'])
+
+    if 'url_path' in event_line:
+        seen.append('url')
+        startswith = startswith_list(event_line['url_path'], url_collators)
+        if startswith:
+            result.append(startswith)
+        else:
+            result.append(event_line['url_path'])
+
+        if 'request_ip' in event_line:
+            seen.append('ip')
+            result.append(event_line['request_ip'])
+
+        if (event_line['url_path'].startswith(
+                '/video/:/transcode/segmented/session') or
+            event_line['url_path'].startswith(
+                '/video/:/transcode/universal/session')):
+            seen.append('session')
+            result.append(event_line['url_path'].split('/')[6])
+        elif (event_line['url_path'].startswith('/video/:/transcode/session')):
+            seen.append('session')
+            result.append(event_line['url_path'].split('/')[5])
+
+    if 'ip' not in seen and 'request_ip' in event_line:
+        seen.append('ip')
+        result.append(event_line['request_ip'])
+
+    if 'session' not in seen and 'url_query' in event_line:
+        url_query = event_line['url_query']
+        if 'session' in url_query:
+            result.append(url_query['session'])
+        elif 'ratingKey' in url_query:
+            result.append(url_query['ratingKey'])
+        elif 'key' in url_query:
+            result.append(url_query['key'].rsplit('/', 1)[-1])
+        elif 'X-Plex-Device-Name' in url_query:
+            result.append(url_query['X-Plex-Device-Name'])
+
+    return tuple(result)
+
+
+## decode_content_session_info as it was, one regex per field, to check the
+##   single pass scanner against.
+_reference_session_info_re = (
+    re.compile(r'Client \[(?P<session>[^\]]+)]'),
+    re.compile(r'progress of (?P<time>\d+)/(?P<total>\d+)ms'),
+    re.compile(r'for guid=(?P<guid>[^,]*)'),
+    re.compile(r'ratingKey=(?P<ratingKey>\d+)'),
+    re.compile(r'url=(?P<url>[^,]*),'),
+    re.compile(r'key=(?P<key>[^,]*),'),
+    re.compile(r'containerKey=(?P<containerKey>[^,]*),'),
+    re.compile(r'metadataId=(?P<metadataId>\d*)'),)
+
+
+def reference_decode_content_session_info(event_line):
+    result = {}
+    content = event_line['content']
+
+    for regex in _reference_session_info_re:
+        match = regex.search(content)
+        if match is not None:
+            result.update(match.groupdict())
+
+    if 'session' in result:
+        del event_line['content']
+        event_line['session_info'] = result
+
+
+def write_log_file(lines, file_name):
+    """Writes lines as JSON lines, like plex-log-saver saves them."""
+    with open(file_name, 'wt') as file_handle:
+        for line in lines:
+            json.dump(line, file_handle, sort_keys=True)
+            file_handle.write('\n')
+
+
+def generate_media_xml(count, seed=1337):
+    """A metadata response for count items, a mix of episodes (with their
+    series Directory) and movies, like library/metadata/k1,k2,..."""
+    rand = random.Random(seed)
+    ratings = ['TV-MA', 'TV-14', 'TV-PG', 'PG-13', 'R', 'G', '']
+    genres = ['Action', 'Comedy', 'Drama', 'Animation', 'Documentary']
+
+    def children(key):
+        return ''.join([
+            '<Media id="{0}" duration="1800000" videoResolution="720">'
+            '<Part id="{0}" key="/library/parts/{0}/file.mkv"'
+            ' file="/media/{0}.mkv" size="123456789">'
+            '<Stream id="{0}1" streamType="1" codec="h264"/>'
+            '<Stream id="{0}2" streamType="2" codec="aac"/>'
+            '</Part></Media>'.format(key),
+            ''.join(
+                '<Genre tag="{0}"/>'.format(genre)
+                for genre in rand.sample(genres, 2)),
+            '<Writer tag="Someone"/><Director tag="Someone Else"/>',
+            ''.join(
+                '<Role tag="Actor {0}" role="Role {0}"/>'.format(role)
+                for role in range(3)),
+            ])
+
+    items = []
+    series = []
+    keys = []
+    for item_no in range(count):
+        key = 1000 + item_no * 3
+        keys.append(key)
+        attrs = (
+            'ratingKey="{0}" key="/library/metadata/{0}" title="Title {0}"'
+            ' contentRating="{1}" summary="Something happens in {0}."'
+            ' duration="{2}" year="2012" addedAt="1372067395"'
+            ' updatedAt="1372067395" originallyAvailableAt="2012-10-14"'
+            ).format(key, rand.choice(ratings), rand.randint(1, 9) * 600000)
+
+        if item_no % 3 == 0:
+            items.append('<Video {0} type="movie">{1}</Video>'.format(
+                attrs, children(key)))
+        else:
+            series_key = key + 1
+            series.append(
+                '<Directory ratingKey="{0}" type="show" title="Show {0}">'
+                '{1}</Directory>'.format(
+                    series_key, ''.join(
+                        '<Genre tag="{0}"/>'.format(genre)
+                        for genre in rand.sample(genres, 2))))
+            items.append((
+                '<Video {0} type="episode" grandparentRatingKey="{1}"'
+                ' grandparentTitle="Show {1}" parentRatingKey="{2}"'
+                ' parentIndex="1" index="{3}">{4}</Video>').format(
+                    attrs, series_key, key + 2, item_no, children(key)))
+
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<MediaContainer size="{0}">{1}{2}</MediaContainer>').format(
+            count, ''.join(items), ''.join(series))
+    return keys, xml
+
+
+def reference_soup_media(xml, keys):
+    """What plex.media did with BeautifulSoup, per key: find the container,
+    then find the video again at each level of the object."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(xml, 'html.parser')
+    results = {}
+    for key in keys:
+        container_tag = soup.find(ratingkey=str(key))
+        first_tag = soup.find(ratingkey=True)
+        video_tag = soup.find('video', ratingkey=str(key))
+        record = {
+            'title': video_tag.get('title', ''),
+            'rating': video_tag.get('contentrating', ''),
+            'duration': int(video_tag.get('duration', 0)),
+            'parts': [
+                part_tag['id']
+                for media_tag in video_tag.find_all('media', id=True)
+                for part_tag in media_tag.find_all('part', id=True)],
+            }
+        if container_tag.get('type') == 'episode':
+            video_tag = soup.find('video', ratingkey=str(key))
+            series_tag = soup.find(
+                'directory',
+                ratingkey=video_tag.get('grandparentratingkey', '0'))
+            record['genres'] = [
+                genre_tag['tag'] for genre_tag in series_tag.find_all('genre')]
+        else:
+            record['genres'] = [
+                genre_tag['tag'] for genre_tag in video_tag.find_all('genre')]
+        results[key] = record
+    return results
+
+
+def media_records(xml, keys):
+    """What reference_soup_media() gives, from one MediaDocument."""
+    document = MediaDocument(xml)
+    results = {}
+    for key in keys:
+        media_object = plex_media_object(None, key, xml, document)
+        results[key] = {
+            'title': media_object.title,
+            'rating': media_object.rating,
+            'duration': media_object.duration,
+            'parts': media_object.parts,
+            'genres': media_object.genres,
+            }
+    return results
+
+
+_library_schema = '''
+CREATE TABLE library_sections (
+    id INTEGER PRIMARY KEY, name TEXT, section_type INTEGER);
+CREATE TABLE metadata_items (
+    id INTEGER PRIMARY KEY, library_section_id INTEGER, parent_id INTEGER,
+    metadata_type INTEGER, title TEXT, content_rating TEXT, summary TEXT,
+    year INTEGER, duration INTEGER, "index" INTEGER, added_at,
+    updated_at, originally_available_at);
+CREATE TABLE tags (id INTEGER PRIMARY KEY, tag TEXT, tag_type INTEGER);
+CREATE TABLE taggings (
+    id INTEGER PRIMARY KEY, metadata_item_id INTEGER, tag_id INTEGER,
+    "index" INTEGER);
+CREATE TABLE media_items (id INTEGER PRIMARY KEY, metadata_item_id INTEGER);
+CREATE TABLE media_parts (
+    id INTEGER PRIMARY KEY, media_item_id INTEGER, file TEXT);
+'''
+
+
+def generate_library_db(file_name, movies=2000, shows=40, episodes=50,
+        seed=1337):
+    """A Plex library database with the tables plex.librarydb reads, the
+    first few items by hand (text and epoch dates, markup in a summary, a
+    tag that isn't a genre), the rest random."""
+    rand = random.Random(seed)
+    connection = sqlite3.connect(file_name)
+    with connection:
+        connection.executescript(_library_schema)
+        connection.executemany(
+            'INSERT INTO library_sections VALUES (?, ?, ?)',
+            [(1, 'Movies', 1), (2, 'TV Shows', 2)])
+        connection.executemany(
+            'INSERT INTO tags VALUES (?, ?, ?)',
+            [(1, 'Drama', 1), (2, 'War', 1), (3, 'Someone', 4),
+                (4, 'Comedy', 1)])
+
+        items = [
+            (10, 1, None, 1, 'Film', 'R', 's & <b>', 1999, 5000, None,
+                100, '2020-01-01 00:00:00', '1999-05-01 00:00:00'),
+            (20, 2, None, 2, 'Show', 'TV-PG', None, 2001, None, None,
+                100, 150, None),
+            (21, 2, 20, 3, 'Season 1', None, None, None, None, 1,
+                100, 150, None),
+            (22, 2, 21, 4, 'Ep', 'TV-Y', 'x', 2001, 900, 3,
+                100, 120, 978307200),
+            ]
+        taggings = [(10, 2, 1), (10, 1, 0), (20, 1, 0), (10, 3, 0)]
+        media = [(10, '/m/film.mkv'), (22, '/t/ep.mkv')]
+
+        key = 100
+        for movie in range(movies):
+            key += 1
+            items.append((
+                key, 1, None, 1, 'Movie {0}'.format(movie),
+                rand.choice(['G', 'PG', 'R', '']), 'Summary', 2000,
+                rand.randint(60, 180) * 60000, None, 1000 + movie,
+                1000 + movie, '2000-01-01'))
+            taggings.append((key, rand.choice([1, 2, 4]), 0))
+            media.append((key, '/m/{0}.mkv'.format(key)))
+
+        for show in range(shows):
+            key += 1
+            show_key = season_key = key
+            items.append((
+                show_key, 2, None, 2, 'Show {0}'.format(show), 'TV-14', '',
+                2010, None, None, 2000 + show, 2000 + show, None))
+            taggings.append((show_key, rand.choice([1, 4]), 0))
+            for episode in range(episodes):
+                if episode % 10 == 0:
+                    key += 1
+                    season_key = key
+                    items.append((
+                        season_key, 2, show_key, 3, 'Season', None, None,
+                        None, None, episode // 10 + 1, 3000, 3000, None))
+                key += 1
+                items.append((
+                    key, 2, season_key, 4, 'Episode {0}'.format(episode),
+                    'TV-14', 'Summary', 2010, 1800000, episode % 10 + 1,
+                    4000 + key, 4000 + key, '2010-01-01'))
+                media.append((key, '/t/{0}.mkv'.format(key)))
+
+        connection.executemany(
+            'INSERT INTO metadata_items VALUES'
+            ' (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', items)
+        connection.executemany(
+            'INSERT INTO taggings (metadata_item_id, tag_id, "index")'
+            ' VALUES (?, ?, ?)', taggings)
+        for media_id, (item_key, file_name) in enumerate(media, 1):
+            connection.execute(
+                'INSERT INTO media_items VALUES (?, ?)', (media_id, item_key))
+            connection.execute(
+                'INSERT INTO media_parts VALUES (?, ?, ?)',
+                (media_id, media_id, file_name))
+    connection.close()
+
+    return len(items)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+"""
+A local snapshot of the Plex library, ratingKey -> the handful of fields
+reports and restrictions need (type, title, rating, duration, series and
+season keys, genres), so looking them up is a dict hit instead of a
+request to the media server.
+
+It's built by walking library/sections and every section's listing, like
+tool-check-plexdb.py does. After that sync() only asks each section for
+the items whose updatedAt or addedAt is newer than the last sync. Items
+removed from the server are only dropped by a full sync, refresh() does
+one every so often, and skips syncing at all if the last was recent.
+
+File format, zlib compressed JSON after the header:
+
+    header:  b'PLEXLIBX' version:uint16
+    body:    {"synced": int, "checked": float, "full_synced": float,
+              "genres": [str, ...], "items": [row, ...]}
+
+synced is the newest updatedAt/addedAt seen (server time), checked and
+full_synced when the last sync and full sync ran (our time).
+
+where rows are the plex.media.MediaRecord fields in order, with genres as
+indexes into "genres" (empty for episodes, they have their show's).
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+
+from plex.media import MediaRecord, _iterparse
+from plex.util import (
+    PlexException, get_content_rating, RATING_UNKNOWN, get_logger)
+
+
+LIBRARY_MAGIC   = b'PLEXLIBX'
+LIBRARY_VERSION = 1
+
+_header = struct.Struct('>8sH')
+
+# Section type -> the item types (type= of the listing) kept from it,
+# episodes get their genres from their show.
+_section_listings = {
+    'movie': (('movie', 1),),
+    'show':  (('show', 2), ('episode', 4)),
+    }
+
+
+class LibraryIndexException(PlexException):
+    pass
+
+
+def library_sections(conn):
+    """[(key, type), ...] of the library sections on the server."""
+    sections = []
+    xml = conn.fetch('library/sections', cached=False)
+    for event, element in _iterparse(xml, ('start',)):
+        if element.tag == 'Directory' and 'key' in element.attrib:
+            sections.append(
+                (element.attrib['key'], element.attrib.get('type')))
+    return sections
+
+
+class LibraryIndex(object):
+    """LibraryIndex(source=None, clock=time.time)
+
+    See the module docstring, get() and rating_code() are the lookups,
+    sync() and refresh() bring it up to date with a PlexServerConnection.
+    The records' other fields are loaded from source when they're asked
+    for.
+    """
+    def __init__(self, source=None, clock=time.time):
+        self.source = source
+        self.clock = clock
+        # key -> MediaRecord
+        self.items = {}
+        # Newest updatedAt/addedAt seen, None until the first sync
+        self.synced = None
+        # When the last sync, and full sync, ran
+        self.checked = None
+        self.full_synced = None
+        # Types and genres repeat a lot, only keep one copy of each
+        self.strings = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _intern(self, string):
+        return self.strings.setdefault(string, string)
+
+    def _lookup(self, key):
+        ## Event media_keys are whatever was in the log
+        try:
+            return self.items.get(int(key))
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key, default=None):
+        """The MediaRecord for key, an episode's has its show's genres."""
+        item = self._lookup(key)
+        return default if item is None else item
+
+    def rating_code(self, key, default=RATING_UNKNOWN):
+        item = self._lookup(key)
+        if item is None:
+            return default
+        return item.rating_code
+
+    def _item(self, element):
+        item_type = element.get('type')
+        if item_type == 'episode':
+            genres = ()
+        else:
+            genres = tuple(self._intern(genre) for genre in element.genres)
+
+        return MediaRecord(
+            int(element['ratingKey']),
+            self._intern(item_type),
+            element.get('title', ''),
+            get_content_rating(element.get('contentRating', '')),
+            int(element.get('duration', 0)),
+            int(element.get('grandparentRatingKey', 0)),
+            int(element.get('parentRatingKey', 0)),
+            genres,
+            int(element.get('updatedAt', element.get('addedAt', 0))),
+            source=self.source)
+
+    def _link_genres(self):
+        """Episodes share the genres of their show."""
+        for item in self.items.values():
+            if item.type == 'episode':
+                series = self.items.get(item.series_key)
+                item.genres = () if series is None else series.genres
+
+    def _listing_paths(self, section_key, listing_type, since):
+        path = 'library/sections/{0}/all?type={1}'.format(
+            section_key, listing_type)
+        if since is None:
+            return [path]
+        ## >>= is plex's "greater than" filter, a second back so items
+        ##   changed in the same second as the last sync aren't missed.
+        return [
+            '{0}&{1}>>={2}'.format(path, field, since - 1)
+            for field in ('updatedAt', 'addedAt')]
+
+    def sync(self, conn, full=False):
+        """Fetches what changed since the last sync (everything if there
+        wasn't one or full is True), returns the number of items that were
+        new or changed."""
+        logger = get_logger(self, 'sync')
+
+        now = self.clock()
+        since = None if full else self.synced
+        items = {} if since is None else self.items
+        newest = self.synced or 0
+        count = 0
+        # Both listings of an incremental sync can have the same item
+        seen = set()
+
+        for section_key, section_type in library_sections(conn):
+            for item_type, listing_type in _section_listings.get(
+                    section_type, ()):
+                for path in self._listing_paths(
+                        section_key, listing_type, since):
+                    for element in conn.fetch_elements(path, cached=False):
+                        if element.get('type') != item_type:
+                            continue
+                        item = self._item(element)
+                        newest = max(
+                            newest, item.updated_at,
+                            int(element.get('addedAt', 0)))
+                        if item.key in seen:
+                            continue
+                        seen.add(item.key)
+
+                        ## The listings start a second before the last
+                        ##   sync, what's in it again unchanged isn't new.
+                        old = items.get(item.key)
+                        if old is not None and (
+                                old.updated_at == item.updated_at):
+                            continue
+                        items[item.key] = item
+                        count += 1
+
+        self.items = items
+        self.synced = newest
+        self.checked = now
+        if since is None:
+            self.full_synced = now
+        self._link_genres()
+
+        logger.info('Synced {0} items ({1}), {2} in the library'.format(
+            count, 'incremental' if since is not None else 'full',
+            len(self.items)))
+        return count
+
+    def refresh(self, conn, interval=1800, full_interval=604800):
+        """sync() if it's been interval seconds since the last one, a full
+        one if it's been full_interval seconds since the last of those.
+        Returns the number of items read, None if it wasn't time yet."""
+        now = self.clock()
+        if self.checked is not None and now - self.checked < interval:
+            return None
+
+        full = (
+            self.full_synced is None or
+            now - self.full_synced >= full_interval)
+        return self.sync(conn, full)
+
+    def load(self, file_name):
+        """Loads a saved index, returns False if there isn't one."""
+        if not os.path.isfile(file_name):
+            return False
+
+        with open(file_name, 'rb') as file_handle:
+            magic, version = _header.unpack(file_handle.read(_header.size))
+            if magic != LIBRARY_MAGIC:
+                raise LibraryIndexException(
+                    '{0!r} is not a library index'.format(file_name))
+            if version != LIBRARY_VERSION:
+                raise LibraryIndexException((
+                    'Unsupported library index version {0}'
+                    ' in {1!r}').format(version, file_name))
+            data = json.loads(
+                zlib.decompress(file_handle.read()).decode('utf-8'))
+
+        genres = [self._intern(genre) for genre in data['genres']]
+        self.items = {}
+        self.synced = data['synced']
+        ## Not in the first indexes, the next refresh() syncs in full
+        self.checked = data.get('checked')
+        self.full_synced = data.get('full_synced')
+        for row in data['items']:
+            row[1] = self._intern(row[1])
+            row[7] = tuple(genres[index] for index in row[7])
+            item = MediaRecord.from_tuple(row, self.source)
+            self.items[item.key] = item
+        self._link_genres()
+
+        return True
+
+    def save(self, file_name):
+        logger = get_logger(self, 'save')
+
+        genres = {}
+        rows = []
+        for key in sorted(self.items):
+            item = self.items[key]
+            row = list(item.to_tuple())
+            if item.type == 'episode':
+                row[7] = []
+            else:
+                row[7] = [genres.setdefault(genre, len(genres))
+                    for genre in row[7]]
+            rows.append(row)
+
+        data = json.dumps({
+            'synced': self.synced,
+            'checked': self.checked,
+            'full_synced': self.full_synced,
+            'genres': sorted(genres, key=genres.get),
+            'items': rows,
+            }, separators=(',', ':')).encode('utf-8')
+
+        temp_file = file_name + '.tmp'
+        with open(temp_file, 'wb') as file_handle:
+            file_handle.write(_header.pack(LIBRARY_MAGIC, LIBRARY_VERSION))
+            file_handle.write(zlib.compress(data))
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+        os.rename(temp_file, file_name)
+
+        logger.debug('Saved {0} items to {1!r}'.format(
+            len(self.items), file_name))
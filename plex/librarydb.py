@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+"""
+Metadata straight from the Plex Media Server's own library database,
+com.plexapp.plugins.library.db, for when the reporter runs on the same box
+as the server. It's far quicker than asking the server over HTTP.
+
+PlexDatabaseConnection stands in for a plex.media.PlexServerConnection,
+fetch(), fetch_many(), fetch_metadata() and fetch_metadata_many() answer
+library/sections, library/sections/{key}/all and library/metadata/{keys}
+with the same xml the server would (as far as plex.media and plex.library
+look at it), built from one query per batch of keys. fetch_elements() and
+fetch_metadata_document() skip the xml, plex.library's listings and
+plex_media_object_batch() go straight from the rows to MediaElements. Anything else goes to the fallback connection, which isn't
+checked until then.
+
+The database is only ever opened read only. If that fails, plex is
+probably running as another user and we can't share its WAL index, so it's
+opened immutable instead, which may not see the latest writes.
+"""
+
+import os
+import sqlite3
+import calendar
+import datetime
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from urllib.request import pathname2url
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from urllib import pathname2url
+    from urlparse import urlparse, parse_qsl
+
+from plex.media import (
+    PlexServerConnection, PlexServerException, MediaDocument, MediaElement)
+from plex.util import PlexException, get_logger
+
+
+PLEX_DATABASE_FILE = (
+    '/var/lib/plexmediaserver/Library/Application Support'
+    '/Plex Media Server/Plug-in Support/Databases'
+    '/com.plexapp.plugins.library.db')
+
+## metadata_items.metadata_type and library_sections.section_type
+_item_types = {1: 'movie', 2: 'show', 3: 'season', 4: 'episode'}
+_section_types = {1: 'movie', 2: 'show', 8: 'artist', 13: 'photo'}
+_listing_types = {'movie': 1, 'show': 2}
+
+_genre_tag_type = 1
+
+## SQLite's default limit on parameters is 999
+_max_keys = 500
+
+_item_select = '''
+    SELECT
+        item.id, item.metadata_type, item.library_section_id, item.title,
+        item.content_rating, item.summary, item.year, item.duration,
+        item.added_at, item.updated_at, item.originally_available_at,
+        item."index", item.parent_id, parent."index", parent.title,
+        parent.parent_id, grandparent.title
+    FROM metadata_items AS item
+    LEFT JOIN metadata_items AS parent ON parent.id = item.parent_id
+    LEFT JOIN metadata_items AS grandparent
+        ON grandparent.id = parent.parent_id
+    '''
+
+## Plex's filters on listings, the ones plex.library uses
+_filter_operators = {
+    '>>': '>',
+    '<<': '<',
+    '': '=',
+    }
+_filter_columns = {
+    'updatedAt': 'item.updated_at',
+    'addedAt': 'item.added_at',
+    }
+
+
+class PlexDatabaseException(PlexException):
+    pass
+
+
+def _timestamp(value):
+    """Plex has stored dates as epoch seconds and as text, both become
+    epoch seconds."""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    return calendar.timegm(datetime.datetime.strptime(
+        value[:19], '%Y-%m-%d %H:%M:%S').timetuple())
+
+
+def _date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value).date().isoformat()
+    return value[:10]
+
+
+def _chunks(keys):
+    for offset in range(0, len(keys), _max_keys):
+        yield keys[offset:offset + _max_keys]
+
+
+class PlexDatabaseConnection(object):
+    """PlexDatabaseConnection(file_name=PLEX_DATABASE_FILE, fallback=None,
+        immutable=False)
+
+    See the module docstring, fallback is a PlexServerConnection (or None).
+    Raises PlexDatabaseException if the database can't be read.
+    """
+    def __init__(self, file_name=PLEX_DATABASE_FILE, fallback=None,
+            immutable=False):
+        self.file_name = file_name
+        self.fallback = fallback
+        self.enabled = False
+        self.server_info = {}
+        if fallback is not None:
+            self.server_info = fallback.server_info
+        self.fallback_checked = False
+
+        self.connection = None
+        self.connect(immutable)
+
+    def connect(self, immutable=False):
+        logger = get_logger(self, 'connect')
+
+        if not os.path.isfile(self.file_name):
+            raise PlexDatabaseException(
+                'No library database at {0!r}'.format(self.file_name))
+
+        uri = 'file:{0}?mode=ro'.format(
+            pathname2url(os.path.abspath(self.file_name)))
+        if immutable:
+            uri += '&immutable=1'
+
+        try:
+            connection = sqlite3.connect(uri, uri=True)
+            connection.execute('SELECT id FROM metadata_items LIMIT 1')
+        except TypeError:
+            raise PlexDatabaseException(
+                'Opening the library database read only needs python 3')
+        except sqlite3.DatabaseError as err:
+            if immutable:
+                raise PlexDatabaseException(
+                    'Unable to read {0!r}: {1}'.format(self.file_name, err))
+            logger.warning(
+                'Unable to read the library database ({0}),'
+                ' opening it immutable'.format(err))
+            return self.connect(True)
+
+        self.connection = connection
+        self.enabled = True
+        logger.info('Reading metadata from {0!r}'.format(self.file_name))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.enabled = False
+
+    def check_connection(self):
+        if self.fallback is not None:
+            self.fallback.check_connection()
+            self.server_info = self.fallback.server_info
+
+    def _items(self, where, parameters):
+        return self.connection.execute(
+            _item_select + 'WHERE ' + where, parameters).fetchall()
+
+    def _items_for_keys(self, keys):
+        rows = []
+        for chunk in _chunks(keys):
+            rows.extend(self._items(
+                'item.id IN ({0})'.format(', '.join('?' * len(chunk))),
+                chunk))
+        return rows
+
+    def _children(self, keys):
+        """{key: [genre, ...]}, {key: [(media_id, [part, ...])]}, parts as
+        in plex.media.MediaElement."""
+        genres = dict((key, []) for key in keys)
+        media = dict((key, []) for key in keys)
+
+        for chunk in _chunks(keys):
+            marks = ', '.join('?' * len(chunk))
+
+            for key, tag in self.connection.execute((
+                    'SELECT taggings.metadata_item_id, tags.tag'
+                    ' FROM taggings JOIN tags ON tags.id = taggings.tag_id'
+                    ' WHERE tags.tag_type = ?'
+                    ' AND taggings.metadata_item_id IN ({0})'
+                    ' ORDER BY taggings.metadata_item_id, taggings."index"'
+                    ).format(marks), [_genre_tag_type] + list(chunk)):
+                genres[key].append(tag)
+
+            parts = {}
+            for key, media_id, part_id, file_name in self.connection.execute((
+                    'SELECT media_items.metadata_item_id, media_items.id,'
+                    ' media_parts.id, media_parts.file'
+                    ' FROM media_items JOIN media_parts'
+                    ' ON media_parts.media_item_id = media_items.id'
+                    ' WHERE media_items.metadata_item_id IN ({0})'
+                    ' ORDER BY media_items.id, media_parts.id'
+                    ).format(marks), chunk):
+                if media_id not in parts:
+                    parts[media_id] = []
+                    media[key].append((str(media_id), parts[media_id]))
+                part = {
+                    'id': str(part_id),
+                    'key': '/library/parts/{0}/file'.format(part_id),
+                    }
+                if file_name:
+                    part['file'] = file_name
+                parts[media_id].append(part)
+
+        return genres, media
+
+    def _elements(self, rows):
+        """The MediaElements of rows, straight from the database, with the
+        attributes the server's xml would have."""
+        keys = [row[0] for row in rows]
+        genres, media = self._children(keys)
+
+        elements = []
+        for row in rows:
+            (key, metadata_type, section_id, title, content_rating, summary,
+                year, duration, added_at, updated_at, aired_at, index,
+                parent_id, parent_index, parent_title, grandparent_id,
+                grandparent_title) = row
+
+            item_type = _item_types.get(metadata_type)
+            if item_type is None:
+                continue
+
+            attributes = {
+                'ratingKey': key,
+                'key': '/library/metadata/{0}'.format(key),
+                'type': item_type,
+                'title': title,
+                'contentRating': content_rating,
+                'summary': summary,
+                'year': year,
+                'duration': duration,
+                'addedAt': _timestamp(added_at),
+                'updatedAt': _timestamp(updated_at),
+                'originallyAvailableAt': _date(aired_at),
+                'librarySectionID': section_id,
+                'index': index,
+                }
+            if item_type in ('season', 'episode'):
+                attributes['parentRatingKey'] = parent_id
+                attributes['parentTitle'] = parent_title
+            if item_type == 'episode':
+                attributes['parentIndex'] = parent_index
+                attributes['grandparentRatingKey'] = grandparent_id
+                attributes['grandparentTitle'] = grandparent_title
+
+            element = MediaElement(
+                'Video' if item_type in ('movie', 'episode') else 'Directory',
+                dict(
+                    (name, str(value)) for name, value in attributes.items()
+                    if value is not None and value != ''))
+            element.media = media[key]
+            element.genres = genres[key]
+            elements.append(element)
+
+        return elements
+
+    def _container(self, elements, **attrib):
+        """The MediaContainer xml of elements, like the server would send."""
+        container = ElementTree.Element(
+            'MediaContainer', size=str(len(elements)))
+        for key, value in attrib.items():
+            container.set(key, str(value))
+
+        for element in elements:
+            item = ElementTree.SubElement(
+                container, element.tag, element.attrib)
+            for media_id, parts in element.media:
+                media_element = ElementTree.SubElement(
+                    item, 'Media', id=media_id)
+                for part in parts:
+                    ElementTree.SubElement(media_element, 'Part', part)
+            for genre in element.genres:
+                ElementTree.SubElement(item, 'Genre', tag=genre)
+
+        return ElementTree.tostring(container, encoding='unicode')
+
+    def metadata_elements(self, keys):
+        """The MediaElements of library/metadata/{keys}, in one query for up
+        to 500 keys."""
+        keys = [int(key) for key in keys]
+        rows = self._items_for_keys(keys)
+        order = dict((key, offset) for offset, key in enumerate(keys))
+        rows.sort(key=lambda row: order[row[0]])
+        return self._elements(rows)
+
+    def metadata(self, keys):
+        """library/metadata/{keys}, see metadata_elements()."""
+        return self._container(self.metadata_elements(keys))
+
+    def sections(self):
+        container = ElementTree.Element('MediaContainer')
+        rows = self.connection.execute(
+            'SELECT id, name, section_type FROM library_sections'
+            ' ORDER BY id').fetchall()
+        container.set('size', str(len(rows)))
+        for section_id, name, section_type in rows:
+            ElementTree.SubElement(
+                container, 'Directory', key=str(section_id),
+                title=name or '',
+                type=_section_types.get(section_type, str(section_type)))
+        return ElementTree.tostring(container, encoding='unicode')
+
+    def section_elements(self, section_key, query=()):
+        """The MediaElements of library/sections/{section_key}/all, with
+        plex's type= and updatedAt/addedAt filters."""
+        section = self.connection.execute(
+            'SELECT section_type FROM library_sections WHERE id = ?',
+            (int(section_key),)).fetchone()
+        if section is None:
+            raise PlexServerException(
+                'No library section {0}'.format(section_key))
+
+        section_type = _section_types.get(section[0])
+        where = ['item.library_section_id = ?', 'item.metadata_type = ?']
+        parameters = [
+            int(section_key), _listing_types.get(section_type, section[0])]
+
+        for name, value in query:
+            if name == 'type':
+                parameters[1] = int(value)
+                continue
+
+            field = name.rstrip('<>')
+            operator = _filter_operators.get(name[len(field):])
+            if field not in _filter_columns or operator is None:
+                raise PlexServerException(
+                    'Unsupported library filter {0!r}'.format(name))
+
+            ## Compared as epoch seconds either way they're stored
+            column = _filter_columns[field]
+            where.append((
+                "(CASE typeof({0}) WHEN 'text'"
+                " THEN CAST(strftime('%s', {0}) AS INTEGER)"
+                " ELSE {0} END) {1} ?").format(column, operator))
+            parameters.append(int(value))
+
+        return self._elements(self._items(
+            ' AND '.join(where) + ' ORDER BY item.id', parameters))
+
+    def section_items(self, section_key, query=()):
+        """library/sections/{section_key}/all, see section_elements()."""
+        return self._container(
+            self.section_elements(section_key, query),
+            librarySectionID=section_key)
+
+    def _fallback(self, what):
+        if self.fallback is None:
+            raise PlexServerException(
+                'Unable to fetch {0} from the library database'.format(what))
+        if not self.fallback.enabled and not self.fallback_checked:
+            ## Not checked until it's needed, see media_connection()
+            self.fallback_checked = True
+            self.check_connection()
+        return self.fallback
+
+    def _route(self, path):
+        """(method, arguments) of what answers path from the database, the
+        xml and MediaElements ones, None for anything else."""
+        url = urlparse(path.lstrip('/'))
+        parts = url.path.rstrip('/').split('/')
+        query = parse_qsl(url.query)
+
+        if (len(parts) == 4 and parts[:2] == ['library', 'sections'] and
+                parts[3] == 'all' and parts[2].isdigit()):
+            return (
+                self.section_items, self.section_elements, (parts[2], query))
+
+        if (len(parts) == 3 and parts[:2] == ['library', 'metadata'] and
+                len(query) == 0 and
+                all(key.isdigit() for key in parts[2].split(','))):
+            return (
+                self.metadata, self.metadata_elements,
+                (parts[2].split(','),))
+
+        return None
+
+    def fetch(self, path, cached=True):
+        if self.connection is None:
+            return self._fallback(repr(path)).fetch(path, cached)
+
+        if urlparse(path.lstrip('/')).path.rstrip('/') == 'library/sections':
+            return self.sections()
+
+        route = self._route(path)
+        if route is None:
+            return self._fallback(repr(path)).fetch(path, cached)
+        xml_method, elements_method, arguments = route
+        return xml_method(*arguments)
+
+    def fetch_elements(self, path, cached=True):
+        """As PlexServerConnection.fetch_elements(), listings and metadata
+        are made straight from the rows without going through xml."""
+        route = None if self.connection is None else self._route(path)
+        if route is None:
+            return MediaDocument(self.fetch(path, cached)).elements
+        xml_method, elements_method, arguments = route
+        return elements_method(*arguments)
+
+    def fetch_many(self, paths, workers=None):
+        """fetch() for each path, one query each, so there's no point in
+        threads here."""
+        return [self.fetch(path) for path in paths]
+
+    def fetch_metadata_many(self, keys, batch_size=100, workers=None,
+            updated_at=None):
+        """As PlexServerConnection.fetch_metadata_many(), from one query,
+        batch_size, workers and updated_at don't matter here."""
+        if self.connection is None:
+            return self._fallback('metadata').fetch_metadata_many(
+                keys, batch_size, workers, updated_at)
+
+        return dict(
+            (int(element['ratingKey']), self._container([element]))
+            for element in self.metadata_elements(keys))
+
+    def fetch_metadata_document(self, keys, batch_size=100, workers=None,
+            updated_at=None):
+        """As PlexServerConnection.fetch_metadata_document(), the document
+        straight from the rows."""
+        if self.connection is None:
+            return self._fallback('metadata').fetch_metadata_document(
+                keys, batch_size, workers, updated_at)
+
+        metadata = {}
+        document = MediaDocument()
+        for element in self.metadata_elements(keys):
+            metadata[int(element['ratingKey'])] = self._container([element])
+            document.append(element)
+        return metadata, document
+
+    def fetch_metadata(self, key, updated_at=None):
+        assert isinstance(key, int)
+
+        if self.connection is None:
+            return self._fallback(
+                'metadata for {0}'.format(key)).fetch_metadata(key, updated_at)
+
+        elements = self.metadata_elements([key])
+        if len(elements) == 0:
+            raise PlexServerException(
+                'Unable to query metadata for {0}: not in the library'.format(
+                    key))
+        return self._container(elements)
+
+
+def media_connection(config, cache=None):
+    """The metadata source config asks for. With media_source 'database',
+    the library database if it can be read, using the media server as the
+    fallback, otherwise (and by default, 'http') just the media server."""
+    logger = get_logger('media_connection')
+
+    database = config.get('media_source', 'http') == 'database'
+
+    ## The server's only asked if the database can't answer
+    conn = PlexServerConnection(
+        config['plex_server_host'], config['plex_server_port'], cache=cache,
+        check=not database)
+
+    if not database:
+        return conn
+
+    try:
+        return PlexDatabaseConnection(
+            config['plex_database_file'] or PLEX_DATABASE_FILE,
+            fallback=conn)
+    except PlexDatabaseException as err:
+        logger.warning('{0}, using the media server'.format(err))
+        conn.check_connection()
+        return conn
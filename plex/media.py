@@ -27,11 +27,19 @@ THE SOFTWARE.
 
 """
 
+import io
 import requests
 import datetime
+import xml.etree.ElementTree as ElementTree
+from multiprocessing.pool import ThreadPool
 from plex.util import (
     PlexException, get_content_rating, RATING_UNKNOWN, get_logger)
-from bs4 import BeautifulSoup
+from plex.cache import metadata_key, page_key, xml_updated_at
+
+try:
+    from lxml.etree import iterparse, XMLSyntaxError as XMLParseError
+except ImportError:
+    from xml.etree.ElementTree import iterparse, ParseError as XMLParseError
 
 
 class PlexServerException(PlexException):
@@ -43,59 +51,93 @@ class PlexMediaException(PlexException):
 
 
 class PlexServerConnection(object):
-    def __init__(self, host='localhost', port=32400):
+    """PlexServerConnection(host='localhost', port=32400, cache=None,
+        timeout=(3.05, 30), pool_size=8, check=True)
+
+    Pass a plex.cache.MetadataCache as cache to keep what's fetched between
+    runs, metadata_cache, element_cache and page_cache only last as long as
+    this object.
+
+    Requests go through a requests.Session, keeping up to pool_size
+    connections alive, timeout is (connect, read) seconds. With check=False
+    it's disabled until check_connection() is called.
+    """
+    def __init__(self, host='localhost', port=32400, cache=None,
+            timeout=(3.05, 30), pool_size=8, check=True):
         self.host           = host
         self.port           = port
         self.enabled        = False
         self.server_info    = {}
         self.metadata_cache = {}
+        # key -> (xml, [MediaElement, ...]), the xml they were parsed from
+        self.element_cache  = {}
         self.page_cache     = {}
+        self.cache          = cache
+        self.timeout        = timeout
+        self.pool_size      = pool_size
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
 
-        self.check_connection()
+        if check:
+            self.check_connection()
 
     def check_connection(self):
         # Check if medialookup is enabled, and test the connection if so
         logger = get_logger(self, 'check_connection')
         logger.debug("Called check_connection")
         try:
-            check_req = requests.get('http://{host}:{port}/servers'.format(
-                host=self.host, port=self.port))
+            check_req = self._get('servers')
 
-            check_soup = BeautifulSoup(check_req.text)
+            server_info = None
+            for event, element in _iterparse(check_req.text, ('start',)):
+                if element.tag == 'Server':
+                    server_info = element.attrib
+                    break
 
-            server_info = check_soup('server')[0]
+            if server_info is None:
+                raise PlexServerException(
+                    'No server found in {0!r}'.format(check_req.text[:200]))
 
             self.server_info = {}
             self.server_info['name']    = server_info['name']
             self.server_info['host']    = server_info['host']
             self.server_info['port']    = server_info['port']
             self.server_info['address'] = server_info['address']
-            self.server_info['id']      = server_info['machineidentifier']
+            self.server_info['id']      = server_info['machineIdentifier']
             self.server_info['version'] = server_info['version']
 
             self.enabled = True
 
             logger.info("Media connection enabled!")
 
-        except requests.ConnectionError as err:
+        except (requests.ConnectionError, requests.Timeout) as err:
             logger.error('Error checking media server: ' + str(err))
             self.enabled = False
             logger.warning("Media connection disabled!")
 
-    def fetch_metadata(self, key):
+    def fetch_metadata(self, key, updated_at=None):
+        """The metadata xml for key, if updated_at is passed a cached copy
+        is only used if it has the same updatedAt."""
         assert isinstance(key, int)
         logger = get_logger(self, 'fetch_metadata')
 
+        if key in self.metadata_cache:
+            return self.metadata_cache[key]
+
+        if self.cache is not None:
+            xml = self.cache.get(metadata_key(key), updated_at)
+            if xml is not None:
+                self.metadata_cache[key] = xml
+                return xml
+
         if not self.enabled:
             raise PlexServerException(
                 'Unable to query metadata, media connection disabled')
 
-        if key in self.metadata_cache:
-            return self.metadata_cache[key]
-
-        metadata_req = requests.get((
-            'http://{host}:{port}/library/metadata/{key}').format(
-                host=self.host, port=self.port, key=key))
+        metadata_req = self._get('library/metadata/{key}'.format(key=key))
 
         if metadata_req.status_code != 200:
             raise PlexServerException((
@@ -106,20 +148,32 @@ class PlexServerConnection(object):
                     reason=metadata_req.reason))
 
         self.metadata_cache[key] = metadata_req.text
+        if self.cache is not None:
+            self.cache.put(
+                metadata_key(key), metadata_req.text,
+                xml_updated_at(metadata_req.text, key))
         return self.metadata_cache[key]
 
-    def fetch(self, path):
-        logger = get_logger(self, 'fetch')
-
-        if not self.enabled:
-            raise PlexServerException(
-                'Unable to fetch data, media connection disabled')
+    def _get(self, path):
+        return self.session.get(
+            'http://{host}:{port}/{path}'.format(
+                host=self.host, port=self.port, path=path),
+            timeout=self.timeout)
 
+    def _cached_page(self, path):
         if path in self.page_cache:
             return self.page_cache[path]
 
-        page_req = requests.get('http://{host}:{port}/{path}'.format(
-            host=self.host, port=self.port, path=path))
+        if self.cache is not None:
+            xml = self.cache.get(page_key(path))
+            if xml is not None:
+                self.page_cache[path] = xml
+                return xml
+
+        return None
+
+    def _fetch_page(self, path):
+        page_req = self._get(path)
 
         if page_req.status_code != 200:
             raise PlexServerException((
@@ -128,15 +182,315 @@ class PlexServerConnection(object):
                     path=path, status_code=page_req.status_code,
                     reason=page_req.reason))
 
-        self.page_cache[path] = page_req.text
-        return self.page_cache[path]
+        return page_req.text
+
+    def _store_page(self, path, xml):
+        self.page_cache[path] = xml
+        if self.cache is not None:
+            self.cache.put(page_key(path), xml)
+
+    def fetch(self, path, cached=True):
+        """The page at path, with cached=False it's always fetched from the
+        server, and isn't cached either (library listings that change)."""
+        logger = get_logger(self, 'fetch')
+
+        if cached:
+            xml = self._cached_page(path)
+            if xml is not None:
+                return xml
+
+        if not self.enabled:
+            raise PlexServerException(
+                'Unable to fetch data, media connection disabled')
+
+        xml = self._fetch_page(path)
+        if cached:
+            self._store_page(path, xml)
+        return xml
+
+    def _fetch_pages(self, paths, workers=None):
+        """The pages at paths, fetched concurrently by workers threads
+        (defaults to pool_size), in the same order. Nothing's cached."""
+        logger = get_logger(self, '_fetch_pages')
+
+        if not self.enabled:
+            raise PlexServerException(
+                'Unable to fetch data, media connection disabled')
+
+        if workers is None:
+            workers = self.pool_size
+        workers = min(workers, len(paths))
+
+        logger.debug('Fetching {0} pages on {1} threads'.format(
+            len(paths), workers))
+
+        if workers <= 1:
+            return [self._fetch_page(path) for path in paths]
+
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self._fetch_page, paths, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def fetch_elements(self, path, cached=True):
+        """The MediaElements of the page at path, see fetch()."""
+        return MediaDocument(self.fetch(path, cached)).elements
+
+    def fetch_many(self, paths, workers=None):
+        """fetch() for a list of paths, returns their pages in the same
+        order. The ones that aren't cached are fetched concurrently, see
+        _fetch_pages()."""
+        pages = [self._cached_page(path) for path in paths]
+        missing = [path for path, xml in zip(paths, pages) if xml is None]
+        if len(missing) == 0:
+            return pages
+
+        # Only cached here, the cache isn't shared with the threads.
+        fetched = dict(zip(missing, self._fetch_pages(missing, workers)))
+        for path, xml in fetched.items():
+            self._store_page(path, xml)
+
+        return [
+            fetched[path] if xml is None else xml
+            for path, xml in zip(paths, pages)]
+
+    def fetch_metadata_many(self, keys, batch_size=100, workers=None,
+            updated_at=None):
+        """fetch_metadata() for a list of keys, returns a dict of key to
+        its metadata xml, keys the server doesn't know are left out.
+
+        The keys that aren't cached are asked for batch_size at a time
+        (library/metadata/1,2,3), the batches concurrently. Each response
+        is split up and cached per key, like fetch_metadata() would, so
+        it's found again whichever batch it's asked for in. updated_at is
+        a dict of key to updatedAt, for the cache, as in fetch_metadata().
+        """
+        logger = get_logger(self, 'fetch_metadata_many')
+        if updated_at is None:
+            updated_at = {}
+
+        results = {}
+        missing = []
+        for key in keys:
+            assert isinstance(key, int)
+            if key in results:
+                continue
+
+            xml = self.metadata_cache.get(key)
+            if xml is None and self.cache is not None:
+                xml = self.cache.get(metadata_key(key), updated_at.get(key))
+                if xml is not None:
+                    self.metadata_cache[key] = xml
+
+            if xml is None:
+                missing.append(key)
+            else:
+                results[key] = xml
+
+        if len(missing) == 0:
+            return results
+
+        paths = [
+            'library/metadata/' + ','.join(
+                map(str, missing[offset:offset + batch_size]))
+            for offset in range(0, len(missing), batch_size)]
+
+        logger.debug('{0} of {1} keys cached, fetching {2} batches'.format(
+            len(results), len(keys), len(paths)))
+
+        # Cached here, in one transaction per batch, not on the threads.
+        for xml in self._fetch_pages(paths, workers):
+            entries = []
+            for key, (key_xml, key_updated_at, elements) in (
+                    split_metadata(xml).items()):
+                self.metadata_cache[key] = key_xml
+                self.element_cache[key] = (key_xml, elements)
+                entries.append((metadata_key(key), key_xml, key_updated_at))
+            if self.cache is not None:
+                self.cache.put_many(entries)
+
+        for key in missing:
+            if key in self.metadata_cache:
+                results[key] = self.metadata_cache[key]
+
+        return results
+
+    def fetch_metadata_document(self, keys, batch_size=100, workers=None,
+            updated_at=None):
+        """fetch_metadata_many(), and a MediaDocument of every key's
+        metadata. What came in a batch was parsed as it was split up, only
+        the xml taken from the cache is parsed here, once."""
+        metadata = self.fetch_metadata_many(
+            keys, batch_size, workers, updated_at)
+
+        document = MediaDocument()
+        for key, xml in metadata.items():
+            cached = self.element_cache.get(key)
+            if cached is None or cached[0] is not xml:
+                cached = (xml, MediaDocument(xml).elements)
+                self.element_cache[key] = cached
+            for element in cached[1]:
+                document.append(element)
+
+        return metadata, document
+
+
+def _iterparse(xml, events):
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    return iterparse(io.BytesIO(xml), events)
+
+
+def _walk(element):
+    """iterparse's start and end events, for a tree that's already parsed."""
+    yield 'start', element
+    for child in element:
+        for event in _walk(child):
+            yield event
+    yield 'end', element
+
+
+def split_metadata(xml):
+    """Splits a library/metadata/{keys} response into one per item, as the
+    server would answer library/metadata/{key}. Returns a dict of each
+    ratingKey (an int) to its (xml, updatedAt, [MediaElement, ...]), the
+    response is only parsed the once."""
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    try:
+        container = ElementTree.fromstring(xml)
+    except ElementTree.ParseError as err:
+        raise PlexMediaException('Unable to parse xml: {0}'.format(err))
+
+    attrib = dict(container.attrib, size='1')
+    results = {}
+    for element in container:
+        key = element.get('ratingKey')
+        if key is None or not key.isdigit():
+            continue
+        element.tail = None
+
+        item_container = ElementTree.Element(container.tag, attrib)
+        item_container.append(element)
+        updated_at = element.get('updatedAt')
+        key_xml = ElementTree.tostring(item_container).decode('ascii')
+
+        # Read last, MediaDocument clears the elements it's done with
+        document = MediaDocument()
+        document.read(_walk(element))
+        results[int(key)] = (
+            key_xml, None if updated_at is None else int(updated_at),
+            document.elements)
+
+    return results
+
+
+class MediaElement(object):
+    """An element with a ratingKey (Video, Directory, ...), its attributes
+    as they are in the xml, plus its Media/Part and Genre children."""
+    __slots__ = ('tag', 'attrib', 'media', 'genres')
+
+    def __init__(self, tag, attrib):
+        self.tag    = tag
+        self.attrib = attrib
+        # [(media_id, [part, ...]), ...], parts are dicts of id, file, key
+        self.media  = []
+        self.genres = []
+
+    def get(self, name, default=None):
+        return self.attrib.get(name, default)
+
+    def __getitem__(self, name):
+        return self.attrib[name]
+
+
+class MediaDocument(object):
+    """MediaDocument(xml)
+
+    A metadata response parsed in a single pass with iterparse (lxml's if
+    it's installed), into a MediaElement for every element with a
+    ratingKey, in document order. They're indexed by ratingKey as they're
+    parsed, so looking up an item, or the series Directory of an episode,
+    doesn't depend on the size of the response.
+
+    Without xml it starts out empty, see read(), append() and extend().
+    """
+    def __init__(self, xml=None):
+        self.elements = []
+        self.index = {}
+
+        if xml is not None:
+            try:
+                self.read(_iterparse(xml, ('start', 'end')))
+            except XMLParseError as err:
+                raise PlexMediaException(
+                    'Unable to parse xml: {0}'.format(err))
+
+    def read(self, events):
+        """Adds the elements from iterparse's start and end events."""
+        stack = []
+        media = None
+        for event, element in events:
+            tag = element.tag
+            if event == 'end':
+                if len(stack) > 0 and stack[-1][1] is element:
+                    stack.pop()
+                elif tag == 'Media':
+                    media = None
+                # Nothing needs the tree once it's read
+                element.clear()
+
+            elif 'ratingKey' in element.attrib:
+                media_element = MediaElement(tag, dict(element.attrib))
+                self.append(media_element)
+                stack.append((media_element, element))
+
+            elif len(stack) == 0:
+                continue
+
+            elif tag == 'Media' and 'id' in element.attrib:
+                media = []
+                stack[-1][0].media.append((element.attrib['id'], media))
+
+            elif (tag == 'Part' and media is not None and
+                    'id' in element.attrib):
+                part = {'id': element.attrib['id']}
+                if 'file' in element.attrib:
+                    part['file'] = element.attrib['file']
+                if 'key' in element.attrib:
+                    part['key'] = element.attrib['key']
+                media.append(part)
+
+            elif tag == 'Genre' and 'tag' in element.attrib:
+                stack[-1][0].genres.append(element.attrib['tag'])
+
+    def append(self, element):
+        """Adds a MediaElement, as if it'd been parsed at the end."""
+        self.elements.append(element)
+        self.index.setdefault(element['ratingKey'], element)
+
+    def extend(self, document):
+        """Adds the elements of another document, as if they'd been parsed
+        at the end of this one."""
+        self.elements.extend(document.elements)
+        for key, element in document.index.items():
+            self.index.setdefault(key, element)
+
+    def find(self, key, tag=None):
+        """The element with ratingKey key (and tag), None if there's none."""
+        element = self.index.get(str(key))
+        if element is None or (tag is not None and element.tag != tag):
+            return None
+        return element
 
 
 class PlexMediaLibraryObject(object):
-    def __init__(self, key=0, xml=None, soup=None):
+    def __init__(self, key=0, xml=None, document=None):
         assert isinstance(key, int)
         self._key = key
-        self.set_xml(xml, soup)
+        self.set_xml(xml, document)
 
     def get_key(self):
         return self._key
@@ -146,31 +500,38 @@ class PlexMediaLibraryObject(object):
         if hasattr(self, '_xml'):
             self._xml = None
 
-    def set_xml(self, xml, soup=None):
+    def set_xml(self, xml, document=None):
         self.clear()
         if xml is None:
             self._xml = None
         else:
-            self._parse_xml(xml, soup)
+            self._parse_xml(xml, document)
 
     def get_xml(self):
         return self._xml
     xml = property(get_xml, set_xml)
 
-    def _parse_xml(self, xml, soup=None):
-        if soup is None:
-            soup = BeautifulSoup(xml)
+    def _parse_xml(self, xml, document=None):
+        if document is None:
+            document = MediaDocument(xml)
 
-        tag = soup.find(ratingkey=True)
-        if int(tag['ratingkey']) != self.key:
+        element = document.find(self.key)
+        if element is None:
             raise PlexMediaException((
-                'Incorrect xml metadata, passed key {0}, xml key {1}').format(
-                    self.key, int(tag['ratingkey'])))
+                'Incorrect xml metadata, passed key {0} is missing').format(
+                    self.key))
+
+        self._parse_element(element, document)
+
+    def _parse_element(self, element, document):
+        """Fill in the fields from element, the one for our key. Subclasses
+        extend this, rather than looking the element up again."""
+        pass
 
 
 class PlexMediaVideoObject(PlexMediaLibraryObject):
-    def __init__(self, key=0, xml=None, soup=None):
-        super(PlexMediaVideoObject, self).__init__(key, xml, soup)
+    def __init__(self, key=0, xml=None, document=None):
+        super(PlexMediaVideoObject, self).__init__(key, xml, document)
 
     def clear(self):
         super(PlexMediaVideoObject, self).clear()
@@ -190,47 +551,34 @@ class PlexMediaVideoObject(PlexMediaLibraryObject):
         self.media = {}
         self.parts = []
 
-    def _parse_xml(self, xml, soup=None):
-        if soup is None:
-            soup = BeautifulSoup(xml)
-        super(PlexMediaVideoObject, self)._parse_xml(xml, soup)
-        video_tag = soup.find('video', ratingkey=str(self.key))
+    def _parse_element(self, element, document):
+        super(PlexMediaVideoObject, self)._parse_element(element, document)
 
-        self.rating      = video_tag.get('contentrating', '')
+        self.rating      = element.get('contentRating', '')
         self.rating_code = get_content_rating(self.rating)
 
-        self.duration    = int(video_tag.get('duration', 0))
-        self.year        = video_tag.get('year', '1900')
-        self.title       = video_tag.get('title', '')
-        self.summary     = video_tag.get('summary', '')
+        self.duration    = int(element.get('duration', 0))
+        self.year        = element.get('year', '1900')
+        self.title       = element.get('title', '')
+        self.summary     = element.get('summary', '')
 
         self.added_at    = datetime.datetime.fromtimestamp(
-            float(video_tag.get('addedat', 0)))
+            float(element.get('addedAt', 0)))
         self.aired_at    = datetime.datetime(*map(
             int,
-            video_tag.get('originallyavailableat', '1900-1-1').split('-')))
+            element.get('originallyAvailableAt', '1900-1-1').split('-')))
 
         ## TODO: Make this better, but I haven't really needed this yet,
         ## so I haven't decided how it needs to be laid out.
-        media_tags = video_tag.find_all('media', id=True)
-        for media_tag in media_tags:
-            media_id = media_tag['id']
-            self.media[media_id] = []
-            part_tags = media_tag.find_all('part', id=True)
-            for part_tag in part_tags:
-                part_id = part_tag['id']
-                part = {'id': part_id}
-                if part_tag.has_attr('file'):
-                    part['file'] = part_tag['file']
-                if part_tag.has_attr('key'):
-                    part['key'] = part_tag['key']
-                self.media[media_id].append(part)
-                self.parts.append(part_id)
+        for media_id, parts in element.media:
+            self.media[media_id] = parts
+            for part in parts:
+                self.parts.append(part['id'])
 
 
 class PlexMediaEpisodeObject(PlexMediaVideoObject):
-    def __init__(self, key=0, xml=None, soup=None):
-        super(PlexMediaEpisodeObject, self).__init__(key, xml)
+    def __init__(self, key=0, xml=None, document=None):
+        super(PlexMediaEpisodeObject, self).__init__(key, xml, document)
 
     def clear(self):
         super(PlexMediaEpisodeObject, self).clear()
@@ -241,23 +589,18 @@ class PlexMediaEpisodeObject(PlexMediaVideoObject):
         self.episode      = 0
         self.genres       = None
 
-    def _parse_xml(self, xml, soup=None):
-        if soup is None:
-            soup = BeautifulSoup(xml)
-        super(PlexMediaEpisodeObject, self)._parse_xml(xml, soup)
-        video_tag = soup.find('video', ratingkey=str(self.key))
+    def _parse_element(self, element, document):
+        super(PlexMediaEpisodeObject, self)._parse_element(element, document)
 
-        self.series_key   = int(video_tag.get('grandparentratingkey', 0))
-        self.series_title = video_tag.get('grandparenttitle', 'Unknown')
-        self.season_key   = int(video_tag.get('parentratingkey', 0))
-        self.season       = int(video_tag.get('parentindex', 0))
-        self.episode      = int(video_tag.get('index', 0))
+        self.series_key   = int(element.get('grandparentRatingKey', 0))
+        self.series_title = element.get('grandparentTitle', 'Unknown')
+        self.season_key   = int(element.get('parentRatingKey', 0))
+        self.season       = int(element.get('parentIndex', 0))
+        self.episode      = int(element.get('index', 0))
 
-        series_tag = soup.find('directory', ratingkey=str(self.series_key))
-        if series_tag is not None:
-            self.genres = []
-            for genre_tag in series_tag.find_all('genre'):
-                self.genres.append(genre_tag['tag'])
+        series_element = document.find(self.series_key, 'Directory')
+        if series_element is not None:
+            self.genres = list(series_element.genres)
 
     def __repr__(self):
         return (
@@ -274,21 +617,16 @@ class PlexMediaEpisodeObject(PlexMediaVideoObject):
 
 
 class PlexMediaMovieObject(PlexMediaVideoObject):
-    def __init__(self, key=0, xml=None, soup=None):
-        super(PlexMediaMovieObject, self).__init__(key, xml)
+    def __init__(self, key=0, xml=None, document=None):
+        super(PlexMediaMovieObject, self).__init__(key, xml, document)
 
     def clear(self):
         super(PlexMediaMovieObject, self).clear()
+        self.genres = []
 
-    def _parse_xml(self, xml, soup=None):
-        if soup is None:
-            soup = BeautifulSoup(xml)
-        super(PlexMediaMovieObject, self)._parse_xml(xml, soup)
-
-        series_tag = soup.find('video', ratingkey=str(self.key))
-        if series_tag is not None:
-            for genre_tag in series_tag.find_all('genre'):
-                self.genres.append(genre_tag['tag'])
+    def _parse_element(self, element, document):
+        super(PlexMediaMovieObject, self)._parse_element(element, document)
+        self.genres = list(element.genres)
 
     def __repr__(self):
         return (
@@ -301,23 +639,134 @@ class PlexMediaMovieObject(PlexMediaVideoObject):
                 us=self)
 
 
-def plex_media_object(conn, key, xml=None, soup=None):
+class MediaRecord(object):
+    """MediaRecord(key, type='', title='', rating_code=RATING_UNKNOWN,
+        duration=0, series_key=0, season_key=0, genres=(), updated_at=0,
+        source=None)
+
+    The fields of a media object that reports and restrictions use, small
+    enough to keep the whole library in memory. They're made straight from
+    a dict or tuple (a cache, plex.library's snapshot) without any xml.
+
+    Anything else a PlexMediaVideoObject has (summary, media, parts, year,
+    added_at, ...) is loaded the first time it's asked for, from the
+    metadata source (a PlexServerConnection or alike). Without a source
+    that raises PlexMediaException.
+    """
+    __slots__ = (
+        'key', 'type', 'title', 'rating_code', 'duration',
+        'series_key', 'season_key', 'genres', 'updated_at',
+        'source', '_details')
+
+    fields = __slots__[:9]
+
+    ## What's only in the full object, see details()
+    detail_fields = frozenset((
+        'rating', 'year', 'summary', 'added_at', 'aired_at', 'media',
+        'parts', 'series_title', 'season', 'episode', 'xml'))
+
+    def __init__(self, key, type='', title='', rating_code=RATING_UNKNOWN,
+            duration=0, series_key=0, season_key=0, genres=(), updated_at=0,
+            source=None):
+        self.key         = int(key)
+        self.type        = type
+        self.title       = title
+        self.rating_code = rating_code
+        self.duration    = duration
+        self.series_key  = series_key
+        self.season_key  = season_key
+        self.genres      = genres
+        self.updated_at  = updated_at
+        self.source      = source
+        self._details    = None
+
+    @classmethod
+    def from_tuple(cls, values, source=None):
+        """values in the order of MediaRecord.fields."""
+        return cls(*values, source=source)
+
+    @classmethod
+    def from_dict(cls, values, source=None):
+        return cls(source=source, **dict(
+            (name, values[name]) for name in cls.fields if name in values))
+
+    @classmethod
+    def from_object(cls, media_object, source=None):
+        """The record of a PlexMediaVideoObject, which is kept as its
+        details."""
+        if isinstance(media_object, PlexMediaEpisodeObject):
+            media_type = 'episode'
+        else:
+            media_type = 'movie'
+
+        record = cls(
+            media_object.key,
+            media_type,
+            media_object.title,
+            media_object.rating_code,
+            media_object.duration,
+            getattr(media_object, 'series_key', 0),
+            getattr(media_object, 'season_key', 0),
+            tuple(media_object.genres or ()),
+            source=source)
+        record._details = media_object
+        return record
+
+    def to_tuple(self):
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.fields)
+
+    def details(self):
+        """The full media object, fetched from source the first time."""
+        if self._details is None:
+            if self.source is None:
+                raise PlexMediaException(
+                    'No metadata source to load {0} from'.format(self.key))
+            self._details = plex_media_object(self.source, self.key)
+        return self._details
+
+    def __getattr__(self, name):
+        # Only called for what isn't a slot
+        if name not in MediaRecord.detail_fields:
+            raise AttributeError(name)
+        return getattr(self.details(), name)
+
+    ## The source and details aren't kept, they'd pickle the connection.
+    def __getstate__(self):
+        return self.to_tuple()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return (
+            '<{us.__class__.__name__}'
+            ' key={us.key},'
+            ' type={us.type!r},'
+            ' rating_code={us.rating_code},'
+            ' genres={us.genres},'
+            ' title={us.title!r}>').format(
+                us=self)
+
+
+def plex_media_object(conn, key, xml=None, document=None):
     """
     passing: conn, key -- will retrieve the xml from the server
-    passing: key, xml[, soup] -- will just parse the possibly cached xml
+    passing: key, xml[, document] -- will just parse the possibly cached xml
     """
     if key is None and xml is None:
         raise TypeError(
             "Require argument 'key' or 'xml' must not be None")
 
     if key is None:
-        if soup is None:
-            soup = BeautifulSoup(xml)
-        container_tag = soup.find(ratingkey=True)
-        if container_tag is None:
+        if document is None:
+            document = MediaDocument(xml)
+        if len(document.elements) == 0:
             raise TypeError(
                 'Invalid xml passed, ratingKey="key" missing!')
-        key = int(container_tag.get('ratingkey', 0))
+        key = int(document.elements[0].get('ratingKey', 0))
 
     elif xml is None:
         if conn is None:
@@ -325,16 +774,24 @@ def plex_media_object(conn, key, xml=None, soup=None):
                 'Argument conn required if xml is None')
         xml = conn.fetch_metadata(key)
 
-    if soup is None:
-        soup = BeautifulSoup(xml)
+    if document is None:
+        document = MediaDocument(xml)
+
+    element = document.find(key)
+    if element is None:
+        raise PlexMediaException(
+            'No metadata for {0}'.format(key))
+
+    return _media_object_class(key, element)(key, xml, document)
+
 
-    container_tag = soup.find(ratingkey=str(key))
-    if container_tag.name == 'video':
-        video_type = container_tag.get('type', None)
+def _media_object_class(key, element):
+    if element.tag == 'Video':
+        video_type = element.get('type', None)
         if video_type == 'episode':
-            return PlexMediaEpisodeObject(key, xml, soup)
+            return PlexMediaEpisodeObject
         elif video_type == 'movie':
-            return PlexMediaMovieObject(key, xml, soup)
+            return PlexMediaMovieObject
         else:
             raise PlexMediaException(
                 'Unknown video type {0!r}'.format(video_type))
@@ -343,12 +800,17 @@ def plex_media_object(conn, key, xml=None, soup=None):
             'Unknown media type for {0}'.format(key))
 
 
-## TODO: allow PlexServerConnection to cache something like this...
-def plex_media_object_batch(conn, keys, batch_size=20):
+def plex_media_object_batch(conn, keys, batch_size=100, workers=None):
     """
     Batch fetch metadata from media server. :)
     Can be used with episodes to get more info by passing the series_key as an
     object to get.
+
+    The metadata comes from conn.fetch_metadata_many(), which only asks the
+    server for the keys it hasn't cached, batch_size at a time. Every key's
+    elements end up in one document (conn.fetch_metadata_document()), so an
+    episode finds its series whichever batch it came in, and every object is
+    built from its own indexed element.
     """
     if not isinstance(keys, (list, tuple)):
         raise TypeError("Required argument 'keys' must be a list or tuple.")
@@ -359,32 +821,20 @@ def plex_media_object_batch(conn, keys, batch_size=20):
     logger = get_logger('plex_media_object_batch')
     logger.debug("Fetching {0} media objects".format(len(keys)))
 
-    results = {}
-    all_keys = keys[:]
-
-    while len(all_keys) > 0:
-        working_keys = all_keys[:batch_size]
-        all_keys = all_keys[batch_size:]
-        req = 'library/metadata/' + ','.join(map(str, working_keys))
-
-        logger.debug("-> {0}".format(', '.join(map(str, working_keys))))
+    metadata, document = conn.fetch_metadata_document(
+        [int(key) for key in keys], batch_size, workers)
 
-        xml = conn.fetch(req)
-        soup = BeautifulSoup(xml)
-
-        for container_tag in soup.find_all(ratingkey=True):
-            container_key = container_tag['ratingkey']
-            if container_key in results:
-                continue
+    results = {}
+    for key, xml in metadata.items():
+        element = document.find(key)
+        if element is None:
+            continue
+        try:
+            media_class = _media_object_class(key, element)
+        except PlexMediaException:
+            continue
 
-            try:
-                ## --TODO--: Extract the soup object, suitable for passing down
-                ##   to plex_media_object
-                ## FIX: Just send it all, the media objects are smarter...
-                results[container_key] = plex_media_object(
-                    conn, int(container_key), xml, soup)
-            except PlexMediaException:
-                pass
+        results[str(key)] = media_class(key, xml, document)
 
     logger.debug("Fetched {0} media objects".format(len(results)))
 
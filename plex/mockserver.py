@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+"""
+A stand-in for the Plex Media Server, serving a generated library over
+HTTP on localhost, so the media code can be run and benchmarked without a
+real server:
+
+    /servers
+    /library/sections
+    /library/sections/{key}/all     (with type= and updatedAt/addedAt>>=)
+    /library/metadata/{key,key,...}
+
+    with MockPlexServer(latency=0.01, error_rate=0.05) as server:
+        conn = PlexServerConnection(*server.address)
+
+Every request can be delayed by latency seconds (or a random amount in a
+(low, high) range), and fails with a 500 error_rate of the time. The
+library is the same for the same seed.
+"""
+
+import time
+import random
+import threading
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+
+from plex.util import get_logger
+
+
+_ratings = ['TV-MA', 'TV-14', 'TV-PG', 'TV-Y', 'PG-13', 'R', 'G', '']
+_genres = ['Action', 'Comedy', 'Drama', 'Animation', 'Documentary']
+
+## type= of library listings
+_listing_types = {1: 'movie', 2: 'show', 3: 'season', 4: 'episode'}
+
+
+class MockItem(object):
+    """An item of the library, as its element in a metadata response."""
+    def __init__(self, tag, attrib, genres=(), media=()):
+        self.tag = tag
+        self.attrib = attrib
+        self.genres = list(genres)
+        # [(media_id, [part_id, ...]), ...]
+        self.media = list(media)
+
+    def element(self, parent):
+        element = ElementTree.SubElement(parent, self.tag, dict(
+            (name, str(value)) for name, value in self.attrib.items()))
+        for media_id, parts in self.media:
+            media = ElementTree.SubElement(
+                element, 'Media', id=str(media_id), duration=str(
+                    self.attrib.get('duration', 0)))
+            for part_id in parts:
+                ElementTree.SubElement(
+                    media, 'Part', id=str(part_id),
+                    key='/library/parts/{0}/file.mkv'.format(part_id),
+                    file='/media/{0}.mkv'.format(part_id))
+        for genre in self.genres:
+            ElementTree.SubElement(element, 'Genre', tag=genre)
+        return element
+
+
+class MockLibrary(object):
+    """MockLibrary(movies=200, shows=20, seasons=2, episodes=10, seed=1337)
+
+    A movie section (key 1) and a TV section (key 2), items is ratingKey ->
+    MockItem.
+    """
+    def __init__(self, movies=200, shows=20, seasons=2, episodes=10,
+            seed=1337):
+        self.rand = random.Random(seed)
+        self.clock = 1372067395
+        self.items = {}
+        self.sections = [('1', 'movie', 'Movies'), ('2', 'show', 'TV Shows')]
+        self.next_key = 1000
+
+        for movie_no in range(movies):
+            self._add('Video', 'movie', '1', media=True, genres=2)
+
+        for show_no in range(shows):
+            show = self._add('Directory', 'show', '2', genres=2)
+            for season_no in range(1, seasons + 1):
+                season = self._add(
+                    'Directory', 'season', '2', index=season_no,
+                    parentRatingKey=show.attrib['ratingKey'],
+                    parentTitle=show.attrib['title'])
+                for episode_no in range(1, episodes + 1):
+                    self._add(
+                        'Video', 'episode', '2', media=True,
+                        index=episode_no,
+                        parentIndex=season_no,
+                        parentRatingKey=season.attrib['ratingKey'],
+                        grandparentRatingKey=show.attrib['ratingKey'],
+                        grandparentTitle=show.attrib['title'])
+
+    def _add(self, tag, item_type, section, media=False, genres=0, **attrib):
+        key = self.next_key
+        self.next_key += 1
+        self.clock += self.rand.randint(1, 3600)
+
+        attrib.update({
+            'ratingKey': key,
+            'key': '/library/metadata/{0}'.format(key),
+            'type': item_type,
+            'title': '{0} {1}'.format(item_type.title(), key),
+            'contentRating': self.rand.choice(_ratings),
+            'summary': 'Something happens in {0}.'.format(key),
+            'year': self.rand.randint(1950, 2013),
+            'addedAt': self.clock,
+            'updatedAt': self.clock,
+            'originallyAvailableAt': '2012-10-14',
+            'librarySectionID': section,
+            })
+        if media:
+            attrib['duration'] = self.rand.randint(1, 9) * 600000
+
+        item = MockItem(
+            tag, attrib, self.rand.sample(_genres, genres),
+            [(key, [key])] if media else [])
+        self.items[key] = item
+        return item
+
+    def update(self, key, **attrib):
+        """Changes an item, like the server would when it's edited."""
+        self.clock += 1
+        item = self.items[int(key)]
+        item.attrib.update(attrib)
+        item.attrib['updatedAt'] = self.clock
+
+    def _container(self, items, **attrib):
+        container = ElementTree.Element('MediaContainer', dict(
+            (name, str(value)) for name, value in attrib.items()))
+        for item in items:
+            item.element(container)
+        container.set('size', str(len(container)))
+        return ElementTree.tostring(container, encoding='utf-8')
+
+    def servers_xml(self, host, port):
+        container = ElementTree.Element('MediaContainer', size='1')
+        ElementTree.SubElement(
+            container, 'Server', name='Mock Plex Media Server', host=host,
+            address=host, port=str(port), machineIdentifier='mock',
+            version='0.9.7.28')
+        return ElementTree.tostring(container, encoding='utf-8')
+
+    def sections_xml(self):
+        container = ElementTree.Element(
+            'MediaContainer', size=str(len(self.sections)))
+        for key, section_type, title in self.sections:
+            ElementTree.SubElement(
+                container, 'Directory', key=key, type=section_type,
+                title=title)
+        return ElementTree.tostring(container, encoding='utf-8')
+
+    def section_xml(self, section_key, query=()):
+        """None if there's no section_key, raises ValueError on filters it
+        doesn't know."""
+        section_types = dict(
+            (key, section_type) for key, section_type, title in self.sections)
+        if section_key not in section_types:
+            return None
+
+        item_type = section_types[section_key]
+        filters = []
+        for name, value in query:
+            if name == 'type':
+                item_type = _listing_types[int(value)]
+            elif name in ('updatedAt>>', 'addedAt>>'):
+                filters.append((name[:-2], int(value)))
+            else:
+                raise ValueError('Unsupported filter {0!r}'.format(name))
+
+        items = [
+            item for key, item in sorted(self.items.items())
+            if item.attrib['librarySectionID'] == section_key and
+                item.attrib['type'] == item_type and
+                all(item.attrib[field] > value for field, value in filters)]
+        return self._container(items, librarySectionID=section_key)
+
+    def metadata_xml(self, keys):
+        """None if none of keys are in the library."""
+        items = [
+            self.items[int(key)] for key in keys
+            if key.isdigit() and int(key) in self.items]
+        if len(items) == 0:
+            return None
+        return self._container(items)
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle every kept alive
+    # request would wait on a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        get_logger(self, 'log_message').debug(format % args)
+
+    def _send(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+        server.delay()
+
+        if server.fail():
+            self._send(500, b'Internal Server Error')
+            return
+
+        library = server.library
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        query = parse_qsl(url.query)
+
+        try:
+            if parts == ['servers']:
+                body = library.servers_xml(*server.address)
+            elif parts == ['library', 'sections']:
+                body = library.sections_xml()
+            elif (len(parts) == 4 and parts[:2] == ['library', 'sections']
+                    and parts[3] == 'all'):
+                body = library.section_xml(parts[2], query)
+            elif len(parts) == 3 and parts[:2] == ['library', 'metadata']:
+                body = library.metadata_xml(parts[2].split(','))
+            else:
+                body = None
+        except (KeyError, ValueError):
+            self._send(400, b'Bad Request')
+            return
+
+        if body is None:
+            self._send(404, b'Not Found')
+        else:
+            self._send(200, body)
+
+
+class MockPlexServer(ThreadingMixIn, HTTPServer):
+    """MockPlexServer(library=None, host='127.0.0.1', port=0, latency=0,
+        error_rate=0.0, seed=1337)
+
+    See the module docstring, library defaults to a MockLibrary(seed=seed),
+    port 0 picks a free one. start() serves it on a thread (the with
+    statement starts and stops it), address is (host, port) once it's
+    bound. requests and errors count what it's served.
+    """
+    daemon_threads = True
+
+    def __init__(self, library=None, host='127.0.0.1', port=0, latency=0,
+            error_rate=0.0, seed=1337):
+        HTTPServer.__init__(self, (host, port), _MockRequestHandler)
+        self.library = library if library is not None else MockLibrary(
+            seed=seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.requests = 0
+        self.errors = 0
+
+    def get_address(self):
+        return self.server_address[:2]
+    address = property(get_address)
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            with self.lock:
+                seconds = self.rand.uniform(*self.latency)
+        else:
+            seconds = self.latency
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            failed = self.rand.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+"""
+Rebuilding events from saved logs across multiple processes.
+
+Events are keyed by their event_category, which holds the client ip, and
+transcode sessions are tracked by client ip too, so lines from different
+clients never affect each other. ShardedLogLoader hashes the request_ip of
+each saved line to one of its shard processes, each of which runs its own
+LogLoader and EventParserController. Lines without a request_ip (session_info
+content lines) are sent to every shard.
+
+The parent process only looks at the raw text of each line, the json
+decoding and event parsing happens in the shards.
+
+reprocess_days splits by time instead, each run of days between two day
+checkpoints (plex.checkpoint.DayCheckpoints) is rebuilt by its own process
+starting from its own checkpoint.
+"""
+
+import os
+import re
+import gzip
+import json
+import zlib
+import datetime
+import traceback
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from plex.util import PlexException, get_logger
+from plex.event import EventParserController, LogLoader, PlexEvent
+from plex.checkpoint import DayCheckpoints
+
+
+_request_ip_re = re.compile(r'"request_ip": "([^"]*)"')
+
+# Seconds between checks on the shards while waiting on their queues.
+_poll_interval = 1.0
+
+
+class ShardException(PlexException):
+    pass
+
+
+def _shard_worker(line_queue, result_queue, shard_no, last_datetime,
+        want_all, controller_kwargs):
+    lines = []
+    try:
+        controller = EventParserController(**controller_kwargs)
+        loader = LogLoader(
+            controller, last_datetime=last_datetime, want_all=want_all)
+
+        while True:
+            lines = line_queue.get()
+            if lines is None:
+                break
+            loader.load_lines(lines, first_line=False)
+
+        controller.parse_finish()
+        done_events = controller.parse_dump(loader.last_datetime)
+        live_events = controller.parse_flush()
+
+        result = (
+            'done', shard_no,
+            [event.to_dict() for event in done_events],
+            [event.to_dict() for event in live_events],
+            loader.counter,
+            controller.get_stats())
+
+    except Exception:
+        result_queue.put(('error', shard_no, traceback.format_exc()))
+        ## Keep taking lines until the parent notices, so it never blocks
+        ## on a full queue.
+        while lines is not None:
+            lines = line_queue.get()
+        return
+
+    result_queue.put(result)
+
+
+class ShardedLogLoader(object):
+    """ShardedLogLoader(shards=None, last_datetime=None, want_all=False,
+        batch_size=1000, **controller_kwargs)
+
+    Works like a LogLoader feeding an EventParserController, but spreads the
+    lines over shards worker processes (defaults to the cpu count). Call
+    load_file() for each saved log, then finish() to get the events back.
+
+    Since each shard only sees the lines of its own clients, the
+    previous/next line buffers of its EventParsers do too.
+
+    If a shard fails (a line it can't decode, ...) or dies, the next
+    load_file() or finish() raises ShardException and the other shards are
+    terminated.
+    """
+    def __init__(self, shards=None, last_datetime=None, want_all=False,
+            batch_size=1000, **controller_kwargs):
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+
+        self.shards = shards
+        self.last_datetime = last_datetime
+        self.want_all = want_all
+        self.batch_size = batch_size
+        self.counter = 0
+        self.stats = []
+
+        self.result_queue = multiprocessing.Queue()
+        self.line_queues = []
+        self.workers = []
+        self.batches = []
+        self.results = [None] * shards
+
+        for shard_no in range(shards):
+            # Bounded, so a slow shard pushes back on the reader.
+            line_queue = multiprocessing.Queue(8)
+            worker = multiprocessing.Process(
+                target=_shard_worker,
+                args=(line_queue, self.result_queue, shard_no,
+                    last_datetime, want_all, controller_kwargs))
+            worker.daemon = True
+            worker.start()
+
+            self.line_queues.append(line_queue)
+            self.workers.append(worker)
+            self.batches.append([])
+
+    def _terminate(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        ## Nobody is left to read what's still buffered, don't wait on it
+        ## at exit.
+        for line_queue in self.line_queues:
+            line_queue.cancel_join_thread()
+
+    def _result(self, result):
+        if result[0] == 'error':
+            self._terminate()
+            raise ShardException('Shard {0} failed:\n{1}'.format(
+                result[1], result[2]))
+        self.results[result[1]] = result[2:]
+
+    def _check_workers(self):
+        """Raises ShardException if a shard failed, or died without a
+        result."""
+        ## Whatever a shard sent is in the queue before it exits, so look at
+        ## which are dead before taking the results.
+        dead = [
+            shard_no for shard_no, worker in enumerate(self.workers)
+            if not worker.is_alive()]
+
+        while True:
+            try:
+                self._result(self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for shard_no in dead:
+            if self.results[shard_no] is None:
+                self._terminate()
+                raise ShardException(
+                    'Shard {0} died, exit code {1}'.format(
+                        shard_no, self.workers[shard_no].exitcode))
+
+    def _send(self, shard_no, batch):
+        while True:
+            try:
+                self.line_queues[shard_no].put(batch, timeout=_poll_interval)
+                return
+            except queue.Full:
+                self._check_workers()
+
+    def _put(self, shard_no, line):
+        batch = self.batches[shard_no]
+        batch.append(line)
+        if len(batch) >= self.batch_size:
+            self._send(shard_no, batch)
+            self.batches[shard_no] = []
+
+    def _put_all(self, line):
+        for shard_no in range(self.shards):
+            self._put(shard_no, line)
+
+    def load_file(self, log_file):
+        if log_file.endswith('.gz'):
+            open_cmd = gzip.open
+        else:
+            open_cmd = open
+
+        shards = self.shards
+        first_line = True
+
+        with open_cmd(log_file, 'rt') as file_handle:
+            for line in file_handle:
+                if first_line:
+                    first_line = False
+                    ## Same as LogLoader, skip files older than last_datetime
+                    event_line = json.loads(line)
+                    if (self.last_datetime is not None and
+                            (self.last_datetime[:3] >
+                                event_line['datetime'][:3])):
+                        break
+
+                match = _request_ip_re.search(line)
+                if match is not None:
+                    request_ip = match.group(1).encode('utf-8')
+                    self._put(zlib.crc32(request_ip) % shards, line)
+                elif self.want_all or '"content": "Client [' in line:
+                    self._put_all(line)
+                else:
+                    continue
+
+                self.counter += 1
+
+    def finish(self):
+        """Waits for the shards, returns (done_events, live_events).
+
+        Both are lists of PlexEvents, sorted by their start.
+        """
+        logger = get_logger(self, 'finish')
+
+        for shard_no in range(self.shards):
+            if len(self.batches[shard_no]) > 0:
+                self._send(shard_no, self.batches[shard_no])
+                self.batches[shard_no] = []
+            self._send(shard_no, None)
+
+        while None in self.results:
+            try:
+                self._result(self.result_queue.get(timeout=_poll_interval))
+            except queue.Empty:
+                self._check_workers()
+
+        done_events = []
+        live_events = []
+        self.stats = [None] * self.shards
+        for shard_no, result in enumerate(self.results):
+            done, live, counter, stats = result
+            logger.debug('Shard {0}: {1} lines, {2}'.format(
+                shard_no, counter, stats))
+            done_events.extend(PlexEvent(**event) for event in done)
+            live_events.extend(PlexEvent(**event) for event in live)
+            self.stats[shard_no] = stats
+
+        for worker in self.workers:
+            worker.join()
+
+        done_events.sort(key=lambda event: event.start)
+        live_events.sort(key=lambda event: event.start)
+        return done_events, live_events
+
+
+_log_day_re = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+
+def log_file_day(log_file):
+    """The (year, month, day) in a saved log's name, None if it has none."""
+    match = _log_day_re.search(os.path.basename(log_file))
+    if match is None:
+        return None
+    return tuple(int(part) for part in match.groups())
+
+
+def next_day(day):
+    date = datetime.date(*day[:3]) + datetime.timedelta(days=1)
+    return (date.year, date.month, date.day)
+
+
+def _in_days(day, start, stop):
+    """start <= day < stop, where None is unbounded."""
+    return (start is None or day >= start) and (stop is None or day < stop)
+
+
+def _reprocess_worker(args):
+    directory, start, stop, log_files, controller_kwargs = args
+
+    checkpoints = DayCheckpoints(directory)
+    last_datetime = controller = None
+    if start is not None:
+        last_datetime, controller = checkpoints.load(start)
+    if controller is None:
+        controller = EventParserController(**controller_kwargs)
+
+    def day_callback(last_datetime, next_datetime):
+        # The checkpoints at start and stop belong to other workers
+        day = tuple(next_datetime[:3])
+        if (start is None or day > start) and (stop is None or day < stop):
+            checkpoints.save(day, last_datetime, controller)
+
+    loader = LogLoader(
+        controller, last_datetime=last_datetime, day_callback=day_callback)
+    for log_file in log_files:
+        loader.load_file(log_file)
+
+    controller.parse_finish()
+    done_events = controller.parse_dump(loader.last_datetime)
+    live_events = controller.parse_flush()
+
+    # Events from before start were already handed out by the worker before,
+    # and those after stop belong to the next one.
+    return (
+        [event.to_dict() for event in done_events
+            if _in_days(tuple(event.start[:3]), start, stop)],
+        [event.to_dict() for event in live_events
+            if _in_days(tuple(event.start[:3]), start, stop)])
+
+
+def reprocess_days(directory, log_files, first_day, last_day=None,
+        jobs=None, **controller_kwargs):
+    """Rebuilds the events from first_day to last_day from saved logs.
+
+    Starts from the nearest day checkpoint in directory on or before
+    first_day (from scratch if there's none), and returns (start,
+    done_events, live_events) where start is the day it started from, or
+    None. Every checkpoint in the range splits it into a run of days that's
+    rebuilt by one of jobs processes (defaults to the cpu count). Each run
+    reads on into the day after it, so events crossing midnight finish, and
+    saves checkpoints for the days inside it that didn't have one.
+    """
+    logger = get_logger('reprocess_days')
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    checkpoints = DayCheckpoints(directory)
+    start = checkpoints.nearest(first_day)
+    stop = None if last_day is None else next_day(last_day)
+
+    boundaries = [start]
+    if jobs > 1:
+        boundaries.extend(
+            day for day in checkpoints.days()
+            if (start is None or day > start) and (stop is None or day < stop))
+
+    tasks = []
+    for run_start, run_stop in zip(boundaries, boundaries[1:] + [stop]):
+        run_files = []
+        for log_file in log_files:
+            day = log_file_day(log_file)
+            # run_stop is read too, for events running over midnight
+            if (day is None or (
+                    (run_start is None or day >= run_start) and
+                    (run_stop is None or day <= run_stop))):
+                run_files.append(log_file)
+        tasks.append((
+            directory, run_start, run_stop, run_files, controller_kwargs))
+
+    logger.debug('Reprocessing from {0} to {1} in {2} runs'.format(
+        start, stop, len(tasks)))
+
+    if len(tasks) == 1:
+        results = [_reprocess_worker(tasks[0])]
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.map(_reprocess_worker, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    done_events = []
+    live_events = []
+    for done, live in results:
+        done_events.extend(PlexEvent(**event) for event in done)
+        live_events.extend(PlexEvent(**event) for event in live)
+
+    done_events.sort(key=lambda event: event.start)
+    live_events.sort(key=lambda event: event.start)
+    return start, done_events, live_events
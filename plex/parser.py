@@ -29,8 +29,9 @@ THE SOFTWARE.
 
 import re
 import os
+import fnmatch
 
-from plex.util import get_logger
+from plex.util import get_logger, datetime_to_millis
 
 try:
     from urlparse import urlparse, parse_qs
@@ -89,43 +90,48 @@ class PlexLogParser(object):
     def _parse_base(self, real_file_name, file_handle):
         file_name = os.path.basename(real_file_name)
         for line_no, line_text in enumerate(file_handle, 1):
+            line_body = self.parse_line(file_name, line_no, line_text)
+            if line_body is not None:
+                yield line_body
+
+    def parse_line(self, file_name, line_no, line_text):
+        """Parse a single line of a plex log, None if it isn't a log line."""
+        # 'Jul 03, 2013 02:13:16:353 [4600] DEBUG - .*'
+        if not self._re_match((
+                r'(?P<month>\w+) (?P<day>\d+), (?P<year>\d{4})'
+                r' (?P<time>\d+:\d+:\d+:\d+) \[\d+\] (?P<debug_level>\w+)'
+                r' - (?P<content>.*)'),
+                line_text):
+            return None
+
+        line_body = {}
+        line_body['file_name'] = file_name
+        line_body['file_line_no'] = line_no
+        line_body.update(self._last)
+
+        self._parse_datetime(line_body)
+
+        # Match 'Request: GET /:/timeline?URL_QUERY_HERE [127.0.0.1:48192]'
+        if self._re_match((
+                r'Request: (?P<method>\w+) (?P<url>.*)'
+                r' \[(?:::ffff:)?'
+                r'(?P<request_ip>[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)'
+                r'(?::(?P<request_port>[0-9]+))?\] .*'),
+                line_body['content']):
 
-            # 'Jul 03, 2013 02:13:16:353 [4600] DEBUG - .*'
-            if not self._re_match((
-                    r'(?P<month>\w+) (?P<day>\d+), (?P<year>\d{4})'
-                    r' (?P<time>\d+:\d+:\d+:\d+) \[\d+\] (?P<debug_level>\w+)'
-                    r' - (?P<content>.*)'),
-                    line_text):
-                continue
-
-            line_body = {}
-            line_body['file_name'] = file_name
-            line_body['file_line_no'] = line_no
             line_body.update(self._last)
+            del line_body['content']
 
-            self._parse_datetime(line_body)
+            line_url = urlparse(line_body['url'])
+            del line_body['url']
 
-            # Match 'Request: GET /:/timeline?URL_QUERY_HERE [127.0.0.1:48192]'
-            if self._re_match((
-                    r'Request: (?P<method>\w+) (?P<url>.*)'
-                    r' \[(?:::ffff:)?'
-                    r'(?P<request_ip>[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+)'
-                    r'(?::(?P<request_port>[0-9]+))?\] .*'),
-                    line_body['content']):
+            line_body['url_path'] = line_url.path
+            line_body['url_query'] = parse_qs(
+                line_url.query, keep_blank_values=True)
 
-                line_body.update(self._last)
-                del line_body['content']
+            self._squish_dict(line_body['url_query'])
 
-                line_url = urlparse(line_body['url'])
-                del line_body['url']
-
-                line_body['url_path'] = line_url.path
-                line_body['url_query'] = parse_qs(
-                    line_url.query, keep_blank_values=True)
-
-                self._squish_dict(line_body['url_query'])
-
-            yield line_body
+        return line_body
 
     def line_body_filter(self, line_body):
         """
@@ -137,16 +143,185 @@ class PlexLogParser(object):
         return True
 
     def parse_file(self, real_file_name):
-        logger = get_logger(self, 'parse_file')
+        return list(self.iter_file(real_file_name))
 
-        logger.debug("Called parse_file with: {0}".format(real_file_name))
+    def iter_file(self, real_file_name):
+        """Like parse_file, but yields the lines as they're parsed."""
+        logger = get_logger(self, 'iter_file')
 
-        lines = []
-        with open(real_file_name, 'rU') as file_handle:
+        logger.debug("Called iter_file with: {0}".format(real_file_name))
+
+        with open(real_file_name, 'r') as file_handle:
             for line_body in self._parse_base(real_file_name, file_handle):
                 if not self.line_body_filter(line_body):
                     continue
 
-                lines.append(line_body)
+                yield line_body
+
+
+def _compile_paths(patterns):
+    """One regex for a list of url_path globs, each its own group."""
+    if len(patterns) == 0:
+        return None
+    return re.compile('|'.join(
+        '(?P<p{0}>{1})'.format(pattern_no, fnmatch.translate(pattern))
+        for pattern_no, pattern in enumerate(patterns)))
+
+
+class IngestFilter(object):
+    """IngestFilter(rules)
+
+    The ingest_filter rules from config.cfg, compiled once:
+
+        deny_paths     url_path globs that are never saved.
+        sample_paths   {url_path glob: n}, only one in every n lines of
+                       each glob is saved.
+        compact_paths  url_paths of the polls clients send while playing,
+                       see compact().
+        compact_span   The most seconds of polls compacted into one line.
+        compact_idle   Seconds without a poll before a client's polls are
+                       written out.
+
+    denied() is used by PlexSuperLogParser.line_body_filter. sample()
+    counts the lines it's given, so it's only called on lines that aren't
+    duplicates (see plex.dedup), or a rotated log read again would shift
+    which lines are kept.
+    """
+    def __init__(self, rules):
+        self.deny_re = _compile_paths(rules.get('deny_paths', []))
+
+        sample_paths = sorted(rules.get('sample_paths', {}).items())
+        self.sample_re = _compile_paths(
+            [pattern for pattern, every in sample_paths])
+        self.sample_every = dict(
+            ('p{0}'.format(pattern_no), int(every))
+            for pattern_no, (pattern, every) in enumerate(sample_paths))
+        self.sample_counts = dict.fromkeys(self.sample_every, 0)
+
+        self.compact_paths = frozenset(rules.get('compact_paths', []))
+        self.compact_span = int(rules.get('compact_span', 300) * 1000)
+        self.compact_idle = int(rules.get('compact_idle', 30) * 1000)
+        # (request_ip, url_path) -> [state, first, last, count, first_millis,
+        #                            last_millis]
+        self.runs = {}
+
+    def denied(self, line_body):
+        """True if the deny rules drop line_body."""
+        return (
+            self.deny_re is not None and 'url_path' in line_body and
+            self.deny_re.match(line_body['url_path']) is not None)
+
+    def sample(self, line_body):
+        """False if the sample rules drop line_body."""
+        if self.sample_re is None or 'url_path' not in line_body:
+            return True
+
+        match = self.sample_re.match(line_body['url_path'])
+        if match is None:
+            return True
+
+        group = match.lastgroup
+        count = self.sample_counts[group]
+        self.sample_counts[group] = count + 1
+        return count % self.sample_every[group] == 0
+
+    def allow(self, line_body):
+        """False if the deny or sample rules drop line_body."""
+        return not self.denied(line_body) and self.sample(line_body)
+
+    def compact(self, line_body):
+        """Returns the lines to save in place of line_body.
+
+        Polls from a client that only differ in their time (the play
+        position) are run length encoded. The first poll of a run is passed
+        on as it is, the rest become a single line, the last poll with
+        poll_count (the polls in the whole run) and poll_first (the datetime
+        of the first one). EventParser still sees every state
+        change, and no more than compact_span between lines while playing.
+
+        Lines come back in order per client, but the compacted line can be
+        up to compact_idle seconds behind other clients' lines, so put them
+        through a ReorderBuffer with reorder_lateness() lateness.
+        """
+        lines = []
+        millis = datetime_to_millis(line_body['datetime'])
+
+        # Clients that went quiet
+        for run_key in list(self.runs):
+            if millis - self.runs[run_key][5] > self.compact_idle:
+                self._close_run(run_key, lines)
+
+        if line_body.get('url_path') not in self.compact_paths:
+            lines.append(line_body)
+            return lines
+
+        state = tuple(sorted(
+            (key, value) for key, value in line_body['url_query'].items()
+            if key != 'time'))
+        run_key = (line_body['request_ip'], line_body['url_path'])
+
+        run = self.runs.get(run_key)
+        if (run is not None and run[0] == state and
+                millis - run[4] <= self.compact_span):
+            run[2] = line_body
+            run[3] += 1
+            run[5] = millis
+            return lines
+
+        self._close_run(run_key, lines)
+        self.runs[run_key] = [state, line_body, line_body, 0, millis, millis]
+        lines.append(line_body)
+        return lines
 
+    def reorder_lateness(self, lateness):
+        """The lateness (in seconds) a ReorderBuffer after compact() needs,
+        lateness or compact_idle, whichever is more."""
+        if len(self.compact_paths) == 0:
+            return lateness
+        return max(lateness, self.compact_idle / 1000.0)
+
+    def _close_run(self, run_key, lines):
+        run = self.runs.pop(run_key, None)
+        if run is None or run[3] == 0:
+            return
+
+        last = run[2]
+        if run[3] > 1:
+            last = dict(last)
+            last['poll_count'] = run[3] + 1
+            last['poll_first'] = run[1]['datetime']
+        lines.append(last)
+
+    def flush(self):
+        """Returns the compacted lines still being held back."""
+        lines = []
+        for run_key in sorted(self.runs):
+            self._close_run(run_key, lines)
+        lines.sort(key=lambda line_body: line_body['datetime'])
         return lines
+
+
+class PlexSuperLogParser(PlexLogParser):
+    """The filtering used when saving logs, drops lines older than
+    last_datetime, the useless lines following request lines and anything
+    the ingest_filter (an IngestFilter) denies. Its sampling is left to the
+    caller, after dropping duplicates."""
+    def __init__(self, last_datetime, *args, **kwargs):
+        self.ingest_filter = kwargs.pop('ingest_filter', None)
+        super(PlexSuperLogParser, self).__init__(**kwargs)
+        self.last_datetime = last_datetime
+
+    def line_body_filter(self, line_body):
+        # We don't want old records
+        if line_body['datetime'] <= self.last_datetime:
+            return False
+
+        # We don't want the useless lines following request lines.
+        if 'content' in line_body and line_body['content'].startswith(' *'):
+            return False
+
+        if (self.ingest_filter is not None and
+                self.ingest_filter.denied(line_body)):
+            return False
+
+        return super(PlexSuperLogParser, self).line_body_filter(line_body)
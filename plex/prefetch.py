@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+"""
+Gets the metadata of events as they start, instead of all at once when
+they're reported. Python 3 only, it's built on asyncio.
+
+MetadataPrefetcher is an event daemon service. It hooks the controller's
+media_callback, so each new event's media_key is queued the moment its
+first line is parsed. Keys already known or on their way are skipped, and
+the rest go to a plex.aiomedia.AsyncPlexServerConnection, which sends the
+ones queued within its batch_delay as one request. Done and live events
+the EventSink emits then have their media_object set already.
+"""
+
+import asyncio
+import collections
+
+from plex.util import PlexException, get_logger
+from plex.media import plex_media_object
+
+
+class MetadataPrefetcher(object):
+    """MetadataPrefetcher(events, conn, max_entries=10000)
+
+    events is the daemon's EventSink, conn an AsyncPlexServerConnection.
+    At most max_entries media objects are kept, the least recently used go
+    first. Call start() from inside the event loop, close() when done.
+    """
+    def __init__(self, events, conn, max_entries=10000):
+        self.events = events
+        self.conn = conn
+        self.max_entries = max_entries
+
+        # key -> media object, in the order they were last used
+        self.media_objects = collections.OrderedDict()
+        self.pending = {}
+
+        self.prefetched = 0
+        self.skipped = 0
+        self.failed = 0
+
+    async def start(self):
+        self.events.controller.media_callback = self.prefetch_event
+        self.events.media_lookup = self.get
+
+        ## Events that started before us, while catching up
+        for event in self.events.controller.live_events():
+            self.prefetch(event.media_key)
+
+    async def close(self):
+        self.events.controller.media_callback = None
+        self.events.media_lookup = None
+
+        if len(self.pending) > 0:
+            await asyncio.wait(list(self.pending.values()))
+        await self.conn.close()
+
+    def prefetch_event(self, event):
+        """The controller's media_callback."""
+        self.prefetch(event.media_key)
+
+    def prefetch(self, media_key):
+        try:
+            key = int(media_key)
+        except (TypeError, ValueError):
+            return
+
+        if key in self.media_objects or key in self.pending:
+            self.skipped += 1
+            return
+
+        task = asyncio.ensure_future(self._fetch(key))
+        self.pending[key] = task
+        task.add_done_callback(lambda task: self.pending.pop(key, None))
+
+    async def _fetch(self, key):
+        logger = get_logger(self, '_fetch')
+
+        try:
+            # Parsed when its batch was split up, not again here
+            xml, document = await self.conn.fetch_metadata_document(key)
+            media_object = plex_media_object(None, key, xml, document)
+        except (PlexException, OSError, EOFError, asyncio.TimeoutError) as err:
+            ## Not remembered, the next event for it tries again
+            self.failed += 1
+            logger.warning('Unable to prefetch {0}: {1}'.format(key, err))
+            return
+
+        self.prefetched += 1
+        self.media_objects[key] = media_object
+        while len(self.media_objects) > self.max_entries:
+            self.media_objects.popitem(last=False)
+
+    def get(self, media_key):
+        """The media object for media_key, None if it isn't here (yet)."""
+        try:
+            key = int(media_key)
+        except (TypeError, ValueError):
+            return None
+
+        media_object = self.media_objects.get(key)
+        if media_object is not None:
+            self.media_objects.move_to_end(key)
+        return media_object
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+"""
+A persistent store of PlexEvents, kept in SQLite.
+
+Events are upserted by their event_id, so live events can be stored every
+run and are simply updated as they progress or finish. start and end are
+kept as milliseconds since the epoch (see plex.util.datetime_to_millis).
+"""
+
+import sqlite3
+
+from plex.util import datetime_to_millis, millis_to_datetime, get_logger
+from plex.event import PlexEvent
+
+
+_event_columns = (
+    'event_id', 'session_key', 'media_key', 'device_name', 'device_ip',
+    'device_client', 'start', 'end', 'duration', 'resumed', 'stopped',
+    'live')
+
+_schema = (
+    '''CREATE TABLE IF NOT EXISTS events (
+        event_id      TEXT PRIMARY KEY,
+        session_key   TEXT NOT NULL,
+        media_key     TEXT NOT NULL,
+        device_name   TEXT NOT NULL,
+        device_ip     TEXT NOT NULL,
+        device_client TEXT NOT NULL,
+        start         INTEGER NOT NULL,
+        end           INTEGER NOT NULL,
+        duration      INTEGER,
+        resumed       INTEGER NOT NULL,
+        stopped       INTEGER,
+        live          INTEGER NOT NULL
+        )''',
+    'CREATE INDEX IF NOT EXISTS events_start ON events (start)',
+    'CREATE INDEX IF NOT EXISTS events_session_key ON events (session_key)',
+    'CREATE INDEX IF NOT EXISTS events_device_name ON events (device_name)',
+    'CREATE INDEX IF NOT EXISTS events_media_key ON events (media_key)',
+    )
+
+if sqlite3.sqlite_version_info >= (3, 24, 0):
+    _upsert_sql = (
+        'INSERT INTO events ({columns}) VALUES ({params})'
+        ' ON CONFLICT (event_id) DO UPDATE SET {updates}').format(
+            columns=', '.join(_event_columns),
+            params=', '.join('?' * len(_event_columns)),
+            updates=', '.join(
+                '{0} = excluded.{0}'.format(column)
+                for column in _event_columns[1:]))
+else:
+    # Every column gets replaced anyway, so this is just as good.
+    _upsert_sql = (
+        'INSERT OR REPLACE INTO events ({columns}) VALUES ({params})').format(
+            columns=', '.join(_event_columns),
+            params=', '.join('?' * len(_event_columns)))
+
+
+def _event_row(event):
+    return (
+        event.event_id,
+        str(event.session_key),
+        str(event.media_key),
+        event.device_name,
+        event.device_ip,
+        event.device_client,
+        datetime_to_millis(event.start),
+        datetime_to_millis(event.end),
+        event.duration,
+        int(bool(event.resumed)),
+        None if event.stopped is None else int(event.stopped),
+        int(bool(event.live)),
+        )
+
+
+def _row_event(row):
+    return PlexEvent(
+        session_key=row[1],
+        media_key=row[2],
+        device_name=row[3],
+        device_ip=row[4],
+        device_client=row[5],
+        start=millis_to_datetime(row[6]),
+        end=millis_to_datetime(row[7]),
+        resumed=row[9] == 1,
+        stopped=None if row[10] is None else row[10] == 1,
+        live=row[11] == 1)
+
+
+class EventStore(object):
+    """EventStore(file_name)
+
+    SQLite backed store of PlexEvents, in WAL mode so reports can read it
+    while plex-reporter writes to it. Indexed on start, session_key,
+    device_name and media_key.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            for statement in _schema:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def upsert_events(self, events):
+        """Inserts, or updates by event_id, events in a single transaction."""
+        logger = get_logger(self, 'upsert_events')
+
+        rows = [
+            _event_row(event) for event in events if event.start is not None]
+        with self.connection:
+            self.connection.executemany(_upsert_sql, rows)
+
+        logger.debug('Upserted {0} events'.format(len(rows)))
+        return len(rows)
+
+    def _select(self, where='', params=(), order='start'):
+        sql = 'SELECT {0} FROM events'.format(', '.join(_event_columns))
+        if where:
+            sql += ' WHERE ' + where
+        sql += ' ORDER BY ' + order
+        return [
+            _row_event(row) for row in self.connection.execute(sql, params)]
+
+    def get_event(self, event_id):
+        events = self._select('event_id = ?', (event_id,))
+        return events[0] if len(events) > 0 else None
+
+    def events_between(self, start, end):
+        """Events that started between the start and end datetimes."""
+        return self._select('start >= ? AND start < ?', (
+            datetime_to_millis(start), datetime_to_millis(end)))
+
+    def delete_between(self, start, end):
+        """Deletes events that started between the start and end datetimes."""
+        with self.connection:
+            return self.connection.execute(
+                'DELETE FROM events WHERE start >= ? AND start < ?', (
+                    datetime_to_millis(start),
+                    datetime_to_millis(end))).rowcount
+
+    def events_for_session(self, session_key):
+        return self._select('session_key = ?', (session_key,))
+
+    def events_for_device(self, device_name):
+        return self._select('device_name = ?', (device_name,))
+
+    def events_for_media(self, media_key):
+        return self._select('media_key = ?', (str(media_key),))
+
+    def live_events(self):
+        return self._select('live = 1')
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM events').fetchone()[0]
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+
+"""
+Local streaming of events from the event daemon. Python 3 only.
+
+EventStreamServer subscribes to an EventSink and pushes every done and live
+event to its clients as PlexEvent.to_dict() JSON, over either:
+
+HTTP on localhost:
+    GET /events  Server-Sent Events, 'event: done' or 'event: live' with the
+                 event as the data.
+    GET /live    JSON list of the events currently live.
+
+A unix domain socket, sending one command line:
+    events       JSON lines of {"type": ..., "event": ...} from then on.
+    live         One JSON line with the events currently live.
+
+Every client has its own bounded queue, a client that falls that far behind
+is disconnected rather than slowing down the daemon.
+"""
+
+import os
+import json
+import asyncio
+
+from plex.util import get_logger
+
+
+_http_status = {
+    200: 'OK',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    }
+
+
+class EventStreamServer(object):
+    """EventStreamServer(events, host='127.0.0.1', port=None,
+        socket_path=None, queue_size=1000)
+
+    events is the daemon's EventSink. Either or both of port and socket_path
+    can be given, call start() from inside the event loop, close() when done.
+    """
+    def __init__(self, events, host='127.0.0.1', port=None, socket_path=None,
+            queue_size=1000):
+        self.events = events
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.queue_size = queue_size
+
+        self.clients = set()
+        self.servers = []
+
+    def publish(self, kind, event):
+        """EventSink subscriber, queues the event for every client."""
+        logger = get_logger(self, 'publish')
+        message = (kind, event.to_dict())
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning('Dropping a client that fell behind')
+                self._disconnect(queue)
+
+    def live_snapshot(self):
+        return [
+            event.to_dict()
+            for event in self.events.controller.live_events()]
+
+    async def start(self):
+        logger = get_logger(self, 'start')
+        self.events.subscribe(self.publish)
+
+        if self.port is not None:
+            self.servers.append(await asyncio.start_server(
+                self._handle_http, self.host, self.port))
+            logger.info('Streaming events on http://{0}:{1}/events'.format(
+                self.host, self.port))
+
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.servers.append(await asyncio.start_unix_server(
+                self._handle_unix, self.socket_path))
+            logger.info('Streaming events on {0}'.format(self.socket_path))
+
+    async def close(self):
+        self.events.unsubscribe(self.publish)
+        for queue in list(self.clients):
+            self._disconnect(queue)
+
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _subscribe(self):
+        queue = asyncio.Queue(self.queue_size)
+        self.clients.add(queue)
+        return queue
+
+    def _disconnect(self, queue):
+        """Tells the client's writer to give up, even if its queue is full."""
+        self.clients.discard(queue)
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _stream(self, queue, writer, format_message):
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                writer.write(format_message(*message))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(queue)
+            writer.close()
+
+    async def _handle_http(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Headers, we don't need any of them
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+        except ConnectionError:
+            writer.close()
+            return
+
+        parts = request_line.decode('latin-1').split()
+        method, path = (parts[0], parts[1]) if len(parts) >= 2 else ('', '')
+
+        if method != 'GET':
+            self._http_reply(writer, 405, {'error': 'GET only'})
+        elif path == '/live':
+            self._http_reply(writer, 200, self.live_snapshot())
+        elif path == '/events':
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/event-stream\r\n'
+                b'Cache-Control: no-cache\r\n'
+                b'Connection: keep-alive\r\n'
+                b'\r\n')
+            await self._stream(self._subscribe(), writer, _format_sse)
+            return
+        else:
+            self._http_reply(writer, 404, {'error': 'Unknown path'})
+
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def _http_reply(self, writer, status, body):
+        body = json.dumps(body, sort_keys=True).encode('utf-8')
+        writer.write((
+            'HTTP/1.1 {0} {1}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {2}\r\n'
+            'Connection: close\r\n'
+            '\r\n').format(
+                status, _http_status[status], len(body)).encode('latin-1'))
+        writer.write(body)
+
+    async def _handle_unix(self, reader, writer):
+        try:
+            command = (await reader.readline()).decode('utf-8').strip()
+        except ConnectionError:
+            writer.close()
+            return
+
+        if command == 'events':
+            await self._stream(self._subscribe(), writer, _format_json_line)
+            return
+
+        if command == 'live':
+            reply = self.live_snapshot()
+        else:
+            reply = {'error': 'Unknown command {0!r}'.format(command)}
+
+        writer.write(json.dumps(reply, sort_keys=True).encode('utf-8') + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+def _format_sse(kind, event_dict):
+    return 'event: {0}\ndata: {1}\n\n'.format(
+        kind, json.dumps(event_dict, sort_keys=True)).encode('utf-8')
+
+
+def _format_json_line(kind, event_dict):
+    return json.dumps(
+        {'type': kind, 'event': event_dict},
+        sort_keys=True).encode('utf-8') + b'\n'
@@ -30,7 +30,11 @@ THE SOFTWARE.
 import os
 import json
 import zlib
+import time
+import heapq
 import logging
+import itertools
+import calendar
 import datetime
 
 
@@ -97,7 +101,22 @@ class PlexException(Exception):
     pass
 
 
-CONFIG_VERSION = '0.1'
+CONFIG_VERSION = '0.8'
+
+
+def default_ingest_filter():
+    """See plex.parser.IngestFilter."""
+    return {
+        'deny_paths': [
+            '/library/metadata/*/thumb*',
+            '/library/metadata/*/art*',
+            '/photo/:/transcode*',
+            ],
+        'sample_paths': {},
+        'compact_paths': ['/:/timeline', '/:/progress'],
+        'compact_span': 300,
+        'compact_idle': 30,
+        }
 
 
 def config_update(config):
@@ -125,12 +144,66 @@ def config_update(config):
 
         # Now 0.1
         config['config_version'] = '0.1'
+
+    if config['config_version'] == '0.1':
+        # Added: 'event_api_host', 'event_api_port', 'event_api_socket'
+        config.setdefault('event_api_host', '127.0.0.1')
+        config.setdefault('event_api_port', 32480)
+        config.setdefault('event_api_socket', '')
+
+        # Now 0.2
+        config['config_version'] = '0.2'
+
+    if config['config_version'] == '0.2':
+        # Added: 'log_reorder_lateness'
+        config.setdefault('log_reorder_lateness', 60)
+
+        # Now 0.3
+        config['config_version'] = '0.3'
+
+    if config['config_version'] == '0.3':
+        # Added: 'log_dedup_window'
+        config.setdefault('log_dedup_window', 6)
+
+        # Now 0.4
+        config['config_version'] = '0.4'
+
+    if config['config_version'] == '0.4':
+        # Added: 'ingest_filter'
+        config.setdefault('ingest_filter', default_ingest_filter())
+
+        # Now 0.5
+        config['config_version'] = '0.5'
+
+    if config['config_version'] == '0.5':
+        # Added: 'media_source', 'plex_database_file'
+        config.setdefault('media_source', 'http')
+        config.setdefault('plex_database_file', '')
+
+        # Now 0.6
+        config['config_version'] = '0.6'
+
+    if config['config_version'] == '0.6':
+        # Added: 'media_prefetch', 'media_prefetch_window'
+        config.setdefault('media_prefetch', True)
+        config.setdefault('media_prefetch_window', 0.05)
+
+        # Now 0.7
+        config['config_version'] = '0.7'
+
+    if config['config_version'] == '0.7':
+        # Added: 'library_sync_minutes', 'library_full_sync_days'
+        config.setdefault('library_sync_minutes', 30)
+        config.setdefault('library_full_sync_days', 7)
+
+        # Now 0.8
+        config['config_version'] = '0.8'
     # Add new updates here... :)
 
 
 def config_load(config_file, no_save=False):
     if os.path.isfile(config_file):
-        with open(config_file, 'rU') as file_handle:
+        with open(config_file, 'r') as file_handle:
             config = json.load(file_handle)
     else:
         config = {
@@ -146,6 +219,18 @@ def config_load(config_file, no_save=False):
             'plex_log_dir': '',
             'plex_server_host': 'localhost',
             'plex_server_port': 32400,
+            'event_api_host': '127.0.0.1',
+            'event_api_port': 32480,
+            'event_api_socket': '',
+            'log_reorder_lateness': 60,
+            'log_dedup_window': 6,
+            'ingest_filter': default_ingest_filter(),
+            'media_source': 'http',
+            'plex_database_file': '',
+            'media_prefetch': True,
+            'media_prefetch_window': 0.05,
+            'library_sync_minutes': 30,
+            'library_full_sync_days': 7,
             }
 
         if not no_save:
@@ -176,6 +261,138 @@ def datetime_diff(date_a, date_b):
     return (a - b).seconds
 
 
+def datetime_seconds(date):
+    """Seconds since the epoch for a log datetime, ignores milliseconds."""
+    return calendar.timegm(tuple(date[:6]))
+
+
+def datetime_to_millis(date):
+    """Milliseconds since the epoch for a log datetime, -1 for None."""
+    if date is None:
+        return -1
+    return datetime_seconds(date) * 1000 + date[6]
+
+
+def millis_to_datetime(millis):
+    """The reverse of datetime_to_millis, gives a log datetime tuple."""
+    if millis < 0:
+        return None
+    seconds, milliseconds = divmod(millis, 1000)
+    return tuple(time.gmtime(seconds)[:6]) + (milliseconds,)
+
+
+class TimeWheel(object):
+    """
+    Keeps track of when keys were last touched, so keys that have been idle
+    for longer than ttl seconds can be expired in bulk.
+
+    Keys are put into buckets of resolution seconds, expire() only ever looks
+    at buckets that are old enough to expire, so touching and expiring are
+    cheap no matter how many keys are being tracked. Times are whatever the
+    caller uses, plex-reporter uses log time (see datetime_seconds).
+
+    Only uses lists, sets and dicts so it pickles between python versions.
+    """
+    def __init__(self, ttl, resolution=60):
+        self.ttl = ttl
+        self.resolution = resolution
+        self.touched = {}
+        self.buckets = {}
+        self.bucket_heap = []
+
+    def __len__(self):
+        return len(self.touched)
+
+    def __contains__(self, key):
+        return key in self.touched
+
+    def touch(self, key, when):
+        self.touched[key] = when
+        bucket_no = when // self.resolution
+        if bucket_no not in self.buckets:
+            self.buckets[bucket_no] = set()
+            heapq.heappush(self.bucket_heap, bucket_no)
+        self.buckets[bucket_no].add(key)
+
+    def discard(self, key):
+        # The key is left in its bucket, expire() skips it later.
+        self.touched.pop(key, None)
+
+    def expire(self, now):
+        """Returns a list of keys idle since now - ttl, and forgets them."""
+        limit = (now - self.ttl) // self.resolution
+        expired = []
+        while len(self.bucket_heap) > 0 and self.bucket_heap[0] < limit:
+            bucket_no = heapq.heappop(self.bucket_heap)
+            for key in self.buckets.pop(bucket_no):
+                # Only expire keys that weren't touched again since.
+                if (key in self.touched and
+                        self.touched[key] // self.resolution == bucket_no):
+                    del self.touched[key]
+                    expired.append(key)
+        return expired
+
+    def clear(self):
+        self.touched.clear()
+        self.buckets.clear()
+        self.bucket_heap[:] = []
+
+
+class ReorderBuffer(object):
+    """ReorderBuffer(lateness, max_size=100000, watermark=None)
+
+    Puts log lines that arrive slightly out of order back in order, as they
+    stream through. Lines are held in a heap keyed by their datetime (and a
+    sequence number, so equal datetimes keep their order) until a line more
+    than lateness seconds newer has been pushed, or the heap grows past
+    max_size.
+
+    A line older than the last one released (or watermark, a datetime) can't
+    be put in order any more, push() returns None for it and counts it in
+    late.
+    """
+    def __init__(self, lateness, max_size=100000, watermark=None):
+        self.lateness = int(lateness * 1000)
+        self.max_size = max_size
+        self.heap = []
+        self.sequence = itertools.count()
+        self.newest = None
+        self.released = (
+            None if watermark is None else datetime_to_millis(watermark))
+        self.late = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, item, date):
+        """Returns the items that are now in order, None if item is late."""
+        millis = datetime_to_millis(date)
+        if self.released is not None and millis < self.released:
+            self.late += 1
+            return None
+
+        heapq.heappush(self.heap, (millis, next(self.sequence), item))
+        if self.newest is None or millis > self.newest:
+            self.newest = millis
+
+        heap = self.heap
+        watermark = self.newest - self.lateness
+        released = []
+        while len(heap) > 0 and (
+                heap[0][0] <= watermark or len(heap) > self.max_size):
+            self.released, _, item = heapq.heappop(heap)
+            released.append(item)
+        return released
+
+    def flush(self):
+        """Returns everything that's left, in order."""
+        released = []
+        while len(self.heap) > 0:
+            self.released, _, item = heapq.heappop(self.heap)
+            released.append(item)
+        return released
+
+
 class BasketOfHandles(object):
     """
     Allows multiple files to be opened by name, but really only keeps
@@ -212,6 +429,10 @@ class BasketOfHandles(object):
         self.handle_queue.insert(0, key)
         return self.handles[key]
 
+    def flush(self):
+        for value in self.handles.values():
+            value.flush()
+
     def __enter__(self):
         logger = logging.getLogger(self.__class__.__name__ + '.__enter__')
         if self.in_state is True:
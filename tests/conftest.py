@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""
+The tests are plain functions, run from the repository root with:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+## The plex package is imported from the checkout, it isn't installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""AsyncPlexServerConnection against the mock server. Python 3 only."""
+
+import asyncio
+
+from plex.aiomedia import AsyncPlexServerConnection
+from plex.media import PlexServerException
+from plex.mockserver import MockPlexServer
+
+
+def _video_keys(library):
+    return sorted(
+        key for key, item in library.items.items() if item.tag == 'Video')
+
+
+def _run(server, check, **kwargs):
+    async def run():
+        conn = AsyncPlexServerConnection(*server.address, **kwargs)
+        try:
+            await check(conn)
+        finally:
+            await conn.close()
+    asyncio.run(run())
+
+
+def test_coalesced_and_batched():
+    """Every key asked for twice at once takes one request per batch, and
+    the caches stay within max_entries."""
+    with MockPlexServer(latency=0.005) as server:
+        keys = _video_keys(server.library)
+
+        async def check(conn):
+            results = await asyncio.gather(
+                *[conn.fetch_metadata(key) for key in keys + keys])
+            for key, xml in zip(keys + keys, results):
+                # Only the key's own part of the batch
+                assert xml.count('ratingKey=') == 1
+                assert 'ratingKey="{0}"'.format(key) in xml
+
+            assert conn.requests == (len(keys) + 19) // 20
+            assert conn.coalesced == len(keys)
+            assert len(conn.metadata_cache) <= 50
+            # The batches aren't kept whole
+            assert len(conn.page_cache) == 0
+
+        _run(server, check, batch_size=20, max_entries=50)
+
+
+def test_metadata_cache_max_bytes():
+    with MockPlexServer() as server:
+        keys = _video_keys(server.library)[:40]
+
+        async def check(conn):
+            for key in keys:
+                xml, document = await conn.fetch_metadata_document(key)
+                assert document.find(key) is not None
+                assert conn.metadata_cache.bytes <= 4096
+            assert 0 < len(conn.metadata_cache) < len(keys)
+            # The newest are the ones kept
+            assert list(conn.metadata_cache.entries)[-1] == keys[-1]
+
+        _run(server, check, batch_delay=0, max_bytes=4096)
+
+
+def test_missing_key_raises():
+    """Alone (the server answers 404), and batched with a key it has."""
+    with MockPlexServer() as server:
+        keys = _video_keys(server.library)
+        missing = max(server.library.items) + 1
+
+        async def check(conn):
+            for batch in ([missing], [missing, keys[1]]):
+                conn.metadata_cache.clear()
+                results = await asyncio.gather(
+                    *[conn.fetch_metadata(key) for key in batch],
+                    return_exceptions=True)
+                assert isinstance(results[0], PlexServerException)
+                if len(batch) > 1:
+                    assert 'ratingKey="{0}"'.format(keys[1]) in results[1]
+
+        _run(server, check)
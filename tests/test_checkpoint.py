@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""Resuming from EventCheckpoint journals gives the same events as parsing
+everything in one go."""
+
+import os
+import json
+
+from plex.checkpoint import EventCheckpoint
+from plex.event import EventParserController, LogLoader
+from plex.fixtures import generate_event_lines, write_log_file
+
+
+def _log_files(tmp_path, count=3, lines_per_file=7000):
+    lines = generate_event_lines(count * lines_per_file)
+    log_files = []
+    for file_no in range(count):
+        log_file = str(tmp_path / 'plex-media-server-{0}.log'.format(file_no))
+        write_log_file(
+            lines[file_no * lines_per_file:(file_no + 1) * lines_per_file],
+            log_file)
+        log_files.append(log_file)
+    return log_files
+
+
+def _dicts(events):
+    return sorted(
+        json.dumps(event.to_dict(), sort_keys=True) for event in events)
+
+
+def _run(checkpoint, log_files):
+    """A plex-reporter run, returns (done events, live events)."""
+    last_datetime, controller = checkpoint.load()
+    if controller is None:
+        controller = EventParserController(10)
+
+    loader = LogLoader(controller, last_datetime=last_datetime)
+    for log_file in log_files:
+        loader.load_file(log_file)
+
+    done_events = controller.parse_dump(loader.last_datetime)
+    checkpoint.save(loader.last_datetime, controller)
+    return done_events, controller.parse_flush()
+
+
+def test_resumed_runs_match_one_run(tmp_path):
+    log_files = _log_files(tmp_path)
+
+    controller = EventParserController(10)
+    loader = LogLoader(controller)
+    for log_file in log_files:
+        loader.load_file(log_file)
+    expected_done = controller.parse_dump(loader.last_datetime)
+    expected_live = controller.parse_flush()
+
+    # A new log file each run, the journal gets a snapshot then changes
+    checkpoint = EventCheckpoint(str(tmp_path / 'events.journal'))
+    done_events = []
+    for run_no in range(1, len(log_files) + 1):
+        done, live_events = _run(checkpoint, log_files[:run_no])
+        done_events.extend(done)
+
+    assert len(expected_done) > 0
+    assert _dicts(done_events) == _dicts(expected_done)
+    assert _dicts(live_events) == _dicts(expected_live)
+
+
+def test_torn_write_is_ignored(tmp_path):
+    log_files = _log_files(tmp_path, count=2)
+    journal_file = str(tmp_path / 'events.journal')
+
+    _run(EventCheckpoint(journal_file), log_files[:1])
+    last_datetime, controller = EventCheckpoint(journal_file).load()
+
+    # Half a record, as if the last save died part way through
+    with open(journal_file, 'ab') as file_handle:
+        file_handle.write(b'\x00\x00\x01\x00\x12\x34')
+
+    torn_datetime, torn_controller = EventCheckpoint(journal_file).load()
+    assert torn_datetime == last_datetime
+    assert torn_controller.dump_state() == controller.dump_state()
+
+    # And the next save carries on past it
+    _run(EventCheckpoint(journal_file), log_files)
+    assert EventCheckpoint(journal_file).load()[0] > last_datetime
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""The event daemon against a raw plex log in a temporary directory."""
+
+import os
+import asyncio
+
+from plex.daemon import EventDaemon, PLEX_LOG_NAME
+from plex.util import config_load
+
+
+_timeline_request = (
+    'Jul 03, 2013 02:{0:02d}:{1:02d}:000 [4600] DEBUG - Request:'
+    ' GET /:/timeline?ratingKey=1234&key=%2Flibrary%2Fmetadata%2F1234'
+    '&state={2}&time={3}&duration=3600000'
+    '&X-Plex-Client-Identifier=abc&X-Plex-Device-Name=TV'
+    '&X-Plex-Product=Plex%20Web [192.168.1.10:40000] Linux\n')
+
+
+def _daemon(tmp_path, **kwargs):
+    plex_log_dir = tmp_path / 'plex'
+    plex_log_dir.mkdir()
+    (tmp_path / 'logs').mkdir()
+
+    config_file = os.path.join('logs', 'config.cfg')
+    config = config_load(config_file)
+    config['plex_log_dir'] = str(plex_log_dir)
+    return EventDaemon(config_file, config, **kwargs), plex_log_dir
+
+
+def test_idle_flush_emits_last_event(tmp_path, monkeypatch, timeout=10.0):
+    """A single play, ended by a stop line, on an otherwise quiet server has
+    to come out of the daemon once it's idle."""
+    monkeypatch.chdir(tmp_path)
+    daemon, plex_log_dir = _daemon(
+        tmp_path, live_interval=0.05, poll_interval=0.05, idle_flush=0.2)
+
+    with open(str(plex_log_dir / PLEX_LOG_NAME), 'wt') as log:
+        for line_no in range(5):
+            log.write(_timeline_request.format(
+                13, line_no * 10, 'playing', line_no * 10000))
+        log.write(_timeline_request.format(14, 0, 'stopped', 50000))
+
+    done = []
+
+    def subscriber(kind, event):
+        if kind == 'done':
+            done.append(event)
+            daemon.stop()
+
+    daemon.events.subscribe(subscriber)
+
+    async def run():
+        asyncio.get_event_loop().call_later(timeout, daemon.stop)
+        await daemon.run()
+
+    asyncio.run(run())
+
+    assert len(done) == 1
+    assert done[0].stopped is True
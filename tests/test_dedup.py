@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""LineIndex, the dedup of lines plex-log-saver reads again."""
+
+from plex.dedup import LineIndex
+
+
+def _line(second, path='/:/timeline', file_name='Plex Media Server.log',
+        line_no=1):
+    return {
+        'datetime': (2013, 7, 1, 12, 0, second, 0),
+        'file_name': file_name,
+        'file_line_no': line_no,
+        'url_path': path,
+        }
+
+
+def test_read_again_is_not_new(tmp_path):
+    index_file = str(tmp_path / 'lines.index')
+    lines = [_line(second, line_no=second) for second in range(10)]
+
+    index = LineIndex()
+    assert all(index.add(line) for line in lines)
+    index.save(index_file)
+
+    # The next run, plex rotated the log, so the lines have another name
+    loaded = LineIndex()
+    assert loaded.load(index_file)
+    assert len(loaded) == len(lines)
+    assert not any(
+        loaded.add(dict(line, file_name='Plex Media Server.1.log'))
+        for line in lines)
+    assert loaded.add(_line(10))
+
+
+def test_identical_lines_are_counted():
+    index = LineIndex()
+    assert index.add(_line(1))
+    assert index.add(_line(1))
+
+    # Read again, with one more copy than before
+    index.seen.clear()
+    assert not index.add(_line(1))
+    assert not index.add(_line(1))
+    assert index.add(_line(1))
+
+
+def test_older_than_window_is_not_new():
+    index = LineIndex(window=1)
+    assert index.add({'datetime': (2013, 7, 1, 12, 0, 0, 0)})
+    assert index.add({'datetime': (2013, 7, 1, 14, 0, 0, 0)})
+    assert not index.add({'datetime': (2013, 7, 1, 12, 30, 0, 0)})
+    assert index.floor() == (2013, 7, 1, 13, 0, 0, 0)
+
+    index.expire()
+    assert len(index) == 1
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""The table driven event_categorize and the single pass session_info
+decoder, against the code they replaced."""
+
+from plex.event import event_categorize, decode_content_session_info
+from plex.fixtures import (
+    generate_event_lines, reference_event_categorize,
+    reference_decode_content_session_info)
+
+
+def _session_contents(lines):
+    return [
+        line['content'] for line in lines
+        if 'content' in line and line['content'].startswith('Client [')]
+
+
+def test_event_categorize_matches_reference():
+    lines = generate_event_lines(20000)
+    for line in lines:
+        if 'content' in line and line['content'].startswith('Client ['):
+            decode_content_session_info(line)
+
+    lines.extend([
+        {'url_path': '/video/:/transcode/session/abc/def/1.ts',
+            'request_ip': '10.0.0.1', 'url_query': {'session': 'x'}},
+        {'url_path': '/video/:/transcode/universal/session/a/b/c/1.ts',
+            'request_ip': '10.0.0.1', 'url_query': {}},
+        {'url_path': '/video/:/transcode/segmented/session/a/b/c/1.ts',
+            'url_query': {'ratingKey': '12'}},
+        {'url_path': '/video/:/transcode/universal/start.m3u8',
+            'request_ip': '10.0.0.2', 'url_query': {
+                'key': '/library/metadata/12'}},
+        {'url_path': '/:/timeline', 'request_ip': '10.0.0.3',
+            'url_query': {'X-Plex-Device-Name': 'TV'}},
+        {'request_ip': '10.0.0.4', 'url_query': {'ratingKey': '7'},
+            'session_info': {'session': 'abc', 'key': '/library/metadata/7'}},
+        {'session_info': {'session': 'abc'}, 'url_query': {'key': 'a/b'}},
+        {},
+        ])
+    for line in lines:
+        assert event_categorize(line) == reference_event_categorize(line), (
+            line)
+
+
+def test_session_info_matches_reference():
+    contents = _session_contents(generate_event_lines(20000))
+    contents.extend([
+        'Client [abc] reporting timeline state stopped, progress of 0/0ms',
+        'Client [abc] for guid=, ratingKey=12 url=http://a/b,c,'
+        ' key=/library/metadata/12, containerKey=, metadataId=',
+        'Client [] reporting',
+        'Not a client line, key=1, url=2,',
+        'Client [abc] reporting timeline state playing, progress of 1/2ms'
+        ' for guid=, ratingKey=12 url=, key=/library/metadata/12,'
+        ' containerKey=, metadataId=',
+        ])
+
+    for content in contents:
+        expected = {'content': content}
+        reference_decode_content_session_info(expected)
+        got = {'content': content}
+        decode_content_session_info(got)
+        assert got == expected, content
+
+
+def test_session_info_ignores_keys_in_guid_and_url():
+    # Where the regexes were wrong on purpose, they'd take the ratingKey and
+    # key out of the guid and url.
+    for content, expected in (
+            ('Client [abc] reporting timeline state playing, progress of'
+             ' 1/2ms for guid=com.plexapp.agents.x://1?ratingKey=5,'
+             ' ratingKey=12 url=http://h/a?key=9, key=/library/metadata/12,'
+             ' containerKey=, metadataId=', {
+                'session': 'abc', 'time': '1', 'total': '2',
+                'guid': 'com.plexapp.agents.x://1?ratingKey=5',
+                'ratingKey': '12', 'url': 'http://h/a?key=9',
+                'key': '/library/metadata/12', 'containerKey': '',
+                'metadataId': ''}),
+            ('Client [abc] for guid=x?ratingKey=5, ratingKey=12'
+             ' url=http://h/a?key=9, key=/library/metadata/12,', {
+                'session': 'abc', 'guid': 'x?ratingKey=5',
+                'ratingKey': '12', 'url': 'http://h/a?key=9',
+                'key': '/library/metadata/12'}),
+            ):
+        got = {'content': content}
+        decode_content_session_info(got)
+        assert got.get('session_info') == expected
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""LibraryIndex syncs, against the mock server."""
+
+from plex.library import LibraryIndex
+from plex.media import PlexServerConnection
+from plex.mockserver import MockPlexServer
+
+
+def test_refresh_incremental_and_full(tmp_path):
+    """An incremental sync only counts what changed, and deletions go with
+    the periodic full sync."""
+    now = [0.0]
+    with MockPlexServer() as server:
+        library = server.library
+        conn = PlexServerConnection(*server.address)
+        index = LibraryIndex(conn, clock=lambda: now[0])
+
+        count = index.refresh(conn, 60, 3600)
+        assert count == len(index) > 0
+
+        changed = sorted(library.items)[5]
+        deleted = sorted(library.items)[0]
+        library.update(changed, title='Changed')
+        del library.items[deleted]
+
+        now[0] = 30
+        assert index.refresh(conn, 60, 3600) is None
+
+        now[0] = 120
+        assert index.refresh(conn, 60, 3600) == 1
+        assert index.get(changed).title == 'Changed'
+        assert deleted in index
+
+        now[0] = 240
+        assert index.refresh(conn, 60, 3600) == 0
+
+        now[0] = 3600
+        assert index.refresh(conn, 60, 3600) == count - 1
+        assert deleted not in index
+
+
+def test_save_and_load(tmp_path):
+    now = [1000.0]
+    index_file = str(tmp_path / 'library.index')
+    with MockPlexServer() as server:
+        conn = PlexServerConnection(*server.address)
+        index = LibraryIndex(conn, clock=lambda: now[0])
+        index.refresh(conn)
+        index.save(index_file)
+
+        loaded = LibraryIndex(conn, clock=lambda: now[0])
+        assert loaded.load(index_file)
+        assert sorted(
+            item.to_tuple() for item in loaded.items.values()) == sorted(
+            item.to_tuple() for item in index.items.values())
+        assert loaded.full_synced == index.full_synced == 1000.0
+        # Synced just now, so it isn't time yet
+        assert loaded.refresh(conn) is None
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""plex.librarydb against a fixture database, with a mock server as the
+fallback that should only be asked for what the database can't answer.
+Opening the database read only needs python 3."""
+
+import pytest
+
+from plex.library import LibraryIndex
+from plex.librarydb import PlexDatabaseConnection, media_connection
+from plex.media import MediaDocument, plex_media_object_batch
+from plex.mockserver import MockPlexServer
+from plex.fixtures import generate_library_db
+from plex.util import config_load
+
+
+@pytest.fixture
+def database(tmp_path):
+    """(connection, mock server) for a fixture database."""
+    db_file = str(tmp_path / 'library.db')
+    generate_library_db(db_file, movies=50, shows=3, episodes=20)
+
+    with MockPlexServer() as server:
+        config = config_load(str(tmp_path / 'config.cfg'), no_save=True)
+        config['media_source'] = 'database'
+        config['plex_database_file'] = db_file
+        config['plex_server_host'], config['plex_server_port'] = (
+            server.address)
+
+        conn = media_connection(config)
+        yield conn, server
+        conn.close()
+
+
+def _element_tuple(element):
+    return (element.tag, element.attrib, element.media, element.genres)
+
+
+def test_no_server_check_in_database_mode(database):
+    conn, server = database
+    assert isinstance(conn, PlexDatabaseConnection)
+    assert server.requests == 0
+
+    # What the database doesn't have goes to the server, which is checked
+    # first.
+    conn.fetch('servers')
+    assert server.requests == 2
+    assert conn.fallback.enabled
+
+
+def test_elements_match_xml(database):
+    conn, server = database
+    for path in (
+            'library/sections/1/all?type=1',
+            'library/sections/2/all?type=4&updatedAt>>=4050',
+            'library/metadata/22,20,10,99'):
+        direct = conn.fetch_elements(path)
+        parsed = MediaDocument(conn.fetch(path)).elements
+        assert len(direct) > 0
+        assert list(map(_element_tuple, direct)) == list(
+            map(_element_tuple, parsed))
+    assert server.requests == 0
+
+
+def test_metadata_fields(database):
+    conn, server = database
+    elements = conn.fetch_elements('library/metadata/22,20,10,99')
+    attributes = dict(
+        (element['ratingKey'], element.attrib) for element in elements)
+
+    assert [element['ratingKey'] for element in elements] == [
+        '22', '20', '10']
+    for key, name, value in (
+            ('22', 'updatedAt', '120'),
+            ('22', 'grandparentRatingKey', '20'),
+            ('22', 'originallyAvailableAt', '2001-01-01'),
+            ('20', 'type', 'show'),
+            ('10', 'summary', 's & <b>'),
+            ('10', 'updatedAt', '1577836800'),
+            ('10', 'originallyAvailableAt', '1999-05-01')):
+        assert attributes[key].get(name) == value, (key, name)
+
+    # Genres in taggings order, the tag that isn't a genre left out
+    assert elements[2].genres == ['Drama', 'War']
+    assert elements[2].media[0][1][0].get('file') == '/m/film.mkv'
+
+
+def test_media_objects_and_sync(database):
+    conn, server = database
+    media_objects = plex_media_object_batch(conn, [22, 10, 99])
+    assert sorted(media_objects) == ['10', '22']
+    # The show wasn't asked for, so there's nothing to take genres from
+    assert media_objects['22'].genres is None
+    assert media_objects['10'].parts == ['1']
+
+    index = LibraryIndex()
+    index.sync(conn, full=True)
+    assert index.get(22).genres == ('Drama',)
+    assert index.get(10).genres == ('Drama', 'War')
+    assert server.requests == 0
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""The one pass media parser, against what BeautifulSoup gave, and
+PlexServerConnection's per key metadata cache, against the mock server."""
+
+import warnings
+
+import pytest
+
+from plex.cache import MetadataCache
+from plex.media import (
+    MediaDocument, PlexServerConnection, plex_media_object_batch,
+    split_metadata)
+from plex.mockserver import MockPlexServer
+from plex.fixtures import (
+    generate_media_xml, reference_soup_media, media_records)
+
+
+@pytest.mark.parametrize('count', [20, 200])
+def test_media_document_matches_soup(count):
+    pytest.importorskip('bs4')
+    # Like plex.media used to, without lxml it's html.parser anyway
+    warnings.filterwarnings('ignore', module='bs4')
+    warnings.filterwarnings('ignore', message='.*XML document')
+
+    keys, xml = generate_media_xml(count)
+    assert media_records(xml, keys[:20]) == reference_soup_media(
+        xml, keys[:20])
+
+
+def _element_tuples(elements):
+    return [
+        (element.tag, element.attrib, element.media, element.genres)
+        for element in elements]
+
+
+def test_split_metadata_matches_parsing_each_item():
+    keys, xml = generate_media_xml(20)
+    split = split_metadata(xml)
+    assert sorted(split) == sorted(
+        int(element['ratingKey']) for element in MediaDocument(xml).elements)
+    for key, (key_xml, updated_at, elements) in split.items():
+        assert _element_tuples(elements) == _element_tuples(
+            MediaDocument(key_xml).elements)
+        if updated_at is not None:
+            assert updated_at == int(elements[0]['updatedAt'])
+
+
+def _video_keys(library):
+    return sorted(
+        key for key, item in library.items.items() if item.tag == 'Video')
+
+
+@pytest.mark.parametrize('batch_size,workers', [(20, 1), (100, 8)])
+def test_batch_gets_every_key(batch_size, workers):
+    with MockPlexServer() as server:
+        keys = _video_keys(server.library)
+        conn = PlexServerConnection(*server.address)
+        media_objects = plex_media_object_batch(
+            conn, keys, batch_size=batch_size, workers=workers)
+        assert sorted(map(int, media_objects)) == keys
+        batches = (len(keys) + batch_size - 1) // batch_size
+        # And the connection check
+        assert server.requests == batches + 1
+
+
+def test_metadata_cached_per_key(tmp_path):
+    """Cached per key, so batching them differently, or asking for some
+    more, only fetches what's new, and a changed item isn't taken from the
+    cache."""
+    cache_file = str(tmp_path / 'metadata.db')
+    with MockPlexServer() as server:
+        library = server.library
+        keys = _video_keys(library)
+        extra = sorted(
+            key for key, item in library.items.items()
+            if item.tag != 'Video')[:5]
+
+        with MetadataCache(cache_file) as cache:
+            conn = PlexServerConnection(*server.address, cache=cache)
+            plex_media_object_batch(conn, keys, batch_size=100, workers=1)
+
+        with MetadataCache(cache_file) as cache:
+            conn = PlexServerConnection(*server.address, cache=cache)
+            before = server.requests
+            media_objects = plex_media_object_batch(
+                conn, keys, batch_size=37, workers=1)
+            assert len(media_objects) == len(keys)
+            assert server.requests == before
+            # From the cache's xml, parsed the once
+            elements = dict(conn.element_cache)
+            plex_media_object_batch(conn, keys, batch_size=37, workers=1)
+            assert all(
+                conn.element_cache[key][1] is elements[key][1]
+                for key in keys)
+
+            conn.fetch_metadata_many(keys + extra, 37, 1)
+            assert server.requests == before + 1
+
+            key = keys[0]
+            library.update(key, title='Changed')
+            updated_at = int(library.items[key].attrib['updatedAt'])
+            conn.metadata_cache.clear()
+            xml = conn.fetch_metadata_many(
+                [key], updated_at={key: updated_at})[key]
+            assert 'Changed' in xml
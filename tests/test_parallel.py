@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""ShardedLogLoader against a single LogLoader, and shards that fail."""
+
+import pytest
+
+from plex.event import EventParserController, LogLoader
+from plex.parallel import ShardedLogLoader, ShardException
+from plex.fixtures import generate_event_lines, write_log_file
+
+
+def _event_ids(events):
+    return sorted(event.event_id for event in events)
+
+
+def test_sharded_matches_single(tmp_path):
+    log_file = str(tmp_path / 'plex-media-server.log')
+    write_log_file(generate_event_lines(20000), log_file)
+
+    controller = EventParserController(10)
+    loader = LogLoader(controller)
+    loader.load_file(log_file)
+    controller.parse_finish()
+    expected = (
+        controller.parse_dump(loader.last_datetime) +
+        controller.parse_flush())
+
+    for shards in (1, 3):
+        loader = ShardedLogLoader(shards, buffer_size=10)
+        loader.load_file(log_file)
+        done_events, live_events = loader.finish()
+        assert _event_ids(done_events + live_events) == _event_ids(expected)
+
+
+def test_malformed_line_raises(tmp_path):
+    # A line a shard can't decode has to fail, not hang finish()
+    bad_file = str(tmp_path / 'plex-media-server-bad.log')
+    write_log_file(generate_event_lines(1000), bad_file)
+    with open(bad_file, 'at') as file_handle:
+        file_handle.write('{"request_ip": "192.168.1.10", broken\n')
+
+    loader = ShardedLogLoader(2, buffer_size=10)
+    loader.load_file(bad_file)
+    with pytest.raises(ShardException):
+        loader.finish()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""IngestFilter's deny, sample and compact rules."""
+
+from plex.parser import IngestFilter
+from plex.util import default_ingest_filter, ReorderBuffer
+
+
+def _poll(second, ip='10.0.0.1', path='/:/timeline', state='playing',
+        minute=0):
+    return {
+        'datetime': (2013, 7, 1, 12, minute, second, 0),
+        'request_ip': ip,
+        'url_path': path,
+        'url_query': {'state': state, 'time': str(second * 1000)},
+        }
+
+
+def test_deny_paths():
+    ingest_filter = IngestFilter(default_ingest_filter())
+    assert ingest_filter.denied(
+        {'url_path': '/library/metadata/12/thumb/1372067395'})
+    assert not ingest_filter.denied({'url_path': '/:/timeline'})
+    assert not ingest_filter.denied({'content': 'not a request'})
+
+
+def test_sample_one_in_every_n_per_glob():
+    ingest_filter = IngestFilter({
+        'sample_paths': {'/a/*': 3, '/b': 2}})
+    kept = [
+        (path, ingest_filter.sample({'url_path': path}))
+        for path in ['/a/1', '/b', '/a/2', '/b', '/a/3', '/a/4', '/c']]
+    assert kept == [
+        ('/a/1', True), ('/b', True), ('/a/2', False), ('/b', False),
+        ('/a/3', False), ('/a/4', True), ('/c', True)]
+
+
+def test_allow_is_deny_then_sample():
+    ingest_filter = IngestFilter({
+        'deny_paths': ['/a/x'], 'sample_paths': {'/a/*': 2}})
+    results = [
+        ingest_filter.allow({'url_path': path})
+        for path in ['/a/x', '/a/1', '/a/2', '/a/3']]
+    # The denied line doesn't count towards the sampling
+    assert results == [False, True, False, True]
+
+
+def _compact_all(ingest_filter, lines):
+    out = []
+    for line_body in lines:
+        out.extend(ingest_filter.compact(line_body))
+    return out + ingest_filter.flush()
+
+
+def test_compact_runs():
+    ingest_filter = IngestFilter(default_ingest_filter())
+    lines = [_poll(second) for second in range(0, 50, 5)]
+    lines.append(_poll(50, state='paused'))
+
+    out = _compact_all(ingest_filter, lines)
+    assert [line['datetime'][5] for line in out] == [0, 45, 50]
+    assert 'poll_count' not in out[0]
+    assert out[1]['poll_count'] == 10
+    assert out[1]['poll_first'] == lines[0]['datetime']
+    assert out[2]['url_query']['state'] == 'paused'
+
+
+def test_compact_span_and_idle():
+    ingest_filter = IngestFilter(dict(
+        default_ingest_filter(), compact_span=20, compact_idle=10))
+    lines = [_poll(second) for second in range(0, 30, 5)]
+    # Another client, long after the first went quiet
+    lines.append(_poll(50, ip='10.0.0.2', path='/other'))
+
+    out = _compact_all(ingest_filter, lines)
+    # A new run at 25s, more than compact_span after the first at 0s, the
+    # idle run is written out before the other client's line.
+    assert [
+        (line['datetime'][5], line.get('poll_count')) for line in out] == [
+        (0, None), (20, 5), (25, None), (50, None)]
+
+
+def _compact_reorder(ingest_filter, lines, lateness):
+    reorder = ReorderBuffer(lateness)
+    out = []
+    for line_body in lines:
+        for line in ingest_filter.compact(line_body):
+            out.extend(reorder.push(line, line['datetime']) or [])
+    for line in ingest_filter.flush():
+        out.extend(reorder.push(line, line['datetime']) or [])
+    return out + reorder.flush(), reorder.late
+
+
+def test_compact_idle_longer_than_lateness():
+    rules = dict(default_ingest_filter(), compact_idle=120)
+    # One client polls for a while and stops, another keeps requesting
+    # until the first one's run is written out, 120s after its last poll.
+    lines = [_poll(second) for second in range(0, 30, 10)]
+    lines.extend(
+        _poll(second % 60, ip='10.0.0.2', path='/other',
+            minute=second // 60)
+        for second in range(30, 180, 15))
+
+    # log_reorder_lateness alone is too little
+    out, late = _compact_reorder(IngestFilter(rules), lines, 60)
+    assert late == 1
+
+    ingest_filter = IngestFilter(rules)
+    assert ingest_filter.reorder_lateness(60) == 120
+    out, late = _compact_reorder(
+        ingest_filter, lines, ingest_filter.reorder_lateness(60))
+    assert late == 0
+    assert len(out) == 2 + 10
+    assert out[1]['poll_count'] == 3
+    datetimes = [line['datetime'] for line in out]
+    assert datetimes == sorted(datetimes)
+
+
+def test_reorder_lateness_without_compacting():
+    ingest_filter = IngestFilter(dict(
+        default_ingest_filter(), compact_paths=[], compact_idle=120))
+    assert ingest_filter.reorder_lateness(60) == 60
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""EventStreamServer's client queues."""
+
+import asyncio
+
+from plex.daemon import EventSink
+from plex.stream import EventStreamServer
+
+
+class _Event(object):
+    def __init__(self, event_id):
+        self.event_id = event_id
+
+    def to_dict(self):
+        return {'event_id': self.event_id}
+
+
+def _server(tmp_path, queue_size=2):
+    events = EventSink(str(tmp_path / 'events.journal'))
+    return events, EventStreamServer(events, queue_size=queue_size)
+
+
+def test_slow_client_is_dropped(tmp_path):
+    async def run():
+        events, server = _server(tmp_path)
+        await server.start()
+        queue = server._subscribe()
+        for event_id in range(3):
+            server.publish('done', _Event(event_id))
+        await server.close()
+        return server, queue
+
+    server, queue = asyncio.run(run())
+    assert len(server.clients) == 0
+    assert queue.get_nowait() == ('done', {'event_id': 1})
+    assert queue.get_nowait() is None
+
+
+def test_close_with_full_client_queue(tmp_path):
+    async def run():
+        events, server = _server(tmp_path)
+        await server.start()
+        queues = [server._subscribe() for i in range(2)]
+        for event_id in range(2):
+            server.publish('live', _Event(event_id))
+        assert all(queue.full() for queue in queues)
+        await server.close()
+        return events, server, queues
+
+    events, server, queues = asyncio.run(run())
+    assert len(server.clients) == 0
+    assert len(events.subscribers) == 0
+    for queue in queues:
+        # The oldest event makes room for the end of the stream
+        assert queue.get_nowait() == ('live', {'event_id': 1})
+        assert queue.get_nowait() is None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# -*- python -*-
+"""ReorderBuffer."""
+
+from plex.util import ReorderBuffer
+
+
+def _date(second, millis=0):
+    return (2013, 7, 1, 12, 0, second, millis)
+
+
+def _push_all(buffer, items):
+    released = []
+    for item, date in items:
+        out = buffer.push(item, date)
+        if out is not None:
+            released.extend(out)
+    return released + buffer.flush()
+
+
+def test_puts_late_lines_in_order():
+    buffer = ReorderBuffer(5)
+    items = [('a', _date(0)), ('c', _date(3)), ('b', _date(1)),
+        ('e', _date(10)), ('d', _date(6)), ('f', _date(20))]
+    assert _push_all(buffer, items) == ['a', 'b', 'c', 'd', 'e', 'f']
+    assert buffer.late == 0
+
+
+def test_equal_datetimes_keep_their_order():
+    buffer = ReorderBuffer(1)
+    items = [(name, _date(0)) for name in 'abcde']
+    assert _push_all(buffer, items) == list('abcde')
+
+
+def test_too_late_is_dropped_and_counted():
+    buffer = ReorderBuffer(2)
+    assert buffer.push('a', _date(0)) == []
+    assert buffer.push('b', _date(10)) == ['a']
+    # Newer than what's out, but already past the watermark
+    assert buffer.push('c', _date(1, 500)) == ['c']
+    # Older than what's already out
+    assert buffer.push('late', _date(1)) is None
+    assert buffer.late == 1
+    assert buffer.flush() == ['b']
+
+
+def test_watermark_and_max_size():
+    buffer = ReorderBuffer(60, max_size=2, watermark=_date(5))
+    assert buffer.push('old', _date(4)) is None
+    assert buffer.push('a', _date(6)) == []
+    assert buffer.push('b', _date(7)) == []
+    assert buffer.push('c', _date(8)) == ['a']
+    assert len(buffer) == 2
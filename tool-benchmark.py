@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+"""
+Micro benchmarks for the hot paths, run from the repository root:
+
+    python tool-benchmark.py [name ...]
+
+Without any names every benchmark is run. The log lines are generated (once,
+and shared by every benchmark), so the numbers are only useful to compare one
+version of the code with another. Whether the code is right is up to the
+tests, python -m pytest tests.
+"""
+
+import os
+import sys
+import random
+import timeit
+import shutil
+import tempfile
+import warnings
+import multiprocessing
+
+from plex.event import (
+    event_categorize, decode_content_session_info, EventParserController,
+    LogLoader)
+from plex.parallel import ShardedLogLoader
+from plex.media import (
+    MediaDocument, MediaRecord, PlexServerConnection, plex_media_object_batch)
+from plex.mockserver import MockPlexServer
+from plex.cache import MetadataCache
+from plex.fixtures import (
+    generate_event_lines, reference_event_categorize,
+    reference_decode_content_session_info, write_log_file,
+    generate_media_xml, reference_soup_media, media_records,
+    generate_library_db)
+
+
+def _decode_lines(lines):
+    """lines with their session_info decoded, as LogLoader passes them on,
+    lines itself is left as it is for the other benchmarks."""
+    decoded = []
+    for line in lines:
+        if 'content' in line and line['content'].startswith('Client ['):
+            line = dict(line)
+            decode_content_session_info(line)
+        decoded.append(line)
+    return decoded
+
+
+def _best_of(run, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = timeit.default_timer()
+        run()
+        seconds = timeit.default_timer() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def _report(name, count, seconds):
+    print('{0:<24} {1:>9} lines {2:>9.3f}s {3:>9.3f}us/line'.format(
+        name, count, seconds, seconds / count * 1000000))
+
+
+def bench_categorize(lines):
+    lines = _decode_lines(lines)
+
+    for name, categorize in (
+            ('event_categorize (old)', reference_event_categorize),
+            ('event_categorize', event_categorize)):
+
+        def run():
+            for line in lines:
+                categorize(line)
+
+        _report(name, len(lines), _best_of(run))
+
+
+def bench_controller(lines):
+    lines = _decode_lines(lines)
+
+    def run():
+        controller = EventParserController(10)
+        for line in lines:
+            controller.parse_line(line)
+        controller.parse_finish()
+
+    _report('parse_line', len(lines), _best_of(run))
+
+
+def bench_session_info(lines):
+    contents = [
+        line['content'] for line in lines
+        if 'content' in line and line['content'].startswith('Client [')]
+
+    for name, decode in (
+            ('session_info (regexes)', reference_decode_content_session_info),
+            ('session_info', decode_content_session_info)):
+
+        def run():
+            for content in contents:
+                decode({'content': content})
+
+        _report(name, len(contents), _best_of(run))
+
+
+def bench_parallel(lines):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        log_file = os.path.join(temp_dir, 'plex-media-server.log')
+        write_log_file(lines, log_file)
+
+        def run_single():
+            controller = EventParserController(10)
+            loader = LogLoader(controller)
+            loader.load_file(log_file)
+            controller.parse_finish()
+            done_events = controller.parse_dump(loader.last_datetime)
+            return done_events + controller.parse_flush()
+
+        def run_sharded(shards):
+            loader = ShardedLogLoader(shards, buffer_size=10)
+            loader.load_file(log_file)
+            done_events, live_events = loader.finish()
+            return done_events + live_events
+
+        events = []
+        seconds = _best_of(lambda: events.append(run_single()), 3)
+        _report('LogLoader', len(lines), seconds)
+        print('{0:<24} {1:>9} events'.format('', len(events[-1])))
+
+        for shards in sorted(set([1, 2, multiprocessing.cpu_count()])):
+            seconds = _best_of(
+                lambda: events.append(run_sharded(shards)), 3)
+            _report('ShardedLogLoader({0})'.format(shards), len(lines),
+                seconds)
+            print('{0:<24} {1:>9} events'.format('', len(events[-1])))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def bench_library(lines):
+    """A full LibraryIndex sync against the mock server, then an
+    incremental one with a single change."""
+    from plex.library import LibraryIndex
+
+    with MockPlexServer() as server:
+        conn = PlexServerConnection(*server.address)
+        index = LibraryIndex(conn)
+
+        start = timeit.default_timer()
+        count = index.sync(conn, full=True)
+        _report('library full sync', count, timeit.default_timer() - start)
+
+        server.library.update(sorted(server.library.items)[5], title='New')
+        start = timeit.default_timer()
+        index.sync(conn)
+        _report('library incremental', 1, timeit.default_timer() - start)
+
+
+def bench_librarydb(lines):
+    """A full LibraryIndex sync from a fixture library database, straight
+    from the rows and through the xml."""
+    # Imported here, opening the database read only needs python 3
+    from plex.library import LibraryIndex
+    from plex.librarydb import PlexDatabaseConnection
+
+    class XMLConnection(object):
+        """Listings through the xml, as they were before fetch_elements."""
+        def __init__(self, conn):
+            self.conn = conn
+
+        def fetch(self, path, cached=True):
+            return self.conn.fetch(path, cached)
+
+        def fetch_elements(self, path, cached=True):
+            return MediaDocument(self.conn.fetch(path, cached)).elements
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db_file = os.path.join(temp_dir, 'library.db')
+        count = generate_library_db(db_file)
+        conn = PlexDatabaseConnection(db_file)
+
+        for name, source in (('xml', XMLConnection(conn)), ('rows', conn)):
+            index = LibraryIndex()
+            _report(
+                'librarydb sync ({0})'.format(name), count,
+                _best_of(lambda: index.sync(source, full=True), 3))
+        conn.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def bench_media(lines):
+    try:
+        import bs4
+        # Like plex.media used to, without lxml it's html.parser anyway
+        warnings.filterwarnings('ignore', module='bs4')
+        warnings.filterwarnings('ignore', message='.*XML document')
+    except ImportError:
+        bs4 = None
+
+    for name, count in (('batch', 20), ('section', 2000)):
+        keys, xml = generate_media_xml(count)
+
+        if bs4 is not None:
+            # A whole section is only ever walked once, no finds
+            if name == 'section':
+                def run_soup():
+                    soup = bs4.BeautifulSoup(xml, 'html.parser')
+                    for video_tag in soup.find_all('video'):
+                        video_tag.get('contentrating')
+            else:
+                def run_soup():
+                    reference_soup_media(xml, keys)
+
+            _report('media {0} (soup)'.format(name), count,
+                _best_of(run_soup, 3))
+
+        if name == 'section':
+            def run():
+                for element in MediaDocument(xml).elements:
+                    element.get('contentRating')
+        else:
+            def run():
+                media_records(xml, keys)
+
+        _report('media {0}'.format(name), count, _best_of(run, 3))
+
+    # The cost per key shouldn't grow with the size of a batch
+    for count in (100, 500):
+        keys, xml = generate_media_xml(count)
+        _report('media batch of {0}'.format(count), count,
+            _best_of(lambda: media_records(xml, keys), 3))
+
+
+def bench_media_server(lines, latency=0.005):
+    """Batch sizes, threads and the metadata cache, against the mock server
+    taking latency seconds per request."""
+    with MockPlexServer(latency=latency) as server:
+        keys = sorted(
+            key for key, item in server.library.items.items()
+            if item.tag == 'Video')
+
+        for batch_size in (20, 100):
+            for workers in (1, 8):
+                def run():
+                    conn = PlexServerConnection(*server.address)
+                    plex_media_object_batch(
+                        conn, keys, batch_size=batch_size, workers=workers)
+
+                _report(
+                    'server batch {0} x{1}'.format(batch_size, workers),
+                    len(keys), _best_of(run, 3))
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_file = os.path.join(temp_dir, 'metadata.db')
+            for name in ('cold', 'warm'):
+                with MetadataCache(cache_file) as cache:
+                    conn = PlexServerConnection(*server.address, cache=cache)
+                    _report(
+                        'server cache {0}'.format(name), len(keys),
+                        _best_of(lambda: plex_media_object_batch(
+                            conn, keys, batch_size=100, workers=1), 1))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+def bench_media_records(lines, count=20000):
+    rand = random.Random(1337)
+    genres = [('Drama',), ('Comedy', 'Drama'), ('Animation',)]
+    rows = [
+        (key, 'episode', 'Episode {0}'.format(key), rand.randint(0, 5),
+            rand.randint(20, 60) * 60000, 1000 + key // 100, key // 10,
+            rand.choice(genres), 1500000000 + key)
+        for key in range(count)]
+
+    _report('media records', count, _best_of(
+        lambda: [MediaRecord.from_tuple(row) for row in rows], 3))
+
+    try:
+        import tracemalloc
+    except ImportError:
+        return
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    records = [MediaRecord.from_tuple(row) for row in rows]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print('{0:<24} {1:>9} items {2:>9.3f}MB {3:>9.1f}B/item'.format(
+        'media records memory', len(records), size / 1048576.0,
+        size / float(len(records))))
+
+
+def bench_media_async(lines, latency=0.005, batch_size=20):
+    """AsyncPlexServerConnection against the mock server, every key asked
+    for twice at once."""
+    # Imported here, asyncio needs python 3
+    import asyncio
+    from plex.aiomedia import AsyncPlexServerConnection
+
+    with MockPlexServer(latency=latency) as server:
+        keys = sorted(
+            key for key, item in server.library.items.items()
+            if item.tag == 'Video')
+
+        async def run():
+            conn = AsyncPlexServerConnection(
+                *server.address, batch_size=batch_size)
+            try:
+                await asyncio.gather(
+                    *[conn.fetch_metadata(key) for key in keys + keys])
+            finally:
+                await conn.close()
+
+        start = timeit.default_timer()
+        asyncio.run(run())
+        seconds = timeit.default_timer() - start
+
+    _report('media async', len(keys) * 2, seconds)
+
+
+benchmarks = [
+    ('categorize', bench_categorize),
+    ('controller', bench_controller),
+    ('library', bench_library),
+    ('librarydb', bench_librarydb),
+    ('media', bench_media),
+    ('media_async', bench_media_async),
+    ('media_records', bench_media_records),
+    ('media_server', bench_media_server),
+    ('parallel', bench_parallel),
+    ('session_info', bench_session_info),
+    ]
+
+
+def main():
+    wanted = sys.argv[1:]
+    lines = generate_event_lines()
+    for name, benchmark in benchmarks:
+        if len(wanted) > 0 and name not in wanted:
+            continue
+        benchmark(lines)
+
+
+if __name__ == '__main__':
+    main()
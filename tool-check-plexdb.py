@@ -33,7 +33,7 @@ import plex.util
 import itertools
 from bs4 import BeautifulSoup
 from plex.lockfile import LockFile
-from plex.media import PlexServerConnection
+from plex.librarydb import media_connection
 from plex.util import (
     config_load, get_content_rating, get_content_rating_name, RATING_UNKNOWN)
 
@@ -45,8 +45,7 @@ def main():
     config_file = os.path.join('logs', 'config.cfg')
     config = config_load(config_file, no_save=True)
 
-    conn = PlexServerConnection(
-        config['plex_server_host'], config['plex_server_port'])
+    conn = media_connection(config)
 
     sections_page = conn.fetch('library/sections')
     sections_soup = BeautifulSoup(sections_page)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+"""
+Run a mock Plex Media Server (plex.mockserver) on its own, to point the
+reporter or tool-check-plexdb.py at without a real server.
+
+    python tool-mock-server.py [--host H] [--port N] [--movies N]
+                               [--shows N] [--latency S] [--error-rate R]
+                               [--seed N]
+"""
+
+import sys
+import logging
+import argparse
+
+from plex.mockserver import MockLibrary, MockPlexServer
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Serve a generated library like a Plex Media Server.')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=32400)
+    arg_parser.add_argument('--movies', type=int, default=200)
+    arg_parser.add_argument('--shows', type=int, default=20)
+    arg_parser.add_argument(
+        '--latency', type=float, default=0,
+        help='seconds to wait before answering each request')
+    arg_parser.add_argument(
+        '--error-rate', type=float, default=0,
+        help='fraction of requests that fail with a 500')
+    arg_parser.add_argument('--seed', type=int, default=1337)
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.DEBUG)
+
+    library = MockLibrary(
+        movies=args.movies, shows=args.shows, seed=args.seed)
+    server = MockPlexServer(
+        library, args.host, args.port, latency=args.latency,
+        error_rate=args.error_rate, seed=args.seed)
+
+    print('Serving {0} items on {1}:{2}'.format(
+        len(library.items), *server.address))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('Served {0} requests, {1} errors'.format(
+            server.requests, server.errors))
+
+
+if __name__ == '__main__':
+    main()
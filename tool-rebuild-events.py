@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+"""
+Rebuild every event from the saved logs, without touching the reporter's
+checkpoint. Lines are spread over one process per cpu, by client ip.
+
+    python tool-rebuild-events.py [shards]
+"""
+
+import os
+import sys
+import json
+import logging
+
+from glob import glob as file_glob
+
+from plex.lockfile import LockFile
+from plex.parallel import ShardedLogLoader
+from plex.util import config_load
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        filename='plex-rebuild-events.log',
+        level=logging.DEBUG)
+
+    if not os.path.isdir('logs'):
+        os.mkdir('logs')
+
+    config_file = os.path.join('logs', 'config.cfg')
+    config = config_load(config_file, no_save=True)
+
+    log_file_match = os.path.join('logs', config['log_file_match'])
+
+    shards = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    loader = ShardedLogLoader(shards, buffer_size=10)
+
+    with LockFile():
+        ## Saved logs are named by date, so sorting keeps them in order
+        for log_file in sorted(file_glob(log_file_match)):
+            loader.load_file(log_file)
+
+    done_events, live_events = loader.finish()
+
+    if len(done_events) > 0:
+        print("{0:#^80}".format("[ Done Events ]"))
+        for event in done_events:
+            print(json.dumps(event.to_dict(), sort_keys=True))
+
+    if len(live_events) > 0:
+        print("{0:#^80}".format("[ Live Events ]"))
+        for event in live_events:
+            print(json.dumps(event.to_dict(), sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+"""
+Replay saved logs into the event pipeline, for load testing and comparing
+changes to the controller on real history.
+
+    python tool-replay.py [--speed N] [--target loader|controller|daemon]
+                          [--limit N] [log files ...]
+
+Lines are paced by their recorded datetime, --speed 60 plays an hour of logs
+in a minute, --speed 0 (the default) goes as fast as possible. Without any
+log files, the saved logs matching log_file_match are replayed in order.
+
+Targets:
+    loader      LogLoader.load_line, what plex-reporter does.
+    controller  Straight into EventParserController.parse_line, no filtering.
+    daemon      The event daemon, through the queues to its saver and
+                EventSink, in a throw away directory. The saved logs are
+                parsed already, so its tailer and parser are left out.
+
+Reports throughput, how far behind schedule (or for --speed 0, how long)
+each line took as percentiles, and memory use.
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import array
+import shutil
+import timeit
+import argparse
+import tempfile
+
+from glob import glob as file_glob
+
+from plex.event import (
+    EventParserController, LogLoader, decode_content_session_info)
+from plex.util import config_load, datetime_to_millis
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+
+def read_event_lines(log_files):
+    for log_file in log_files:
+        open_cmd = gzip.open if log_file.endswith('.gz') else open
+        with open_cmd(log_file, 'rt') as file_handle:
+            for line in file_handle:
+                yield json.loads(line)
+
+
+class ControllerTarget(object):
+    def __init__(self):
+        self.controller = EventParserController(10)
+
+    def feed(self, event_line):
+        if ('content' in event_line and
+                event_line['content'].startswith('Client [')):
+            decode_content_session_info(event_line)
+        self.controller.parse_line(event_line)
+
+    def finish(self):
+        self.controller.parse_finish()
+        return len(self.controller.done_events)
+
+
+class LoaderTarget(object):
+    def __init__(self):
+        self.controller = EventParserController(10)
+        self.loader = LogLoader(self.controller)
+
+    def feed(self, event_line):
+        self.loader.load_line(event_line)
+
+    def finish(self):
+        self.loader.flush()
+        self.controller.parse_finish()
+        return len(self.controller.done_events)
+
+
+class DaemonTarget(object):
+    def __init__(self):
+        # Imported here, the daemon needs python 3
+        from plex.daemon import EventDaemon
+
+        ## The daemon keeps everything under logs/, a throw away one here
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+        os.mkdir('logs')
+
+        config_file = os.path.join('logs', 'config.cfg')
+        self.daemon = EventDaemon(config_file, config_load(config_file))
+        self.events = 0
+        self.daemon.events.subscribe(self._count)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._start())
+
+    def _count(self, kind, event):
+        if kind == 'done':
+            self.events += 1
+
+    async def _start(self):
+        daemon = self.daemon
+        self.saver_queue = asyncio.Queue(daemon.queue_size)
+        self.event_queue = asyncio.Queue(daemon.queue_size)
+        self.tasks = [
+            asyncio.ensure_future(daemon._save(self.saver_queue)),
+            asyncio.ensure_future(daemon._feed_events(self.event_queue)),
+            asyncio.ensure_future(daemon._periodic()),
+            ]
+
+    async def _put(self, line_body):
+        # As EventDaemon._parse() hands on a line
+        await self.saver_queue.put(line_body)
+        await self.event_queue.put(line_body)
+        # And the stages get to run before the next one
+        await asyncio.sleep(0)
+
+    def feed(self, event_line):
+        # As it comes out of the daemon's parser
+        event_line['datetime'] = tuple(event_line['datetime'])
+        self.loop.run_until_complete(self._put(event_line))
+
+    async def _stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.daemon._drain(
+            asyncio.Queue(), self.saver_queue, self.event_queue)
+
+    def finish(self):
+        """Stops the daemon like EventDaemon.run() does, the controller's
+        last lines are parsed first, as they are once the log goes quiet."""
+        try:
+            self.loop.run_until_complete(self._stop())
+            self.daemon.events.idle_flush()
+            self.daemon.events.emit_live()
+            self.daemon.saver.close()
+            self.daemon.events.checkpoint()
+        finally:
+            self.loop.close()
+            asyncio.set_event_loop(None)
+            os.chdir(self.cwd)
+            shutil.rmtree(self.temp_dir)
+        return self.events
+
+
+targets = {
+    'controller': ControllerTarget,
+    'loader': LoaderTarget,
+    'daemon': DaemonTarget,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on OS X, kilobytes elsewhere
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def replay(event_lines, target, speed=0, limit=None):
+    """Feeds event_lines to target, returns (lines, seconds, lags)."""
+    clock = timeit.default_timer
+    lags = array.array('d')
+    counter = 0
+
+    wall_start = clock()
+    log_start = None
+
+    for event_line in event_lines:
+        if limit is not None and counter >= limit:
+            break
+        counter += 1
+
+        if speed > 0:
+            log_time = datetime_to_millis(event_line['datetime']) / 1000.0
+            if log_start is None:
+                log_start = log_time
+            due = wall_start + (log_time - log_start) / speed
+            now = clock()
+            if due > now:
+                time.sleep(due - now)
+            target.feed(event_line)
+            lags.append(clock() - due)
+        else:
+            start = clock()
+            target.feed(event_line)
+            lags.append(clock() - start)
+
+    return counter, clock() - wall_start, lags
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Replay saved logs into the event pipeline.')
+    arg_parser.add_argument(
+        '--speed', type=float, default=0,
+        help='speed multiplier, 0 for as fast as possible')
+    arg_parser.add_argument(
+        '--target', choices=sorted(targets), default='loader')
+    arg_parser.add_argument(
+        '--limit', type=int, default=None, help='stop after this many lines')
+    arg_parser.add_argument('log_files', nargs='*')
+    args = arg_parser.parse_args()
+
+    log_files = args.log_files
+    if len(log_files) == 0:
+        config = config_load(os.path.join('logs', 'config.cfg'), no_save=True)
+        log_files = sorted(file_glob(
+            os.path.join('logs', config['log_file_match'])))
+    # The daemon target runs in a directory of its own
+    log_files = [os.path.abspath(log_file) for log_file in log_files]
+
+    target = targets[args.target]()
+    counter, seconds, lags = replay(
+        read_event_lines(log_files), target, args.speed, args.limit)
+    events = target.finish()
+
+    lags = sorted(lags)
+    print('Replayed {0} lines from {1} files into {2} in {3:.3f}s'.format(
+        counter, len(log_files), args.target, seconds))
+    print('  {0:.0f} lines/s, {1} done events'.format(
+        counter / seconds if seconds > 0 else 0, events))
+    print('  {0} p50 {1:.3f}ms p90 {2:.3f}ms p99 {3:.3f}ms '
+          'max {4:.3f}ms'.format(
+        'lag' if args.speed > 0 else 'per line',
+        percentile(lags, 0.5) * 1000, percentile(lags, 0.9) * 1000,
+        percentile(lags, 0.99) * 1000, percentile(lags, 1.0) * 1000))
+
+    max_rss = max_rss_kb()
+    if max_rss is not None:
+        print('  max rss {0} KB'.format(max_rss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -*- python -*-
+from __future__ import print_function
+
+__license__ = """
+
+The MIT License (MIT)
+Copyright (c) 2013 Jacob Smith <kloptops@gmail.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+"""
+Rebuild the events of a range of days from the saved logs, starting from
+the nearest day checkpoint plex-reporter saved before the first day, and
+replace them in the event store.
+
+    python tool-reprocess-events.py [--jobs N] FIRST_DAY [LAST_DAY]
+
+Days are YYYY-MM-DD. Without LAST_DAY everything from FIRST_DAY on is
+rebuilt. Every day checkpoint in the range lets another process rebuild the
+days after it in parallel.
+"""
+
+import os
+import json
+import logging
+import argparse
+
+from glob import glob as file_glob
+
+from plex.lockfile import LockFile
+from plex.parallel import reprocess_days
+from plex.store import EventStore
+from plex.util import config_load
+
+
+def parse_day(text):
+    try:
+        day = tuple(int(part) for part in text.split('-'))
+    except ValueError:
+        day = ()
+    if len(day) != 3:
+        raise argparse.ArgumentTypeError(
+            '{0!r} is not a YYYY-MM-DD day'.format(text))
+    return day
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        filename='plex-reprocess-events.log',
+        level=logging.DEBUG)
+
+    arg_parser = argparse.ArgumentParser(
+        description='Rebuild the events of a range of days.')
+    arg_parser.add_argument(
+        '--jobs', type=int, default=None,
+        help='processes to use, defaults to the cpu count')
+    arg_parser.add_argument('first_day', type=parse_day)
+    arg_parser.add_argument('last_day', type=parse_day, nargs='?')
+    args = arg_parser.parse_args()
+
+    config_file = os.path.join('logs', 'config.cfg')
+    checkpoint_dir = os.path.join('logs', 'checkpoints')
+    store_file = os.path.join('logs', 'events.db')
+
+    config = config_load(config_file, no_save=True)
+    log_file_match = os.path.join('logs', config['log_file_match'])
+
+    with LockFile():
+        start, done_events, live_events = reprocess_days(
+            checkpoint_dir, sorted(file_glob(log_file_match)),
+            args.first_day, args.last_day, args.jobs, buffer_size=10)
+
+        with EventStore(store_file) as store:
+            ## Events whose event_id changed would be left behind otherwise
+            deleted = store.delete_between(
+                (start or (1970, 1, 1)) + (0, 0, 0, 0),
+                (args.last_day or (9999, 12, 31)) + (23, 59, 59, 999))
+            store.upsert_events(done_events + live_events)
+
+    print('Rebuilt from {0}: {1} done events, {2} live events'
+          ' ({3} replaced)'.format(
+              'the start' if start is None else
+                  '{0:04d}-{1:02d}-{2:02d}'.format(*start),
+              len(done_events), len(live_events), deleted))
+
+    for event in done_events + live_events:
+        print(json.dumps(event.to_dict(), sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()